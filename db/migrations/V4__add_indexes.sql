@@ -0,0 +1,13 @@
+-- Индексы под запросы, которые выполняет приложение.
+-- Столбец count не входит ни в один индекс: частые обновления остатков (журнал записи остатков)
+-- остаются HOT-обновлениями и не перестраивают индексы.
+-- Поиск ячейки по координатам и выборка непустых ячеек идут по снимку склада в памяти (WarehouseState),
+-- в БД таких запросов нет, поэтому индексов под них тоже нет.
+
+-- Проверка внешнего ключа при удалении типа товара (ON DELETE SET NULL): ячейки с этим артикулом.
+-- Частичный: пустые ячейки (product_sku IS NULL) в индекс не попадают
+CREATE INDEX IF NOT EXISTS ix_cell_product_sku
+    ON cell (product_sku)
+    WHERE product_sku IS NOT NULL;
+
+ANALYZE cell;
@@ -1,3 +1,5 @@
+from src.server.startup import profile
+
 import logging
 import random
 import asyncio
@@ -7,8 +9,16 @@ import socket
 import src.logging.logger
 from src.models.product import Product
 from src.models.warehouse_on_db import Warehouse
-from src.server.server import server_handler
+from src.server.server import server_handler, PRODUCERS, TOPIC_PARAMETERS
+from src.server.metrics import process_request
+from src.server.broadcast import hub
+from src.server.codec import CODECS, select_subprotocol
+from src.server.solver_process import SolverProcess
 from src.parsers.json_parser import manager
+from src.parsers.db_parser import db
+from src.parsers.config_parser import config
+
+profile.mark("импорт модулей")
 
 
 def get_local_ip():
@@ -25,14 +35,41 @@ def get_local_ip():
 async def main():
     logging.debug("Инициализация сервера")
 
-    await manager.warehouse.solver.start()
+    remote = None
+    if config.solverprocess:
+        # Склад и решатель работают в отдельном процессе, здесь остаются только websocket и рассылка
+        remote = SolverProcess(config.solverhealthinterval, config.solverhealthtimeout,
+                               config.solvermaxrestarts, config.solverrestartwindow)
+        with profile.stage("запуск процесса решателя"):
+            await remote.start()
+        manager.remote = remote
+        for prefix in PRODUCERS:
+            hub.source(prefix, remote.producer, parameter=TOPIC_PARAMETERS.get(prefix))
+    else:
+        with profile.stage("подключение к БД"):
+            db.get()
+        with profile.stage("загрузка склада"):
+            solver = manager.warehouse.solver
+        with profile.stage("кластеризация"):
+            await solver.start()
     logging.debug("Алгоритм инициализирован")
 
-    server = await websockets.serve(server_handler, "0.0.0.0", 8765)
+    with profile.stage("запуск сервера"):
+        # Обычные HTTP GET /healthz и /metrics обслуживаются на том же порту до рукопожатия websocket
+        server = await websockets.serve(server_handler, "0.0.0.0", 8765,
+                                        subprotocols=list(CODECS), select_subprotocol=select_subprotocol,
+                                        process_request=process_request)
     local_ip = get_local_ip()
-    logging.info(f"Сервер запущен на ws://{local_ip}:8765")
+    logging.info(f"Сервер запущен на ws://{local_ip}:8765 (мониторинг: http://{local_ip}:8765/metrics)")
+    profile.report()
 
-    await server.wait_closed()
+    try:
+        await server.wait_closed()
+    finally:
+        if remote is not None:
+            await remote.stop()
+        if db.initialised:
+            await db.dispose()
 
 
 if __name__ == '__main__':
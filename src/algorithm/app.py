@@ -1,55 +1,56 @@
 import asyncio
-from queue import PriorityQueue as SyncPriorityQueue
-from asyncio import PriorityQueue
+import logging
+from collections.abc import Callable, Hashable
 import threading
 from datetime import datetime, timedelta
 import time
-from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from typing import Optional, TypeVar
 
 from src.algorithm.genetic import GeneticAlgorithm
-from src.algorithm.utils import run_async_thread, AsyncThreadLocker
+from src.algorithm.outbox import Outbox, RouteStream
+from src.algorithm.scheduler import RequestScheduler
+from src.algorithm.state import ShardedProductState, WaitingProduct
+from src.algorithm.utils import run_async_thread, TimeBudget, MeteredExecutor, Histogram
 from src.models.cell import Cell
 from src.models.warehouse_on_db import Warehouse
-from src.models.selection_request import SelectionRequest
+from src.models.reservations import ReservationLedger
+from src.models.selection_request import SelectionRequest, Priority
 from src.models.product import Product
 from src.algorithm.clusterizer import Clusterizer, Cluster
 from src.algorithm.size_enum import SizeType
-from src.algorithm.optimiser import adapter
+from src.algorithm.optimiser import adapter, route_length
 
 
-class ProductWrapper:
-    def __init__(self, count: int = 0, nearest_deadline: Optional[datetime] = None):
-        self.count = count
-        self.deadlines = SyncPriorityQueue()
-        if nearest_deadline is not None:
-            self.deadlines.put(nearest_deadline)
+executor__ = MeteredExecutor(max_workers=256)
 
-    def push_deadline(self, deadline: Optional[datetime]):
-        if deadline is not None:
-            self.deadlines.put(deadline)
-
-    def nearest_deadline(self):
-        if self.deadlines.queue:
-            return self.deadlines.queue[0]
-        return None
-
-    def pop_deadline(self):
-        if self.nearest_deadline() is not None:
-            return self.deadlines.get()
-
-
-executor__ = ThreadPoolExecutor(max_workers=256)
+T = TypeVar('T')
 
 
 class Algorithm:
     class __FlagContainer:
         def __init__(self):
             self.flag = False
-            self.request = SelectionRequest()
+            self.request = self.__empty()
+            # Флаг пополняется потоком-наблюдателем и забирается из event loop: секции короткие и без await
+            self._lock = threading.Lock()
+
+        @staticmethod
+        def __empty() -> SelectionRequest:
+            # Нейтральный элемент для |=: любой добавленный запрос задаст дедлайн и приоритет
+            return SelectionRequest(deadline=datetime.max, priority=Priority.LOW)
+
+        def take(self) -> SelectionRequest:
+            """
+            Забирает накопленный запрос и сбрасывает флаг.
+            """
+            with self._lock:
+                request, self.request = self.request, self.__empty()
+                self.flag = False
+                return request
 
         def __ior__(self, other: SelectionRequest):
-            self.request |= other
+            with self._lock:
+                self.request |= other
             return self
 
         def __isub__(self, other: SelectionRequest):
@@ -74,36 +75,54 @@ class Algorithm:
         def __iter__(self):
             return ((product, self.request[product]) for product in self.request)
 
+    # Срок жизни резерва (в секундах) под маршруты получателей, которые их не подтверждают
+    UNCONFIRMED_HOLD_TTL = 60
+
     warehouse: Warehouse
     clusters_controller: Clusterizer
     size_type: SizeType
 
-    requests_queue: PriorityQueue[SelectionRequest]
-    requests_in_wait: dict[Product, ProductWrapper]
-    requests_in_process: dict[Product, int]
-    outbox_container: list
+    requests_queue: RequestScheduler
+    product_state: ShardedProductState
+    reservations: ReservationLedger
+    outbox: Outbox
+    unconfirmed_workers: set[Hashable]
 
-    deadline_flag: __FlagContainer = __FlagContainer()
-    full_stack_flag: __FlagContainer = __FlagContainer()
-    one_product_left_flag: __FlagContainer = __FlagContainer()
+    deadline_flag: __FlagContainer
+    full_stack_flag: __FlagContainer
+    one_product_left_flag: __FlagContainer
 
-    locker: AsyncThreadLocker = AsyncThreadLocker(asyncio.Lock(), threading.Lock())
-    thread_locker: threading.Lock = threading.Lock()
-    async_locker: asyncio.Lock = asyncio.Lock()
     _stop_event: threading.Event
+    _in_flight: set[TimeBudget]
     __threads: list[threading.Thread] = list()
     _async_task: asyncio.Task
 
     def __init__(self):
+        self.ANYTIME_MODE = True
+        self.ANYTIME_INTERVAL = 0.5
         self.warehouse = Warehouse(self)
         self.clusters_controller = Clusterizer(self.warehouse)
 
-        self.requests_queue = PriorityQueue()
-        self.requests_in_wait = dict()
-        self.requests_in_process = dict()
-        self.outbox_container = list()
+        # Очередь и состояние товаров потокобезопасны сами по себе; outbox принадлежит только event loop
+        self.requests_queue = RequestScheduler()
+        self.product_state = ShardedProductState()
+        self.reservations = ReservationLedger()
+        self.outbox = Outbox()
+        # Получатели, которые не подтверждают маршруты (например, тестовая лента): их резервы живут недолго
+        self.unconfirmed_workers = set()
+
+        self.deadline_flag = self.__FlagContainer()
+        self.full_stack_flag = self.__FlagContainer()
+        self.one_product_left_flag = self.__FlagContainer()
 
         self._stop_event = threading.Event()
+        self._in_flight = set()
+        # Сериализует построение маршрутов и точечные изменения раскладки склада
+        self.layout_lock = asyncio.Lock()
+
+        # Время от постановки запроса до первого маршрута и время полной обработки пачки товаров
+        self.solve_latency = Histogram()
+        self.route_latency = Histogram()
 
     async def start(self):
         self._async_task = asyncio.create_task(self.run_process())
@@ -111,6 +130,7 @@ class Algorithm:
 
     def __del__(self):
         self._stop_event.set()
+        self.cancel_in_flight()
 
         if hasattr(self, '_async_task'):
             self._async_task.cancel()
@@ -121,28 +141,103 @@ class Algorithm:
             if thread.is_alive():
                 thread.join(timeout=1)
 
-    async def solve(self, request: Optional[SelectionRequest]) -> Optional[list[int]]:
-        with self.thread_locker:
-            async with self.async_locker:
-                if request is None:
-                    request = SelectionRequest()
+    async def solve(self, request: Optional[SelectionRequest],
+                    worker_id: Optional[Hashable] = None) -> Optional[asyncio.Future]:
+        """
+        Ставит запрос в очередь на обработку.
 
-                while self.requests_queue._queue and not self.requests_queue._queue[0]:
-                    await self.requests_queue.get()
+        :param request: Запрос на выборку.
+        :param worker_id: Работник, в персональный канал которого нужно доставить маршрут.
+        :return: Future, который разрешится маршрутом для данного запроса, или None, если запроса нет.
+        """
+        if request is None:
+            return None
 
-                await self.requests_queue.put(request)
+        future = self.outbox.expect(request, worker_id)
+        started = time.perf_counter()
 
-                for product, count in request.items():
-                    deadline = datetime.now() + timedelta(seconds=10)
-                    tmp = self.requests_in_wait.get(product, ProductWrapper())
-                    tmp.count += count
-                    self.requests_in_wait[product] = tmp
-                    self.requests_in_wait[product].push_deadline(deadline)
+        def observe(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                self.solve_latency.observe(time.perf_counter() - started)
 
-                if bool(self.outbox_container):
-                    res = self.outbox_container[0]
-                    self.outbox_container = self.outbox_container[1:]
-                    return res
+        future.add_done_callback(observe)
+        self.requests_queue.push(request)
+        for product, count in request.items():
+            self.product_state.add_waiting(product, count, request.deadline)
+
+        return future
+
+    async def solve_many(self, requests: list[SelectionRequest],
+                         worker_id: Optional[Hashable] = None) -> list[asyncio.Future]:
+        """
+        Ставит пачку запросов в очередь за один шаг: одна вставка в планировщик и по одному захвату
+        блокировки на шард состояния товаров.
+
+        :return: Future маршрута для каждого запроса, в том же порядке.
+        """
+        started = time.perf_counter()
+
+        def observe(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                self.solve_latency.observe(time.perf_counter() - started)
+
+        # Сначала очередь: если запрос в неё не встанет, ожидание маршрута для него не регистрируется
+        self.requests_queue.push_many(requests)
+        futures = [self.outbox.expect(request, worker_id) for request in requests]
+        for future in futures:
+            future.add_done_callback(observe)
+
+        self.product_state.add_waiting_many(
+            (product, count, request.deadline) for request in requests for product, count in request.items()
+        )
+        return futures
+
+    @property
+    def requests_in_wait(self) -> dict[Product, WaitingProduct]:
+        """
+        Согласованный снимок товаров, ожидающих отбора.
+        """
+        return self.product_state.waiting()
+
+    @property
+    def requests_in_process(self) -> dict[Product, int]:
+        """
+        Согласованный снимок товаров, находящихся в обработке.
+        """
+        return self.product_state.processing()
+
+    def lock_stats(self) -> dict:
+        """
+        Показатели конкуренции за блокировки состояния товаров.
+        """
+        return self.product_state.lock_stats()
+
+    def status(self) -> dict:
+        """
+        Краткое состояние решателя: очередь запросов, товары в ожидании и в обработке, выданные маршруты.
+        """
+        return {
+            "queued_requests": len(self.requests_queue),
+            "waiting_products": sum(waiting.count for waiting in self.product_state.waiting().values()),
+            "processing_products": sum(self.product_state.processing().values()),
+            "in_flight": len(self._in_flight),
+            "reserved_routes": len(self.reservations)
+        }
+
+    def metrics(self) -> dict:
+        """
+        Показатели решателя для мониторинга: состояние очередей, загрузка пула потоков и гистограммы задержек.
+        """
+        waiting = self.product_state.waiting()
+        return {
+            **self.status(),
+            "waiting_positions": len(waiting),
+            "processing_positions": len(self.product_state.processing()),
+            "executor": executor__.stats(),
+            "solve_latency": self.solve_latency.as_dict(),
+            "route_latency": self.route_latency.as_dict(),
+            "locks": self.lock_stats()
+        }
 
     async def run_process(self):
         self._run_thread(self._watch_max_stack)
@@ -151,16 +246,19 @@ class Algorithm:
         self._run_thread(self._answer_requests)
 
         while True:
+            self.reservations.expire()
             await self.check_flags_and_run()
             await asyncio.sleep(0.1)
 
     def _watch_max_stack(self):
         while True:
             local_flag = False
-            for product, wrapper in self.requests_in_wait.items():
+            for product, wrapper in self.product_state.waiting().items():
                 if not self.full_stack_flag and wrapper.count >= product.max_per_hand:
-                    self.full_stack_flag |= SelectionRequest((product, wrapper.count))
-                    local_flag = True
+                    batch = self._claim(product, wrapper.count, wrapper.nearest_deadline)
+                    if batch.covers:
+                        self.full_stack_flag |= batch
+                        local_flag = True
 
             if local_flag:
                 self.full_stack_flag = +self.full_stack_flag
@@ -183,12 +281,14 @@ class Algorithm:
         while True:
             local_flag = False
 
-            for product, wrapper in self.requests_in_wait.items():
-                if (not self.deadline_flag and wrapper.nearest_deadline() is not None and wrapper.count > 0
-                        and wrapper.nearest_deadline() - timedelta(seconds=5) <= datetime.now()):
-                    self.deadline_flag |= SelectionRequest((product, max(wrapper.count, product.max_per_hand)))
-                    wrapper.pop_deadline()
-                    local_flag = True
+            for product, wrapper in self.product_state.waiting().items():
+                if (not self.deadline_flag and wrapper.nearest_deadline is not None and wrapper.count > 0
+                        and wrapper.nearest_deadline - timedelta(seconds=5) <= datetime.now()):
+                    batch = self._claim(product, max(wrapper.count, product.max_per_hand), wrapper.nearest_deadline)
+                    self.product_state.pop_deadline(product)
+                    if batch.covers:
+                        self.deadline_flag |= batch
+                        local_flag = True
 
             if local_flag:
                 self.deadline_flag = +self.deadline_flag
@@ -198,56 +298,210 @@ class Algorithm:
         while True:
             to_delete = dict()
 
-            for product, count in self.requests_in_process.items():
-                with self.thread_locker:
-                    if self.requests_queue._queue and product in self.requests_queue._queue[0]:
-                        to_send = min(count, self.requests_queue._queue[0][product])
-                        to_delete[product] = to_send
-                        self.requests_queue._queue[0] -= SelectionRequest((product, to_send))
-
-            with self.thread_locker:
-                for product, count in to_delete.items():
-                    self.requests_in_process[product] -= count
+            for product, count in self.product_state.processing().items():
+                # Обслуживаем запросы с этим товаром в порядке срочности, начиная с включённых в пакеты
+                urgent = self.requests_queue.most_urgent(feasible=lambda r: product in r)
+                urgent.sort(key=lambda r: not self.requests_queue.claimed(r.request_id))
+                for request in urgent:
+                    if count <= 0:
+                        break
+                    to_send = min(count, request[product])
+                    self.requests_queue.subtract(request.request_id, SelectionRequest((product, to_send)))
+                    to_delete[product] = to_delete.get(product, 0) + to_send
+                    count -= to_send
+
+            for product, count in to_delete.items():
+                self.product_state.finish_processing(product, count)
 
             time.sleep(5)
 
+    def _claim(self, product: Product, count: int, deadline) -> SelectionRequest:
+        """
+        Собирает пакет для товара: все ещё не взятые в работу запросы с этим товаром целиком,
+        чтобы построенный маршрут выполнял каждый из них полностью. Товара берётся не меньше count.
+
+        :return: Пакет; covers - идентификаторы вошедших в него запросов (пустой, если брать нечего).
+        """
+        batch = SelectionRequest(deadline=deadline)
+        for request in self.requests_queue.claim(product):
+            batch |= request
+        if batch.covers:
+            batch.data[product] = max(batch[product], count)
+        return batch
+
     def _run_thread(self, sync_func) -> None:
         thread = threading.Thread(target=sync_func, daemon=True)
         self.__threads.append(thread)
         thread.start()
 
+    def cancel(self, request_id: int) -> None:
+        """
+        Отменяет запрос: убирает его из очереди и снимает ожидание маршрута.
+        """
+        self.requests_queue.cancel(request_id)
+        self.outbox.cancel(request_id)
+
+    async def change_layout(self, change: Callable[[], T]) -> T:
+        """
+        Выполняет изменение раскладки склада в пуле потоков, приостановив построение маршрутов:
+        текущий расчёт прерывается (отправляется лучший найденный маршрут), следующий начнётся после изменения.
+        """
+        self.cancel_in_flight()
+        async with self.layout_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, change)
+
+    def cancel_in_flight(self) -> None:
+        """
+        Кооперативно прерывает все выполняющиеся сейчас расчёты: этапы вернут лучший найденный результат.
+        """
+        for budget in list(self._in_flight):
+            budget.cancel()
+
     async def check_flags_and_run(self):
         request = None
 
         if self.deadline_flag:
-            with self.thread_locker:
-                request = self.deadline_flag.request
-                self.deadline_flag = -self.deadline_flag
+            request = self.deadline_flag.take()
         elif self.full_stack_flag:
-            with self.thread_locker:
-                request = self.full_stack_flag.request
-                self.full_stack_flag = -self.full_stack_flag
+            request = self.full_stack_flag.take()
         elif self.one_product_left_flag:
-            with self.thread_locker:
-                request = self.one_product_left_flag.request
-                self.one_product_left_flag = -self.one_product_left_flag
+            request = self.one_product_left_flag.take()
 
         if request:
-            await self.add_to_process(request)
+            # Раскладка склада (update_warehouse) не меняется, пока строится маршрут
+            async with self.layout_lock:
+                await self.process(request)
+
+    async def process(self, request: SelectionRequest) -> None:
+        """
+        Строит и публикует маршрут для пакета запросов.
+        """
+        await self.add_to_process(request)
+        budget = TimeBudget.until(request.deadline)
+        self._in_flight.add(budget)
+        started = time.perf_counter()
+        try:
+            if self.ANYTIME_MODE:
+                await self.solve_anytime(request, budget)
+            else:
+                stream = RouteStream(self.outbox, request.covers)
+                try:
+                    clusters = await self.choose_clusters(request)
+                    cells = await self.choose_cells(request, clusters, budget.share(0.7))
+                    way = await self.build_way(cells, budget)
+                    self.issue(stream, request, cells, way)
+                finally:
+                    stream.close()
+        except Exception as e:
+            logging.error(f"Не удалось построить маршрут для {request}: {e}")
+            budget.cancel()
+            self.outbox.fail(request.covers, e)
+            return
+        finally:
+            self._in_flight.discard(budget)
+            self.route_latency.observe(time.perf_counter() - started)
+
+        if budget.expired:
+            logging.warning(f"Бюджет времени на запрос {request} исчерпан, отправлен лучший найденный маршрут")
+
+    async def solve_anytime(self, request: SelectionRequest, budget: TimeBudget) -> None:
+        """
+        Anytime-режим: сразу отправляет первый допустимый маршрут (жадный набор ячеек и быстрый порядок обхода),
+        затем досылает улучшенные версии по мере работы генетического алгоритма и отжига.
+        """
+        stream = RouteStream(self.outbox, request.covers)
+        evolution = None
+        try:
             clusters = await self.choose_clusters(request)
-            cells = await self.choose_cells(request, clusters)
-            way = await self.build_way(cells)
-
-            with self.thread_locker:
-                async with self.async_locker:
-                    self.outbox_container.append(way)
+            cells = await self.choose_cells(request, clusters, TimeBudget(0))
+            way = await self.build_way(cells, TimeBudget(0))
+            self.issue(stream, request, cells, way)
+
+            latest = [None]
+
+            def on_improvement(improved: set[Cell]) -> None:
+                latest[0] = improved
+
+            evolution = asyncio.ensure_future(self.choose_cells(request, clusters, budget.share(0.7), on_improvement))
+            while not evolution.done():
+                await asyncio.wait({evolution}, timeout=self.ANYTIME_INTERVAL)
+                candidate, latest[0] = latest[0], None
+                if candidate is not None and not evolution.done():
+                    way = await self.build_way(candidate, TimeBudget(0))
+                    self.issue(stream, request, candidate, way)
+
+            cells = evolution.result()
+            way = await self.build_way(cells, budget)
+            self.issue(stream, request, cells, way)
+        finally:
+            stream.close()
+            if evolution is not None:
+                # Эволюция не должна переживать запрос, если построение маршрута упало или задачу отменили
+                if not evolution.done():
+                    evolution.cancel()
+                await asyncio.wait({evolution})
+                # Исключение забирается, чтобы не попасть в лог как непрочитанное
+                evolution.cancelled() or evolution.exception()
+
+    def issue(self, stream: RouteStream, request: SelectionRequest, cells: set[Cell], way: list) -> bool:
+        """
+        Публикует версию маршрута и переоформляет под неё резерв товара в выбранных ячейках.
+
+        :return: True, если версия оказалась лучше предыдущих и была отправлена.
+        """
+        if not stream.offer(way, route_length(way)):
+            return False
+
+        listeners = self.outbox.listeners(stream.route_id)
+        ttl = self.UNCONFIRMED_HOLD_TTL if listeners and listeners <= self.unconfirmed_workers else None
+        self.reservations.reserve(stream.route_id, self.allocate(request, cells, stream.route_id), ttl)
+        return True
+
+    def available(self, cell_id: int) -> int:
+        """
+        Количество товара в ячейке, доступное для новых маршрутов (остаток за вычетом резервов).
+        """
+        return self.reservations.available(cell_id, self.warehouse.state.count(cell_id))
+
+    def allocate(self, request: SelectionRequest, cells: set[Cell], hold_id=None) -> dict[int, int]:
+        """
+        Распределяет количество товара из запроса по выбранным ячейкам с учётом доступного остатка.
+
+        :param hold_id: Резерв, который будет заменён: его собственное количество считается доступным.
+        """
+        own = self.reservations.hold(hold_id) if hold_id is not None else dict()
+        needed = {product.sku: count for product, count in request.items()}
+        allocation = dict()
+
+        for cell in sorted(cells, key=lambda c: c.cell_id):
+            left = needed.get(cell.product_sku, 0)
+            if left <= 0:
+                continue
+
+            take = min(left, self.available(cell.cell_id) + own.get(cell.cell_id, 0))
+            if take > 0:
+                allocation[cell.cell_id] = take
+                needed[cell.product_sku] -= take
+
+        return allocation
+
+    def confirm_route(self, route_id: int, picked: bool = True) -> dict[int, int]:
+        """
+        Завершает маршрут: при подтверждённом отборе резерв превращается в списание со склада,
+        иначе просто снимается.
+
+        :return: Количество товара по ячейкам, которое было зарезервировано под маршрут.
+        """
+        allocation = self.reservations.release(route_id)
+        if picked:
+            for cell_id, count in allocation.items():
+                if not self.warehouse.remove_product_from_cell(cell_id, count):
+                    logging.warning(f"Не удалось списать {count} ед. товара из ячейки {cell_id}")
+        return allocation
 
     async def add_to_process(self, request: SelectionRequest) -> None:
-        with self.thread_locker:
-            async with self.async_locker:
-                for product, count in request.items():
-                    self.requests_in_wait[product].count -= count
-                    self.requests_in_process[product] = self.requests_in_process.get(product, 0) + count
+        for product, count in request.items():
+            self.product_state.start_processing(product, count)
 
     @run_async_thread(executor__)
     def choose_clusters(self, request: SelectionRequest) -> set[Cluster]:
@@ -261,7 +515,8 @@ class Algorithm:
         return result
 
     @run_async_thread(executor__)
-    def choose_cells(self, request: SelectionRequest, clusters: set[Cluster]) -> set[Cell]:
+    def choose_cells(self, request: SelectionRequest, clusters: set[Cluster],
+                     budget: Optional[TimeBudget] = None, on_improvement=None) -> set[Cell]:
         settings = {
             'population_size': 270,
             'generations': 1600,
@@ -279,9 +534,9 @@ class Algorithm:
             for product, count in request.items()
         }
 
-        genetic_algorithm = GeneticAlgorithm(sup_cluster)
-        return genetic_algorithm.evolution(order, settings)
+        genetic_algorithm = GeneticAlgorithm(sup_cluster, lambda cell: self.available(cell.cell_id))
+        return genetic_algorithm.evolution(order, settings, budget, on_improvement)
 
     @run_async_thread(executor__)
-    def build_way(self, cells: set[Cell]) -> list[tuple[int, int]]:
-        return adapter(self.warehouse, cells)
+    def build_way(self, cells: set[Cell], budget: Optional[TimeBudget] = None) -> list[tuple[int, int]]:
+        return adapter(self.warehouse, cells, budget)
@@ -1,13 +1,9 @@
 import numpy as np
-import pandas as pd
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import LabelEncoder
 
 from src.algorithm.size_enum import SizeType
 from src.models.cell import Cell
 from src.models.warehouse_on_db import Warehouse
 from src.models.product import Product
-from src.parsers.db_parser import db
 
 
 class Clusterizer:
@@ -122,19 +118,23 @@ class Clusterizer:
         return self.size_type
 
     async def clusterize(self):
-        query = """
-                SELECT 
-                    c.cell_id, c.x, c.y, 
-                    c.count, 
-                    p.max_amount, 
-                    p.product_type
-                FROM cell c
-                JOIN product p ON c.product_sku = p.sku
-                WHERE c.count > 0
-            """
-
-        with db.engine.connect() as conn:
-            cells_df = pd.read_sql(query, conn)    # conn возьму из Database class
+        # pandas импортируется только при кластеризации, sklearn - только если метки не нашлись в кэше
+        import pandas as pd
+
+        # Ячейки берутся из снимка склада в памяти, без запроса к БД
+        arrays = self.warehouse.state.arrays()
+        products = self.warehouse.state.products()
+        mask = (arrays['count'] > 0) & np.isin(arrays['product_sku'], np.fromiter(products, dtype=np.int64))
+
+        cells_df = pd.DataFrame({
+            'cell_id': arrays['cell_id'][mask],
+            'x': arrays['x'][mask],
+            'y': arrays['y'][mask],
+            'count': arrays['count'][mask]
+        })
+        skus = arrays['product_sku'][mask]
+        cells_df['max_amount'] = [products[sku].max_amount for sku in skus]
+        cells_df['product_type'] = [products[sku].product_type for sku in skus]
 
         if cells_df.empty:
             return  # Сообщить об ошибке
@@ -142,18 +142,21 @@ class Clusterizer:
         # Подсчёт заполненности
         cells_df['fill_ratio'] = cells_df['count'] / cells_df['max_amount'] * 100
 
-        # Кодирование категориального признака
-        le = LabelEncoder()
-        cells_df['product_type_encoded'] = le.fit_transform(cells_df['product_type'])
+        # Кодирование категориального признака (номер категории в отсортированном списке, как у LabelEncoder)
+        cells_df['product_type_encoded'] = np.unique(cells_df['product_type'].values, return_inverse=True)[1]
 
         start_x, start_y = self.warehouse.get_start()
         cells_df['dist_to_start'] = np.sqrt((cells_df['x'] - start_x) ** 2 + (cells_df['y'] - start_y) ** 2)
 
         features = cells_df[['x', 'y', 'fill_ratio', 'product_type_encoded', 'dist_to_start']].values
 
-        # Кластеризация
-        clustering = DBSCAN(eps=self.__eps, min_samples=self.__min_samples).fit(features)
-        cells_df['cluster'] = clustering.labels_
+        # Кластеризация. Метки однозначно определяются признаками и параметрами DBSCAN,
+        # поэтому после перезапуска без изменений склада они читаются из дискового кэша
+        key = self.warehouse.precomputed.key(
+            self.warehouse.state.layout_hash, cells_df['cell_id'].values, features,
+            {"eps": self.__eps, "min_samples": self.__min_samples}
+        )
+        cells_df['cluster'] = self.warehouse.precomputed.get_or_build('dbscan', key, lambda: self._dbscan(features))
 
         self.clusters = {
             self.Cluster(self.warehouse, cluster_id, group['cell_id'].tolist())
@@ -167,6 +170,30 @@ class Clusterizer:
             if cluster_id == -1  # -1 означает "шум" в DBSCAN
         }
 
+    def _dbscan(self, features: np.ndarray) -> np.ndarray:
+        from sklearn.cluster import DBSCAN
+
+        return DBSCAN(eps=self.__eps, min_samples=self.__min_samples).fit(features).labels_
+
+    def discard_cells(self, cell_ids: list[int]) -> None:
+        """
+        Убирает удалённые со склада ячейки из кластеров без повторной кластеризации.
+        Опустевшие кластеры удаляются. Новые ячейки пусты, поэтому в кластеры не попадают до следующей кластеризации.
+        """
+        if not self.clusters or not cell_ids:
+            return
+
+        cell_ids = set(cell_ids)
+        for cluster in list(self.clusters):
+            cells = {cell for cell in cluster.cells if cell.cell_id not in cell_ids}
+            if len(cells) == len(cluster.cells):
+                continue
+            if cells:
+                cluster.cells = cells
+                cluster._cache_data(cells)
+            else:
+                self.clusters.discard(cluster)
+
     def get_clusters(self) -> set[Cluster]:
         if self.clusters is None or not self.__is_updated:
             # todo await self.clusterize()
@@ -1,13 +1,20 @@
 import random
 import math
 from collections import defaultdict
-from typing import Dict, List, Tuple, Set, Any, Optional
+from typing import Dict, List, Tuple, Set, Any, Optional, Callable
+from src.algorithm.utils import TimeBudget
 from src.models.cell import Cell
 
 
 class GeneticAlgorithm:
-    def __init__(self, warehouse: Dict[str, Cell]) -> None:
+    def __init__(self, warehouse: Dict[str, Cell], available: Optional[Callable[[Cell], int]] = None) -> None:
+        """
+        :param warehouse: Ячейки-кандидаты по строковым идентификаторам.
+        :param available: Доступное количество товара в ячейке (с учётом резервов). По умолчанию - cell.count.
+        """
         self.all_cells_data: Dict[str, Cell] = warehouse
+        available = available if available is not None else (lambda cell: cell.count)
+        self.availability: Dict[str, int] = {cid: available(cell) for cid, cell in warehouse.items()}
         self.MUTATION_RATE: Optional[float] = None
         self.GENERATIONS: Optional[int] = None
         self.POPULATION_SIZE: Optional[int] = None
@@ -26,9 +33,7 @@ class GeneticAlgorithm:
         """Генерирует один валидный набор ID ячеек."""
         selected: Set[str] = set()
         # Копируем доступность, чтобы не менять оригинальную
-        temp_avail: Dict[str, int] = {
-            cid: cell.count for cid, cell in self.all_cells_data.items()
-        }
+        temp_avail: Dict[str, int] = self.availability.copy()
         items = list(current_order.items())
         random.shuffle(items)
 
@@ -109,9 +114,16 @@ class GeneticAlgorithm:
     def evolution(
         self,
         order: Dict[str, int],
-        settings: Dict[str, Any]
-    ) -> None:
-        """Запуск генетического алгоритма."""
+        settings: Dict[str, Any],
+        budget: Optional[TimeBudget] = None,
+        on_improvement: Optional[Callable[[Set[Cell]], None]] = None
+    ) -> Set[Cell]:
+        """
+        Запуск генетического алгоритма.
+        При исчерпании бюджета возвращает лучшее найденное к этому моменту решение.
+        Если передан on_improvement, он вызывается с набором ячеек при каждом улучшении лучшего решения.
+        """
+        budget = budget if budget is not None else TimeBudget()
         self.POPULATION_SIZE = settings['population_size']
         self.GENERATIONS = settings['generations']
         self.MUTATION_RATE = settings['mutation_rate']
@@ -120,26 +132,35 @@ class GeneticAlgorithm:
         locations: Dict[str, List[str]] = defaultdict(list)
         for cid, cell in self.all_cells_data.items():
             locations[cell.product.sku].append(cid)
-        # Инициализация популяции
-        population = [
-            self.generate_valid_solution(order, locations)
-            for _ in range(self.POPULATION_SIZE)
-        ]
+        # Инициализация популяции (хотя бы одно решение строится всегда)
+        population = [self.generate_valid_solution(order, locations)]
+        while len(population) < self.POPULATION_SIZE and budget:
+            population.append(self.generate_valid_solution(order, locations))
         fitness = [self.calculate_fitness(sol) for sol in population]
 
-        best_sol: Optional[List[str]] = None
-        best_fit = float('inf')
+        idx = min(range(len(population)), key=lambda i: fitness[i])
+        best_sol: List[str] = population[idx][:]
+        best_fit = fitness[idx]
+        if on_improvement is not None:
+            on_improvement({self.all_cells_data[cid] for cid in best_sol})
 
         for gen in range(self.GENERATIONS):
+            if budget.expired:
+                break
+
             idx = min(range(len(population)), key=lambda i: fitness[i])
             if fitness[idx] < best_fit:
                 best_fit = fitness[idx]
                 best_sol = population[idx][:]
                 # print(f"Generation {gen}: new best = {best_fit:.2f}, cells = {len(best_sol)}")
+                if on_improvement is not None:
+                    on_improvement({self.all_cells_data[cid] for cid in best_sol})
 
             new_pop = [best_sol]
             new_fit = [best_fit]
             for _ in range(self.POPULATION_SIZE - 1):
+                if budget.expired:
+                    break
                 child = self.mutate_solution(best_sol, order, locations)
                 f = self.calculate_fitness(child)
                 new_pop.append(child)
@@ -147,4 +168,8 @@ class GeneticAlgorithm:
 
             population, fitness = new_pop, new_fit
 
+        idx = min(range(len(population)), key=lambda i: fitness[i])
+        if fitness[idx] < best_fit:
+            best_sol = population[idx][:]
+
         return {self.all_cells_data[cid] for cid in best_sol}
@@ -5,6 +5,7 @@ import heapq
 
 from pydantic.tools import lru_cache
 
+from src.algorithm.utils import TimeBudget
 from src.models.warehouse_on_db import Warehouse
 
 Point = tuple[float, float]
@@ -27,16 +28,26 @@ base_temp = 1.0
 
 
 class Otjig:
-    # Выбирает use точек (включая стартовую) минимизируя длину пути между ними
-    def optimise(self, dots: list[Point], use: int, iterations=1000):
+    # Выбирает use точек (включая стартовую) минимизируя длину пути между ними.
+    # При исчерпании бюджета останавливается и оставляет в dots лучший найденный порядок
+    def optimise(self, dots: list[Point], use: int, iterations=1000, budget: TimeBudget = None):
         self.path = dots
         self.use = use
         self.temp = base_temp
         self.length = length(self.path[:use])
         if len(self.path) < 4:
             return
+
+        best_path, best_length = self.path[:], self.length
         for _ in range(iterations):
+            if budget is not None and budget.expired:
+                break
             self.__iterate()
+            if self.length < best_length:
+                best_path, best_length = self.path[:], self.length
+
+        self.path[:] = best_path
+        self.length = best_length
 
     def __elem_dist(self, id1: int, id2: int) -> float:
         return dist(self.path[id1], self.path[id2])
@@ -90,6 +101,23 @@ class Otjig:
         self.__cool()
 
 
+def nearest_neighbour(dots: list[Point]) -> list[Point]:
+    # Быстрое начальное упорядочивание: от старта каждый раз идём к ближайшей непосещённой точке
+    if len(dots) < 3:
+        return dots[:]
+    rest = dots[1:]
+    result = [dots[0]]
+    while rest:
+        nearest = min(range(len(rest)), key=lambda i: dist(result[-1], rest[i]))
+        result.append(rest.pop(nearest))
+    return result
+
+
+def route_length(way: list[tuple[int, int, str]]) -> float:
+    # Длина сжатого маршрута: между соседними точками zip_way идёт прямой отрезок
+    return length([(x, y) for x, y, _ in way])
+
+
 def zip_way(way: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
     result = list()
     result.append(way[0])
@@ -113,11 +141,15 @@ def zip_way(way: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
     return result
 
 
-def adapter(warehouse: Warehouse, cells: set) -> list[tuple[int, int]]:
-    dots = [(cell.x, cell.y) for cell in cells]
-    dots.insert(0, warehouse.get_start())
+def adapter(warehouse: Warehouse, cells: set, budget: TimeBudget = None) -> list[tuple[int, int]]:
+    dots = nearest_neighbour([warehouse.get_start()] + [(cell.x, cell.y) for cell in cells])
     dots.append(warehouse.get_start())
-    Otjig().optimise(dots, len(dots))
+    # Отжиг прерывается по бюджету, а поиск пути (A*) всегда доводится до конца, иначе маршрут будет неполным
+    Otjig().optimise(dots, len(dots), budget=budget)
+
+    # Сетка проходимости берётся один раз на весь маршрут (из дискового кэша, если раскладка не менялась)
+    walkable = warehouse.walkable_grid()
+    width, height = walkable.shape
 
     result = list()
     for i in range(len(dots) - 1):
@@ -144,7 +176,8 @@ def adapter(warehouse: Warehouse, cells: set) -> list[tuple[int, int]]:
             x, y = current
             for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
                 neighbor = (x + dx, y + dy)
-                if neighbor == dots[i + 1] or warehouse.is_moving_cell(neighbor):
+                inside = 0 <= neighbor[0] < width and 0 <= neighbor[1] < height
+                if neighbor == dots[i + 1] or not inside or walkable[neighbor]:
                     if neighbor not in visited:
                         comes_from[neighbor] = current
                         heapq.heappush(open_set, (
@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+from collections.abc import Hashable, Iterable
+from typing import NamedTuple, Optional
+
+from src.models.selection_request import SelectionRequest
+
+
+_route_ids = itertools.count(1)
+
+
+class RouteUpdate(NamedTuple):
+    """
+    Очередная версия маршрута, доставляемая в канал работника.
+    """
+    route_id: int
+    version: int
+    route: list
+
+
+class Outbox:
+    """
+    Адресная доставка построенных маршрутов.
+
+    Каждый запрос на выборку получает собственный future, который разрешается первым маршрутом пакета,
+    в который решатель включил этот запрос целиком (SelectionRequest.covers). Если запрос отправлен от имени работника и этот работник
+    слушает свой персональный канал (asyncio.Queue), маршрут дополнительно кладётся туда в виде RouteUpdate,
+    а все последующие улучшенные версии того же маршрута доставляются в тот же канал.
+    """
+
+    def __init__(self):
+        self._channels: dict[Hashable, asyncio.Queue] = dict()
+        self._waiters: dict[int, tuple[Optional[Hashable], asyncio.Future]] = dict()
+        self._listeners: dict[int, set[Hashable]] = dict()
+
+    def channel(self, key: Hashable) -> asyncio.Queue:
+        """
+        Возвращает канал доставки для работника (или любого другого ключа), создавая его при необходимости.
+        Очереди создаются лениво, уже внутри работающего event loop.
+        """
+        if key not in self._channels:
+            self._channels[key] = asyncio.Queue()
+        return self._channels[key]
+
+    def expect(self, request: SelectionRequest, worker_id: Optional[Hashable] = None) -> asyncio.Future:
+        """
+        Регистрирует ожидание маршрута для запроса.
+
+        :param request: Запрос на выборку.
+        :param worker_id: Работник, в канал которого нужно продублировать маршрут.
+        :return: Future, который разрешится маршрутом для данного запроса.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request.request_id] = (worker_id, future)
+        return future
+
+    def deliver(self, route: list, request_ids: Iterable[int],
+                route_id: Optional[int] = None, version: int = 1) -> int:
+        """
+        Передаёт маршрут ожидающим запросам, для которых он построен.
+        Новые версии уже выданного маршрута (version > 1) отправляются в каналы тех же работников.
+
+        :return: Количество запросов (или каналов для новых версий), получивших маршрут.
+        """
+        # Слушателей запоминаем только для маршрутов, у которых могут появиться новые версии
+        listeners = set() if route_id is None else self._listeners.setdefault(route_id, set())
+        if route_id is None:
+            route_id = next(_route_ids)
+
+        if version > 1:
+            listeners = self._listeners.get(route_id, set())
+            update = RouteUpdate(route_id, version, route)
+            for worker_id in listeners:
+                if worker_id in self._channels:
+                    self._channels[worker_id].put_nowait(update)
+            return len(listeners)
+
+        delivered = 0
+
+        for request_id in request_ids:
+            waiter = self._waiters.pop(request_id, None)
+            if waiter is None or waiter[1].done():
+                continue
+
+            worker_id, future = waiter
+
+            future.set_result(route)
+            if worker_id in self._channels:
+                self._channels[worker_id].put_nowait(RouteUpdate(route_id, version, route))
+                listeners.add(worker_id)
+            delivered += 1
+
+        return delivered
+
+    def listeners(self, route_id: int) -> set[Hashable]:
+        """
+        Работники, в каналы которых доставляются версии маршрута.
+        """
+        return set(self._listeners.get(route_id, ()))
+
+    def finish(self, route_id: int) -> None:
+        """
+        Прекращает доставку новых версий маршрута.
+        """
+        self._listeners.pop(route_id, None)
+
+    def fail(self, request_ids: Iterable[int], exc: BaseException) -> None:
+        """
+        Завершает с ошибкой ожидание указанных запросов.
+        """
+        for request_id in request_ids:
+            waiter = self._waiters.pop(request_id, None)
+            if waiter is not None and not waiter[1].done():
+                waiter[1].set_exception(exc)
+
+    def close_channel(self, key: Hashable) -> None:
+        """
+        Удаляет канал работника, который больше не слушает маршруты.
+        """
+        self._channels.pop(key, None)
+        for listeners in self._listeners.values():
+            listeners.discard(key)
+
+    def cancel(self, request_id: int) -> None:
+        """
+        Снимает ожидание маршрута для запроса.
+        """
+        waiter = self._waiters.pop(request_id, None)
+        if waiter is not None and not waiter[1].done():
+            waiter[1].cancel()
+
+    def __len__(self):
+        return len(self._waiters)
+
+
+class RouteStream:
+    """
+    Поток версий одного маршрута для anytime-режима.
+    Публикует маршрут только если он короче всех ранее отправленных, увеличивая номер версии.
+    """
+
+    def __init__(self, outbox: Outbox, request_ids: Iterable[int]):
+        self.route_id = next(_route_ids)
+        self.version = 0
+        self.best_length = float('inf')
+        self._outbox = outbox
+        self._request_ids = list(request_ids)
+
+    def offer(self, route: list, route_length: float) -> bool:
+        """
+        Предлагает новую версию маршрута.
+
+        :return: True, если версия оказалась лучше предыдущих и была отправлена.
+        """
+        if not route or route_length >= self.best_length:
+            return False
+
+        self.best_length = route_length
+        self.version += 1
+        self._outbox.deliver(route, self._request_ids, self.route_id, self.version)
+        return True
+
+    def close(self) -> None:
+        self._outbox.finish(self.route_id)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections.abc import Callable
+from typing import Optional
+
+import numpy as np
+
+
+class PrecomputeCache:
+    """
+    Дисковый кэш предвычисленных структур склада (сетка проходимости, метки DBSCAN и т. п.).
+
+    Каждая структура хранится отдельным .npy-файлом `<name>-<key>.npy`, где key - хэш раскладки ячеек
+    и параметров расчёта. Файлы открываются через np.load(mmap_mode='r'), то есть отображаются в память
+    без копирования и только для чтения. Запись атомарна (временный файл + os.replace), поэтому
+    одновременно стартующие процессы никогда не прочитают недописанный файл.
+    При сохранении новой версии структуры файлы с другими ключами удаляются.
+    """
+
+    def __init__(self, directory: str = os.path.join('cache', 'precompute')):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Хэш частей ключа: массивы хэшируются по содержимому, типу и форме, остальное - через JSON.
+        """
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part)
+                digest.update(f"{part.dtype.str}{part.shape}".encode())
+                digest.update(part.tobytes())
+            else:
+                digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def path(self, name: str, key: str) -> str:
+        return os.path.join(self.directory, f"{name}-{key}.npy")
+
+    def load(self, name: str, key: str) -> Optional[np.ndarray]:
+        """
+        Отображает сохранённый массив в память.
+
+        :return: Массив только для чтения или None, если файла нет или он повреждён.
+        """
+        path = self.path(name, key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать предвычисленные данные {path}: {e}")
+            return None
+
+    def save(self, name: str, key: str, array: np.ndarray) -> np.ndarray:
+        """
+        Сохраняет массив и возвращает его отображение в память.
+        Если записать файл не удалось, возвращается исходный массив.
+        """
+        path = self.path(name, key)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp, 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+            os.replace(temp, path)
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить предвычисленные данные {path}: {e}")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return array
+
+        self._prune(name, key)
+        loaded = self.load(name, key)
+        return loaded if loaded is not None else array
+
+    def get_or_build(self, name: str, key: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Возвращает сохранённую структуру, а если её нет - строит, сохраняет и возвращает.
+        """
+        array = self.load(name, key)
+        with self._lock:
+            if array is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if array is not None:
+            logging.debug(f"Предвычисленные данные '{name}' загружены из кэша")
+            return array
+
+        logging.debug(f"Предвычисленные данные '{name}' устарели или отсутствуют, пересчёт")
+        return self.save(name, key, build())
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _prune(self, name: str, keep: str) -> None:
+        prefix, current = f"{name}-", os.path.basename(self.path(name, keep))
+        try:
+            for file in os.listdir(self.directory):
+                if file.startswith(prefix) and file.endswith('.npy') and file != current:
+                    os.remove(os.path.join(self.directory, file))
+        except OSError as e:
+            logging.warning(f"Не удалось удалить устаревшие предвычисленные данные '{name}': {e}")
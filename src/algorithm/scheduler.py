@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
+from typing import Optional
+
+from src.models.selection_request import SelectionRequest, Priority
+
+
+class RequestScheduler:
+    """
+    Очередь запросов на выборку в порядке EDF (earliest deadline first) с классами приоритета.
+
+    Запросы упорядочены по паре (priority, deadline): сначала более срочный класс, внутри класса -
+    ближайший дедлайн. Вставка, изменение и отмена выполняются за O(log n) (отмена - за O(1)):
+    вместо удаления из середины кучи запись помечается удалённой и выбрасывается, когда доходит до вершины.
+
+    Структура потокобезопасна: внутренняя блокировка никогда не удерживается во время await.
+    """
+
+    _REMOVED = None
+
+    def __init__(self):
+        self._heap: list[list] = list()
+        self._entries: dict[int, list] = dict()
+        self._sequence = itertools.count()
+        self._removed = 0
+        # Запросы, уже включённые в пакет решателя: повторно в пакеты они не попадают
+        self._claimed: set[int] = set()
+        self._lock = threading.Lock()
+
+    def push(self, request: SelectionRequest) -> None:
+        """
+        Добавляет запрос в очередь. Повторное добавление того же запроса обновляет его позицию.
+        """
+        with self._lock:
+            self._push(request)
+
+    def push_many(self, requests: Iterable[SelectionRequest]) -> None:
+        """
+        Добавляет пачку запросов под одним захватом блокировки.
+        """
+        with self._lock:
+            for request in requests:
+                self._push(request)
+
+    def update(self, request_id: int, deadline: Optional[datetime] = None,
+               priority: Optional[Priority] = None) -> bool:
+        """
+        Меняет дедлайн и/или класс приоритета запроса.
+
+        :return: False, если запроса с таким идентификатором нет в очереди.
+        """
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return False
+
+            request = entry[-1]
+            if deadline is not None:
+                request.deadline = deadline
+            if priority is not None:
+                request.priority = Priority(priority)
+            self._push(request)
+            return True
+
+    def cancel(self, request_id: int) -> Optional[SelectionRequest]:
+        """
+        Удаляет запрос из очереди (ленивое удаление).
+
+        :return: Удалённый запрос или None, если его не было в очереди.
+        """
+        with self._lock:
+            entry = self._entries.pop(request_id, None)
+            if entry is None:
+                return None
+
+            request = entry[-1]
+            self._remove(entry)
+            return request
+
+    def peek(self) -> Optional[SelectionRequest]:
+        """
+        Возвращает самый срочный непустой запрос, не извлекая его.
+        """
+        with self._lock:
+            self._drop_dead_head()
+            return self._heap[0][-1] if self._heap else None
+
+    def pop(self) -> Optional[SelectionRequest]:
+        """
+        Извлекает самый срочный непустой запрос.
+        """
+        with self._lock:
+            self._drop_dead_head()
+            if not self._heap:
+                return None
+
+            entry = heapq.heappop(self._heap)
+            request = entry[-1]
+            del self._entries[request.request_id]
+            self._claimed.discard(request.request_id)
+            return request
+
+    def most_urgent(self, limit: Optional[int] = None,
+                    feasible: Optional[Callable[[SelectionRequest], bool]] = None) -> list[SelectionRequest]:
+        """
+        Возвращает самые срочные допустимые запросы, не извлекая их из очереди.
+
+        :param limit: Максимальный размер пачки. None - без ограничения.
+        :param feasible: Предикат допустимости запроса (например, наличие нужного товара).
+        :return: Запросы в порядке убывания срочности.
+        """
+        with self._lock:
+            live = [
+                tuple(entry) for entry in self._entries.values()
+                if entry[-1] and (feasible is None or feasible(entry[-1]))
+            ]
+
+        if limit is None:
+            live.sort()
+        else:
+            live = heapq.nsmallest(limit, live)
+        return [entry[-1] for entry in live]
+
+    def claim(self, product) -> list[SelectionRequest]:
+        """
+        Забирает в пакет все ещё не взятые запросы с данным товаром.
+
+        :return: Копии запросов (в порядке убывания срочности), у каждой covers - идентификатор исходного запроса.
+        """
+        with self._lock:
+            live = sorted(
+                tuple(entry) for request_id, entry in self._entries.items()
+                if entry[-1] and product in entry[-1] and request_id not in self._claimed
+            )
+            claimed = list()
+            for entry in live:
+                request = entry[-1]
+                self._claimed.add(request.request_id)
+                copy = SelectionRequest(*request.items(), deadline=request.deadline, priority=request.priority)
+                copy.covers.add(request.request_id)
+                claimed.append(copy)
+            return claimed
+
+    def claimed(self, request_id: int) -> bool:
+        return request_id in self._claimed
+
+    def subtract(self, request_id: int, other: SelectionRequest) -> Optional[SelectionRequest]:
+        """
+        Вычитает выполненную часть из запроса. Полностью выполненный запрос удаляется из очереди.
+
+        :return: Остаток запроса или None, если запроса нет либо он выполнен полностью.
+        """
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return None
+
+            request = entry[-1]
+            request -= other
+            if request:
+                return request
+
+            del self._entries[request_id]
+            self._remove(entry)
+            return None
+
+    def _push(self, request: SelectionRequest) -> None:
+        old = self._entries.get(request.request_id)
+        if old is not None:
+            # Перестановка в очереди не снимает запрос с пакета
+            claimed = request.request_id in self._claimed
+            self._remove(old)
+            if claimed:
+                self._claimed.add(request.request_id)
+
+        entry = [request.priority, request.deadline, next(self._sequence), request]
+        self._entries[request.request_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _remove(self, entry: list) -> None:
+        if entry[-1] is not self._REMOVED:
+            self._claimed.discard(entry[-1].request_id)
+        entry[-1] = self._REMOVED
+        self._removed += 1
+
+        # Если удалённых записей стало больше живых, перестраиваем кучу, чтобы она не росла бесконечно
+        if self._removed > len(self._entries):
+            self._heap = [entry for entry in self._heap if entry[-1] is not self._REMOVED]
+            heapq.heapify(self._heap)
+            self._removed = 0
+
+    def _drop_dead_head(self) -> None:
+        while self._heap and not self._heap[0][-1]:
+            entry = heapq.heappop(self._heap)
+            request = entry[-1]
+            if request is self._REMOVED:
+                self._removed -= 1
+            else:
+                # Пустой (полностью выполненный) запрос
+                self._entries.pop(request.request_id, None)
+                self._claimed.discard(request.request_id)
+
+    def __contains__(self, request_id: int) -> bool:
+        return request_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[SelectionRequest]:
+        return iter(self.most_urgent())
@@ -0,0 +1,212 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from src.models.product import Product
+
+
+class ProductWrapper:
+    """
+    Состояние ожидающей части заказов по одному товару: суммарное количество и дедлайны запросов.
+    Не потокобезопасен сам по себе - защищается блокировкой шарда, которому принадлежит товар.
+    """
+
+    def __init__(self, count: int = 0, nearest_deadline: Optional[datetime] = None):
+        self.count = count
+        self.deadlines: list[datetime] = list()
+        if nearest_deadline is not None:
+            self.push_deadline(nearest_deadline)
+
+    def push_deadline(self, deadline: Optional[datetime]):
+        if deadline is not None:
+            heapq.heappush(self.deadlines, deadline)
+
+    def nearest_deadline(self) -> Optional[datetime]:
+        if self.deadlines:
+            return self.deadlines[0]
+        return None
+
+    def pop_deadline(self) -> Optional[datetime]:
+        if self.deadlines:
+            return heapq.heappop(self.deadlines)
+        return None
+
+
+class WaitingProduct(NamedTuple):
+    """
+    Снимок ожидающего состояния товара.
+    """
+    count: int
+    nearest_deadline: Optional[datetime]
+
+
+class LockStats:
+    """
+    Счётчики конкуренции за блокировку: сколько раз её брали, сколько раз пришлось ждать и как долго.
+    """
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "contention_ratio": self.contended / self.acquisitions if self.acquisitions else 0.0,
+            "wait_time": self.wait_time,
+            "max_wait": self.max_wait
+        }
+
+
+class MeteredLock:
+    """
+    threading.Lock, считающий случаи конкуренции. Предназначен только для коротких синхронных секций:
+    удерживать его во время await нельзя.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = LockStats()
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - started
+            # Счётчики меняются уже под блокировкой
+            self.stats.contended += 1
+            self.stats.wait_time += waited
+            self.stats.max_wait = max(self.stats.max_wait, waited)
+        self.stats.acquisitions += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+
+
+class ShardedProductState:
+    """
+    Состояние товаров, ожидающих отбора и находящихся в обработке, разбитое на шарды по артикулу.
+
+    Каждый шард защищён своей блокировкой, поэтому операции над разными товарами не конкурируют.
+    Согласованный снимок всех шардов берётся захватом блокировок в фиксированном порядке.
+    """
+
+    def __init__(self, shards: int = 16):
+        self._locks = [MeteredLock() for _ in range(shards)]
+        self._waiting: list[dict[Product, ProductWrapper]] = [dict() for _ in range(shards)]
+        self._processing: list[dict[Product, int]] = [dict() for _ in range(shards)]
+
+    def _shard(self, product: Product) -> int:
+        return hash(product) % len(self._locks)
+
+    @contextmanager
+    def _all_shards(self) -> Iterator[None]:
+        for lock in self._locks:
+            lock.__enter__()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.__exit__(None, None, None)
+
+    def add_waiting(self, product: Product, count: int, deadline: Optional[datetime] = None) -> None:
+        """
+        Добавляет товар из нового запроса в ожидание.
+        """
+        i = self._shard(product)
+        with self._locks[i]:
+            wrapper = self._waiting[i].setdefault(product, ProductWrapper())
+            wrapper.count += count
+            wrapper.push_deadline(deadline)
+
+    def add_waiting_many(self, items: Iterable[tuple[Product, int, Optional[datetime]]]) -> None:
+        """
+        Добавляет в ожидание товары из пачки запросов: каждый шард блокируется один раз.
+        """
+        by_shard: dict[int, list[tuple[Product, int, Optional[datetime]]]] = dict()
+        for item in items:
+            by_shard.setdefault(self._shard(item[0]), list()).append(item)
+
+        for i, shard_items in by_shard.items():
+            with self._locks[i]:
+                for product, count, deadline in shard_items:
+                    wrapper = self._waiting[i].setdefault(product, ProductWrapper())
+                    wrapper.count += count
+                    wrapper.push_deadline(deadline)
+
+    def pop_deadline(self, product: Product) -> Optional[datetime]:
+        """
+        Снимает ближайший дедлайн товара (после того как по нему был поднят флаг).
+        """
+        i = self._shard(product)
+        with self._locks[i]:
+            wrapper = self._waiting[i].get(product)
+            if wrapper is None:
+                return None
+
+            deadline = wrapper.pop_deadline()
+            if wrapper.count <= 0 and not wrapper.deadlines:
+                del self._waiting[i][product]
+            return deadline
+
+    def start_processing(self, product: Product, count: int) -> None:
+        """
+        Переводит количество товара из ожидания в обработку.
+        """
+        i = self._shard(product)
+        with self._locks[i]:
+            wrapper = self._waiting[i].get(product)
+            if wrapper is not None:
+                wrapper.count -= count
+                if wrapper.count <= 0 and not wrapper.deadlines:
+                    del self._waiting[i][product]
+            self._processing[i][product] = self._processing[i].get(product, 0) + count
+
+    def finish_processing(self, product: Product, count: int) -> None:
+        """
+        Отмечает, что количество товара выдано запросам и больше не находится в обработке.
+        """
+        i = self._shard(product)
+        with self._locks[i]:
+            left = self._processing[i].get(product, 0) - count
+            if left > 0:
+                self._processing[i][product] = left
+            else:
+                self._processing[i].pop(product, None)
+
+    def waiting(self) -> dict[Product, WaitingProduct]:
+        """
+        Согласованный снимок ожидающих товаров.
+        """
+        with self._all_shards():
+            return {
+                product: WaitingProduct(wrapper.count, wrapper.nearest_deadline())
+                for shard in self._waiting
+                for product, wrapper in shard.items()
+            }
+
+    def processing(self) -> dict[Product, int]:
+        """
+        Согласованный снимок товаров в обработке.
+        """
+        with self._all_shards():
+            return {product: count for shard in self._processing for product, count in shard.items()}
+
+    def lock_stats(self) -> dict:
+        """
+        Суммарные показатели конкуренции по всем шардам.
+        """
+        total = LockStats()
+        for lock in self._locks:
+            total.acquisitions += lock.stats.acquisitions
+            total.contended += lock.stats.contended
+            total.wait_time += lock.stats.wait_time
+            total.max_wait = max(total.max_wait, lock.stats.max_wait)
+        return total.as_dict()
@@ -1,5 +1,8 @@
 import asyncio
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import Optional
 
 
@@ -30,3 +33,143 @@ class AsyncThreadLocker:
     async def __aexit__(self, exc_type: Optional[type], exc: Optional[BaseException], tb: Optional[BaseException]):
         self.async_locker.release()
         self.thread_locker.release()
+
+
+class TimeBudget:
+    """
+    Бюджет времени на обработку запроса с возможностью кооперативной отмены.
+
+    Этапы конвейера периодически проверяют `expired` и, если бюджет исчерпан или отменён,
+    возвращают лучший найденный к этому моменту результат вместо работы до конца.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, parent: Optional['TimeBudget'] = None):
+        """
+        :param seconds: Длительность бюджета. None - без ограничения по времени.
+        :param parent: Родительский бюджет: его отмена и истечение распространяются на дочерний.
+        """
+        self._deadline = None if seconds is None else time.monotonic() + max(seconds, 0.0)
+        self._parent = parent
+        self._cancelled = threading.Event()
+
+        if parent is not None and parent._deadline is not None:
+            self._deadline = parent._deadline if self._deadline is None else min(self._deadline, parent._deadline)
+
+    @classmethod
+    def until(cls, deadline: Optional[datetime]) -> 'TimeBudget':
+        """
+        Создаёт бюджет, истекающий в момент дедлайна запроса.
+        """
+        if deadline is None:
+            return cls()
+        return cls((deadline - datetime.now()).total_seconds())
+
+    def share(self, fraction: float) -> 'TimeBudget':
+        """
+        Выделяет дочерний бюджет на долю оставшегося времени (для отдельного этапа конвейера).
+        """
+        remaining = self.remaining()
+        return TimeBudget(None if remaining is None else remaining * fraction, parent=self)
+
+    def remaining(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0.0)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self._parent is not None and self._parent.cancelled)
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or (self._deadline is not None and time.monotonic() >= self._deadline)
+
+    def __bool__(self):
+        return not self.expired
+
+
+class MeteredExecutor(ThreadPoolExecutor):
+    """
+    Пул потоков с учётом загрузки: сколько задач выполняется и ждёт в очереди, сколько выполнено
+    и суммарное время работы.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, *args, **kwargs):
+        super().__init__(max_workers, *args, **kwargs)
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.busy_time = 0.0
+        self._metrics_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._metrics_lock:
+            self.submitted += 1
+
+        def run():
+            with self._metrics_lock:
+                self.active += 1
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._metrics_lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.busy_time += elapsed
+
+        return super().submit(run)
+
+    def stats(self) -> dict:
+        with self._metrics_lock:
+            return {
+                "max_workers": self._max_workers,
+                "active": self.active,
+                "queued": self.submitted - self.completed - self.active,
+                "completed": self.completed,
+                "busy_time": self.busy_time,
+                "utilisation": self.active / self._max_workers
+            }
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с фиксированными границами корзин (секунды), как у Prometheus.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def as_dict(self) -> dict:
+        """
+        Накопленные (cumulative) значения корзин, сумма и количество наблюдений.
+        """
+        with self._lock:
+            cumulative, total = list(), 0
+            for count in self.counts:
+                total += count
+                cumulative.append(total)
+            return {
+                "buckets": dict(zip(self.buckets, cumulative)),
+                "count": self.count,
+                "sum": self.sum
+            }
@@ -0,0 +1,83 @@
+"""
+Бенчмарк запросов решателя: выводит план выполнения каждого запроса из src.models.queries,
+используемые индексы и время выполнения.
+
+Запуск из корня репозитория (нужна настроенная БД из env/config.env):
+
+    python -m src.benchmarks.query_plans [--runs N]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from src.models.queries import BENCHMARK
+from src.parsers.db_parser import db
+
+
+def sample_parameters(connection) -> dict:
+    """
+    Значения параметров запросов, взятые из текущих данных склада: самый распространённый артикул.
+    """
+    sku = connection.exec_driver_sql(
+        "SELECT product_sku FROM cell WHERE product_sku IS NOT NULL GROUP BY product_sku "
+        "ORDER BY count(*) DESC LIMIT 1"
+    ).scalar() or 0
+    return {"sku": sku}
+
+
+def plan_nodes(plan: dict, depth: int = 0):
+    """
+    Узлы плана в порядке обхода: (глубина, тип узла, индекс, таблица).
+    """
+    yield depth, plan['Node Type'], plan.get('Index Name'), plan.get('Relation Name')
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child, depth + 1)
+
+
+def bind(compiled, parameters: dict) -> dict:
+    return {name: parameters.get(name, value) for name, value in compiled.params.items()}
+
+
+def explain(connection, query, parameters: dict) -> dict:
+    compiled = query.compile(dialect=connection.dialect)
+    params = bind(compiled, parameters)
+    result = connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}", params).scalar()
+    return (json.loads(result) if isinstance(result, str) else result)[0]
+
+
+def measure(connection, query, parameters: dict, runs: int) -> list[float]:
+    params = bind(query.compile(dialect=connection.dialect), parameters)
+    timings = list()
+    for _ in range(runs):
+        started = time.perf_counter()
+        connection.execute(query, params).all()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Планы и время выполнения запросов решателя")
+    parser.add_argument('--runs', type=int, default=50, help="Количество замеров каждого запроса")
+    args = parser.parse_args()
+
+    with db.engine.connect() as connection:
+        parameters = sample_parameters(connection)
+        print(f"Параметры: {parameters}")
+
+        for name, query in BENCHMARK.items():
+            explained = explain(connection, query, parameters)
+            timings = measure(connection, query, parameters, args.runs)
+
+            print(f"\n== {name} ==")
+            for depth, node, index, relation in plan_nodes(explained['Plan']):
+                target = f" [{index}]" if index else (f" on {relation}" if relation else "")
+                print(f"{'  ' * depth}{node}{target}")
+            print(f"планирование {explained['Planning Time']:.3f} мс, "
+                  f"выполнение {explained['Execution Time']:.3f} мс (EXPLAIN ANALYZE)")
+            print(f"клиент: медиана {statistics.median(timings):.3f} мс, "
+                  f"максимум {max(timings):.3f} мс за {args.runs} запусков")
+
+
+if __name__ == '__main__':
+    main()
@@ -59,3 +59,21 @@ class IncompleteMapException(BuildException):
     Например, если переданный список списков не является прямоугольной матрицей.
     """
     pass
+
+
+class UnknownUploadException(BuildException):
+    """
+    Исключение, вызываемое при обращении к несуществующей или уже завершённой загрузке карты склада.
+    """
+    pass
+
+
+class UploadOffsetException(BuildException):
+    """
+    Исключение, вызываемое, если порция карты пришла не с той строки, которую ожидает сервер.
+    Например, если клиент пропустил порцию после переподключения. Атрибут next_row - ожидаемая строка.
+    """
+
+    def __init__(self, message: str, next_row: int):
+        super().__init__(message)
+        self.next_row = next_row
@@ -1,21 +1,137 @@
+"""
+Настройка журналирования.
+
+Записи не пишутся в файл и консоль из потока, который их создал: корневой логгер только кладёт их
+в очередь (QueueHandler), а запись на диск и в терминал выполняет отдельный поток (QueueListener).
+Поэтому цикл событий не ждёт ввода-вывода при каждом сообщении в журнал.
+"""
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from src.parsers.config_parser import config
+
+
+def parse_levels(spec: str) -> dict[str, int]:
+    """
+    Разбирает уровни модулей из строки вида "websockets=INFO,src.server.server=WARNING".
+    """
+    levels = dict()
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Неизвестный уровень журналирования в '{item}'")
+        levels[name.strip()] = level
+    return levels
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Пропускает не больше burst записей с одной строки кода за interval секунд.
+    О пропущенных записях сообщает следующая пропущенная фильтром запись с той же строки.
+    """
+
+    def __init__(self, interval: float, burst: int):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        # (файл, строка) -> (начало окна, записей в окне, пропущено)
+        self._windows: dict[tuple[str, int], tuple[float, int, int]] = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, passed = now, 0
+            if passed >= self.burst:
+                self._windows[key] = (started, passed, suppressed + 1)
+                return False
+            self._windows[key] = (started, passed + 1, 0)
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} (пропущено похожих записей: {suppressed})"
+            record.args = None
+        return True
+
+
+_rate_limit = RateLimitFilter(config.logsampleinterval, config.logsampleburst)
+
+
+def sampled(name: str) -> logging.Logger:
+    """
+    Логгер для частых событий (каждое входящее сообщение, каждый новый запрос):
+    записи уровней ниже WARNING ограничиваются по частоте.
+    """
+    logger = logging.getLogger(name)
+    if _rate_limit not in logger.filters:
+        logger.addFilter(_rate_limit)
+    return logger
+
+
+def _file_handler(path: str, main: bool) -> logging.Handler:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if not main:
+        # Дочерние процессы (процесс решателя) дописывают в общий лог; файл ротирует основной процесс,
+        # WatchedFileHandler после ротации переоткрывает его
+        return logging.handlers.WatchedFileHandler(path, encoding="utf-8")
+
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=config.logmaxbytes,
+                                                   backupCount=config.logbackups, encoding="utf-8")
+    # Журнал прошлого запуска сохраняется в app.log.1 вместо перезаписи
+    if config.logbackups and os.path.getsize(path):
+        handler.doRollover()
+    return handler
+
+
+def setup(main: Optional[bool] = None) -> logging.handlers.QueueListener:
+    """
+    Подключает к корневому логгеру очередь записей и запускает поток, который пишет их в файл и консоль.
+
+    :param main: Основной ли это процесс (по умолчанию определяется по имени процесса).
+    """
+    if main is None:
+        # Имя процесса задаётся до импорта модулей в дочернем процессе, в отличие от parent_process()
+        main = multiprocessing.current_process().name == "MainProcess"
+
+    file_handler = _file_handler(config.logfile, main)
+    file_formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
+    file_handler.setFormatter(file_formatter)
 
+    console_handler = logging.StreamHandler()
+    console_formatter = logging.Formatter("[%(levelname)s] %(message)s")
+    console_handler.setFormatter(console_formatter)
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
 
-if logger.hasHandlers():
-    logger.handlers.clear()
+    root = logging.getLogger()
+    if root.hasHandlers():
+        root.handlers.clear()
+    root.setLevel(config.loglevel.upper())
+    root.addHandler(logging.handlers.QueueHandler(records))
+    for name, level in parse_levels(config.loglevels).items():
+        logging.getLogger(name).setLevel(level)
 
-file_handler = logging.FileHandler("logs/app.log", mode="w", encoding="utf-8")
-file_handler.setLevel(logging.DEBUG)
-file_formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
-file_handler.setFormatter(file_formatter)
+    listener.start()
+    # При завершении процесса оставшиеся в очереди записи дописываются
+    atexit.register(listener.stop)
+    return listener
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-console_formatter = logging.Formatter("[%(levelname)s] %(message)s")
-console_handler.setFormatter(console_formatter)
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+listener = setup()
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from src.server.base import Base
 
 
 class Cell(Base):
     __tablename__ = 'cell'
+    # Совпадает с индексом из миграции V4__add_indexes.sql
+    __table_args__ = (
+        Index('ix_cell_product_sku', 'product_sku', postgresql_where=text('product_sku IS NOT NULL')),
+    )
 
     cell_id = Column(Integer, primary_key=True)
     x = Column(Integer, nullable=False)
@@ -0,0 +1,157 @@
+import io
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.exceptions.warehouse_exceptions import (IllegalSizeException, IncompleteMapException, WarehouseException,
+                                                 UnknownUploadException, UploadOffsetException)
+from src.parsers.db_parser import db
+
+
+class LayoutUpload:
+    """
+    Загрузка карты склада по частям.
+
+    Строки карты приходят порциями и сразу записываются через COPY во временную (UNLOGGED) таблицу загрузки,
+    после чего отбрасываются - вся карта в памяти не хранится. Каждая порция фиксируется отдельной транзакцией,
+    поэтому после обрыва соединения клиент продолжает с `next_row`. Склад заменяется только при завершении
+    загрузки (см. Warehouse.commit_upload) одной транзакцией.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        if rows <= 0 or cols <= 0:
+            raise IllegalSizeException("Нельзя создать склад с нулём ячеек")
+
+        self.upload_id = uuid.uuid4().hex[:16]
+        # Имя таблицы строится только из сгенерированного сервером идентификатора
+        self.table = f"cell_upload_{self.upload_id}"
+        self.rows = rows
+        self.cols = cols
+        self.next_row = 0
+        self.cells = 0
+        self.touched = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self.next_row == self.rows
+
+    def create(self) -> None:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(f"CREATE UNLOGGED TABLE {self.table} (x INTEGER NOT NULL, y INTEGER NOT NULL)")
+
+    def write(self, offset: int, rows: Sequence) -> int:
+        """
+        Записывает порцию строк карты, начиная со строки offset.
+        Повторная отправка уже записанной порции (например, если подтверждение не дошло) ничего не меняет.
+
+        :return: Номер следующей ожидаемой строки.
+        :raises UploadOffsetException: Если порция начинается не с ожидаемой строки.
+        :raises IncompleteMapException: Если длина строки не совпадает с шириной карты.
+        """
+        with self._lock:
+            self.touched = time.monotonic()
+            if offset + len(rows) <= self.next_row:
+                return self.next_row
+            if offset != self.next_row:
+                raise UploadOffsetException(f"Ожидается порция со строки {self.next_row}", self.next_row)
+            if offset + len(rows) > self.rows:
+                raise IllegalSizeException("Порция выходит за пределы заявленного размера карты")
+
+            buffer = io.StringIO()
+            cells = 0
+            for x, row in enumerate(rows, start=offset):
+                if len(row) != self.cols:
+                    raise IncompleteMapException("Переданная карта ячеек имеет непрямоугольный размер")
+                ys = np.flatnonzero(np.asarray(row, dtype=bool))
+                buffer.writelines(f"{x},{y}\n" for y in ys)
+                cells += len(ys)
+            buffer.seek(0)
+
+            connection = db.engine.raw_connection()
+            try:
+                connection.cursor().copy_expert(f"COPY {self.table} (x, y) FROM STDIN WITH (FORMAT csv)", buffer)
+                connection.commit()
+            except (SQLAlchemyError, db.engine.dialect.dbapi.Error) as e:
+                connection.rollback()
+                logging.error(f"Ошибка при записи порции карты склада: {e}")
+                raise WarehouseException("Не удалось записать порцию карты из-за ошибки базы данных")
+            finally:
+                connection.close()
+
+            self.next_row += len(rows)
+            self.cells += cells
+            return self.next_row
+
+    def drop(self) -> None:
+        try:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {self.table}")
+        except SQLAlchemyError as e:
+            logging.error(f"Не удалось удалить таблицу загрузки {self.table}: {e}")
+
+    def status(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "next_row": self.next_row,
+            "rows": self.rows,
+            "cols": self.cols,
+            "cells": self.cells
+        }
+
+
+class LayoutUploads:
+    """
+    Незавершённые загрузки карт. Загрузки, к которым долго не обращались, удаляются вместе с таблицами.
+    """
+
+    def __init__(self, ttl: float = 60 * 60):
+        self.ttl = ttl
+        self._uploads: dict[str, LayoutUpload] = dict()
+        self._lock = threading.Lock()
+
+    def begin(self, rows: int, cols: int) -> LayoutUpload:
+        self.expire()
+        upload = LayoutUpload(rows, cols)
+        upload.create()
+        with self._lock:
+            self._uploads[upload.upload_id] = upload
+        logging.info(f"Начата загрузка карты склада {upload.upload_id} ({rows}x{cols})")
+        return upload
+
+    def get(self, upload_id: str) -> LayoutUpload:
+        """
+        :raises UnknownUploadException: Если загрузки нет.
+        """
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            raise UnknownUploadException(f"Загрузка {upload_id} не найдена")
+        return upload
+
+    def pop(self, upload_id: str) -> Optional[LayoutUpload]:
+        with self._lock:
+            return self._uploads.pop(upload_id, None)
+
+    def abort(self, upload_id: str) -> bool:
+        upload = self.pop(upload_id)
+        if upload is None:
+            return False
+        upload.drop()
+        logging.info(f"Загрузка карты склада {upload_id} отменена")
+        return True
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [upload_id for upload_id, upload in self._uploads.items() if now - upload.touched > self.ttl]
+        return sum(self.abort(upload_id) for upload_id in expired)
+
+    def __len__(self) -> int:
+        return len(self._uploads)
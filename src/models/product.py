@@ -1,4 +1,3 @@
-from pandas.io.sql import execute
 from sqlalchemy import Column, Integer, String, Float
 from sqlalchemy.orm import relationship
 from src.server.base import Base
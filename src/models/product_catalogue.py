@@ -0,0 +1,88 @@
+import logging
+import threading
+from typing import Optional
+
+from src.models.product import Product
+from src.models.queries import PRODUCTS
+from src.parsers.db_parser import db
+
+
+class ProductCatalogue:
+    """
+    Кэш каталога товаров в памяти.
+
+    Товары загружаются из БД одним запросом (без связанных ячеек) при первом обращении и хранятся
+    отсоединёнными от сессии. Каталог сбрасывается методом `invalidate` при создании или удалении
+    типов товаров, счётчик `version` позволяет зависимым кэшам заметить изменение.
+    Вместе с товарами заранее готовится сериализуемое представление для команды list_product_types.
+    Из цикла событий каталог перечитывается методом `reload` через асинхронную сессию.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._data: Optional[tuple[tuple[Product, ...], dict[int, Product], list[dict]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> tuple[tuple[Product, ...], dict[int, Product], list[dict]]:
+        with db.session_scope(readonly=True) as session:
+            products = tuple(session.scalars(PRODUCTS).all())
+            session.expunge_all()
+        return self._index(products)
+
+    async def reload(self) -> None:
+        """
+        Перечитывает каталог из БД, не блокируя цикл событий.
+        """
+        async with db.async_session() as session:
+            products = tuple((await session.scalars(PRODUCTS)).all())
+            session.expunge_all()
+
+        data = self._index(products)
+        with self._lock:
+            self._data = data
+            self.version += 1
+
+    @staticmethod
+    def _index(products: tuple[Product, ...]) -> tuple[tuple[Product, ...], dict[int, Product], list[dict]]:
+        by_sku = {product.sku: product for product in products}
+        payload = [
+            {column.name: getattr(product, column.name) for column in Product.__table__.columns}
+            for product in products
+        ]
+        logging.debug(f"Каталог товаров загружен: {len(products)} типов")
+        return products, by_sku, payload
+
+    def _current(self) -> tuple[tuple[Product, ...], dict[int, Product], list[dict]]:
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._load()
+                data = self._data
+        return data
+
+    def products(self) -> tuple[Product, ...]:
+        return self._current()[0]
+
+    def by_sku(self) -> dict[int, Product]:
+        return self._current()[1]
+
+    def get(self, sku: int) -> Optional[Product]:
+        return self.by_sku().get(sku)
+
+    def payload(self) -> list[dict]:
+        """
+        Готовое к сериализации описание всех товаров.
+        """
+        return self._current()[2]
+
+    def invalidate(self) -> None:
+        """
+        Сбрасывает кэш: следующее обращение перечитает каталог из БД.
+        """
+        with self._lock:
+            self._data = None
+            self.version += 1
+
+    def __len__(self) -> int:
+        return len(self.products())
@@ -0,0 +1,32 @@
+"""
+Набор заранее построенных Core-запросов для чтений решателя и снимка склада.
+
+Запросы собираются один раз при импорте и выполняются без ORM: без identity map, без загрузки связей
+и без создания объектов моделей. Скомпилированная форма запроса кэшируется SQLAlchemy,
+а asyncpg дополнительно подготавливает её на стороне сервера.
+Снимок и каталог читают таблицы целиком в порядке первичного ключа, отдельные индексы им не нужны.
+"""
+from sqlalchemy import bindparam, select
+
+from src.models.cell import Cell
+from src.models.product import Product
+
+# Полный снимок ячеек для WarehouseState (последовательное чтение, порядок по первичному ключу)
+SNAPSHOT_CELLS = (
+    select(Cell.cell_id, Cell.x, Cell.y, Cell.product_sku, Cell.count)
+    .order_by(Cell.cell_id)
+)
+
+# Каталог товаров без связанных ячеек
+PRODUCTS = select(Product).order_by(Product.sku)
+
+# Ячейки с товаром данного артикула: тот же доступ, что у действия внешнего ключа ON DELETE SET NULL
+# при удалении типа товара (delete_product_type), обслуживается индексом ix_cell_product_sku
+CELLS_BY_SKU = select(Cell.cell_id).where(Cell.product_sku == bindparam('sku'))
+
+# Запросы, планы которых выводит бенчмарк src/benchmarks/query_plans.py
+BENCHMARK = {
+    "snapshot_cells": SNAPSHOT_CELLS,
+    "products": PRODUCTS,
+    "cells_by_sku": CELLS_BY_SKU,
+}
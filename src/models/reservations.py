@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from collections.abc import Hashable, Iterable, Mapping
+from typing import Optional
+
+
+class ReservationLedger:
+    """
+    Журнал резервов товара под выданные маршруты.
+
+    Когда маршрут выдаётся работнику, под него резервируется товар в конкретных ячейках. Резерв снимается
+    при отмене маршрута, превращается в списание при подтверждении отбора и истекает по таймауту.
+    Зарезервированное количество по ячейке хранится готовым, поэтому `available = count - reserved`
+    считается за O(1) и может использоваться при каждой проверке допустимости решения.
+    """
+
+    def __init__(self, ttl: float = 30 * 60):
+        """
+        :param ttl: Время жизни резерва в секундах.
+        """
+        self.ttl = ttl
+        self._holds: dict[Hashable, dict[int, int]] = dict()
+        self._expires: dict[Hashable, float] = dict()
+        self._timeline: list[tuple[float, int, Hashable]] = list()
+        self._reserved: dict[int, int] = dict()
+        # Ячейки, которые сейчас удаляются со склада: новые резервы в них не оформляются
+        self._retiring: set[int] = set()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, hold_id: Hashable, allocation: Mapping[int, int], ttl: Optional[float] = None) -> None:
+        """
+        Резервирует товар по ячейкам. Повторный резерв с тем же идентификатором заменяет предыдущий.
+
+        :param hold_id: Идентификатор резерва (например, идентификатор маршрута).
+        :param allocation: Количество товара по идентификаторам ячеек.
+        :param ttl: Время жизни резерва. По умолчанию - self.ttl.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._release(hold_id)
+            allocation = {cell_id: count for cell_id, count in allocation.items() if cell_id not in self._retiring}
+            self._holds[hold_id] = allocation
+            self._expires[hold_id] = expires
+            for cell_id, count in allocation.items():
+                self._reserved[cell_id] = self._reserved.get(cell_id, 0) + count
+
+            self._sequence += 1
+            heapq.heappush(self._timeline, (expires, self._sequence, hold_id))
+
+    def release(self, hold_id: Hashable) -> dict[int, int]:
+        """
+        Снимает резерв.
+
+        :return: Снятое количество товара по ячейкам (пустой словарь, если резерва не было).
+        """
+        with self._lock:
+            return self._release(hold_id)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """
+        Снимает все резервы с истёкшим сроком жизни.
+
+        :return: Количество снятых резервов.
+        """
+        now = time.monotonic() if now is None else now
+        expired = 0
+        with self._lock:
+            while self._timeline and self._timeline[0][0] <= now:
+                expires, _, hold_id = heapq.heappop(self._timeline)
+                # Запись устарела, если резерв уже снят или переоформлен с другим сроком
+                if self._expires.get(hold_id) == expires:
+                    self._release(hold_id)
+                    expired += 1
+        return expired
+
+    def reserved(self, cell_id: int) -> int:
+        return self._reserved.get(cell_id, 0)
+
+    def available(self, cell_id: int, count: int) -> int:
+        """
+        Доступное для новых маршрутов количество товара в ячейке.
+        """
+        if cell_id in self._retiring:
+            return 0
+        return max(count - self._reserved.get(cell_id, 0), 0)
+
+    def retire(self, cell_ids: Iterable[int]) -> list[int]:
+        """
+        Атомарно проверяет, что в ячейках нет резервов, и запрещает новые резервы в них до вызова unretire.
+        Проверка и запрет выполняются под одной блокировкой, поэтому между ними резерв оформить нельзя.
+
+        :return: Зарезервированные ячейки; если список не пуст, ничего не запрещается.
+        """
+        cell_ids = list(cell_ids)
+        with self._lock:
+            busy = [cell_id for cell_id in cell_ids if self._reserved.get(cell_id)]
+            if not busy:
+                self._retiring.update(cell_ids)
+            return busy
+
+    def unretire(self, cell_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._retiring.difference_update(cell_ids)
+
+    def hold(self, hold_id: Hashable) -> dict[int, int]:
+        with self._lock:
+            return dict(self._holds.get(hold_id, dict()))
+
+    def _release(self, hold_id: Hashable) -> dict[int, int]:
+        allocation = self._holds.pop(hold_id, dict())
+        self._expires.pop(hold_id, None)
+        for cell_id, count in allocation.items():
+            left = self._reserved.get(cell_id, 0) - count
+            if left > 0:
+                self._reserved[cell_id] = left
+            else:
+                self._reserved.pop(cell_id, None)
+        return allocation
+
+    def __len__(self) -> int:
+        return len(self._holds)
+
+    def __contains__(self, hold_id: Hashable) -> bool:
+        return hold_id in self._holds
@@ -1,10 +1,26 @@
-from typing import Iterable
+from enum import IntEnum
+from itertools import count as counter
+from typing import Iterable, Optional
 
 from datetime import datetime, timedelta
 
 from src.exceptions.selection_exceptions import UnsupportedFormat, BadInstance
 from src.models.product import Product
 
+_request_ids = counter(1)
+
+DEFAULT_DEADLINE = timedelta(seconds=10)
+
+
+class Priority(IntEnum):
+    """
+    Класс срочности запроса. Меньшее значение обслуживается раньше независимо от дедлайна.
+    """
+    URGENT = 0
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
 
 class SelectionRequest:
     """
@@ -13,33 +29,46 @@ class SelectionRequest:
     Атрибуты:
         data (dict): Словарь, содержащий продукты и их количество.
             Ключ - объект класса Product, значение - количество.
+        request_id (int): Уникальный в рамках процесса идентификатор запроса.
+        deadline (datetime): Момент, к которому запрос должен быть собран.
+        priority (Priority): Класс срочности запроса.
+        covers (set[int]): Для пакета, собранного решателем, - идентификаторы запросов, которые он выполняет целиком.
     """
 
-    def __init__(self, *args):
+    def __init__(self, *args, deadline: Optional[datetime] = None, priority: Priority = Priority.NORMAL):
         """
         Инициализирует объект запроса на выборку продуктов.
 
         Args:
             *args: Список кортежей, где каждый кортеж состоит из объекта Product
                 и количества этого продукта (int).
+            deadline: Срок выполнения запроса. По умолчанию - через 10 секунд после создания.
+            priority: Класс срочности запроса.
 
         Пример:
             request = SelectionRequest((product1, 5), (product2, 10))
         """
         self.data = dict()  # Словарь для хранения продуктов и их количества.
+        self.request_id = next(_request_ids)
         self.add_products_from_list(args)
-        self.deadline = datetime.now() + timedelta(seconds=10)
+        self.deadline = deadline if deadline is not None else datetime.now() + DEFAULT_DEADLINE
+        self.priority = Priority(priority)
+        self.covers: set[int] = set()
 
     def __ior__(self, other):
         for product, count in other.items():
             self.data[product] = self.data.get(product, 0) + count
+        # Объединённый запрос наследует самый ранний дедлайн и самый срочный класс
+        self.deadline = min(self.deadline, other.deadline)
+        self.priority = min(self.priority, other.priority)
+        self.covers |= other.covers
         return self
 
     def __or__(self, other):
         data = self.data.copy()
         for product, count in other.items():
             self.data[product] = self.data.get(product, 0) + count
-        return SelectionRequest(*((key, data[key]) for key in data))
+        return SelectionRequest(*((key, data[key]) for key in data), deadline=self.deadline, priority=self.priority)
 
     def __sub__(self, other):
         data = self.data.copy()
@@ -48,7 +77,7 @@ class SelectionRequest:
                 data[product] -= count
                 if data[product] <= 0:
                     del data[product]
-        return SelectionRequest(*((key, data[key]) for key in data))
+        return SelectionRequest(*((key, data[key]) for key in data), deadline=self.deadline, priority=self.priority)
 
     def __isub__(self, other):
         for product, count in other.items():
@@ -71,7 +100,7 @@ class SelectionRequest:
         return str(self.data)
 
     def __lt__(self, other):
-        return self.deadline.__lt__(other.deadline)
+        return (self.priority, self.deadline) < (other.priority, other.deadline)
 
     def __getitem__(self, item):
         if item in self:
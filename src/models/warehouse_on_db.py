@@ -1,26 +1,52 @@
+import io
 import logging
 import random
+from collections.abc import Callable
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import joinedload
-from collections.abc import Mapping
+from sqlalchemy.orm import selectinload
+from collections.abc import Mapping, Sequence
 from typing import Optional
 
+import numpy as np
+
 from src.exceptions.warehouse_exceptions import (FireTooManyWorkersException, EmptyCellException, WarehouseException,
                                                  EmptyListOfProductsException, WrongTypeOfCellException,
-                                                 IncompleteMapException)
+                                                 IncompleteMapException, IllegalSizeException)
 from src.models.product import Product
 from src.models.cell import Cell
 from src.models.zone import Zone
 from src.models.user import User
 from src.models.selection_request import SelectionRequest
+from src.models.warehouse_state import WarehouseState, CellRecord
+from src.models.product_catalogue import ProductCatalogue
+from src.models.layout_upload import LayoutUpload, LayoutUploads
+from src.algorithm.precompute import PrecomputeCache
+from src.logging.logger import sampled
 from src.parsers.db_parser import db
 
+# Обработчик прогресса длительных операций: (этап, сделано, всего)
+Progress = Callable[[str, int, int], None]
+# Новые запросы создаются постоянно, записи о них ограничиваются по частоте
+requests_log = sampled(__name__)
+
 
 class Warehouse:
     def __init__(self, solver):
         logging.debug("Инициализация модели склада")
-        self.session = db.session
         self.solver = solver
+        self.catalogue = ProductCatalogue()
+
+        # Снимок ячеек в памяти: чтения идут из него, изменения пачками записываются в БД фоновым потоком
+        self.state = WarehouseState()
+        self.state.reload(self._products_by_sku())
+        self.state.start()
+
+        # Структуры, зависящие только от раскладки, переживают перезапуск в дисковом кэше
+        self.precomputed = PrecomputeCache()
+        # Незавершённые загрузки карты склада по частям
+        self.uploads = LayoutUploads()
+        self._walkable: tuple[str, np.ndarray] = ('', np.ones((0, 0), dtype=bool))
 
         self.size = self.init_size()
         self.start_cords = (51, 190)
@@ -41,61 +67,118 @@ class Warehouse:
         return self.size[1]
 
     def init_size(self) -> tuple[int, int]:
-        all_cells = self.get_all_cells()
-        width = max({*map(lambda cell: cell.x, all_cells)} | {0})
-        height = max({*map(lambda cell: cell.y, all_cells)} | {0})
+        return self.state.size()
+
+    def version(self) -> int:
+        """
+        Версия состояния склада: меняется при любом изменении ячеек.
+        """
+        return self.state.version
+
+    def _products_by_sku(self) -> dict[int, Product]:
+        return self.catalogue.by_sku()
 
-        return width, height
+    async def refresh_products(self) -> None:
+        """
+        Перечитывает каталог товаров после изменения типов товаров в БД.
+        """
+        await self.catalogue.reload()
+        self.state.set_products(self.catalogue.by_sku())
 
-    def get_all_cells(self) -> list[Cell]:
-        return self.session.query(Cell).all()
+    def get_all_cells(self) -> list[CellRecord]:
+        return self.state.cells()
 
-    def get_cells_by_product_sku(self, sku: int) -> list[Cell]:
-        return self.session.query(Cell).options(joinedload("*")).filter(Cell.product_sku == sku).all()
+    def get_cells_by_product_sku(self, sku: int) -> list[CellRecord]:
+        return self.state.cells_by_sku(sku)
 
-    def get_cell_by_id(self, cell_id: int) -> Cell:
-        return self.session.query(Cell).filter(Cell.cell_id == cell_id).first()
+    def get_cell_by_id(self, cell_id: int) -> Optional[CellRecord]:
+        return self.state.cell_by_id(cell_id)
 
     def get_zones_by_user(self, user_id: int) -> list[Zone]:
-        user = self.session.query(User).filter(User.user_id == user_id).first()
-        return user.zones if user else list()
+        with db.session_scope(readonly=True) as session:
+            user = session.scalar(
+                select(User).options(selectinload(User.zones)).where(User.user_id == user_id)
+            )
+            return list(user.zones) if user else list()
+
+    async def fetch_zones_by_user(self, user_id: int) -> list[Zone]:
+        """
+        Асинхронный вариант get_zones_by_user для обработчиков в цикле событий.
+        """
+        async with db.async_session() as session:
+            user = await session.scalar(
+                select(User).options(selectinload(User.zones)).where(User.user_id == user_id)
+            )
+            return list(user.zones) if user else list()
 
     def get_all_products(self) -> list[Product]:
-        return self.session.query(Product).options(joinedload("*")).all()
+        return list(self.catalogue.products())
 
     def add_product_to_cell(self, cell_id: int, count: int, product_sku: Optional[int] = None, commit: bool = True) -> bool:
-        cell = self.session.query(Cell).filter(Cell.cell_id == cell_id).first()
-        if cell:
-            if cell.product_sku is None:
-                if product_sku is None:
-                    raise RuntimeError("Невозможно определить тип товара в ячейке")
-                cell.product_sku = product_sku
+        """
+        Добавляет товар в ячейку. Изменение сразу видно в снимке склада, а в БД записывается пачкой.
 
-            cell.count += count
+        Args:
+            commit (bool): Попросить поток записи сбросить изменения в БД, не дожидаясь таймера.
+        """
+        if not self.state.add(cell_id, count, product_sku):
+            return False
 
-            if commit:
-                self.session.commit()
-            return True
-        return False
+        if commit:
+            self.state.request_flush()
+        return True
 
     def remove_product_from_cell(self, cell_id: int, count: int) -> bool:
-        cell = self.session.query(Cell).filter(Cell.cell_id == cell_id).first()
-        if cell and cell.count >= count:
-            cell.count -= count
-
-            if cell.count <= 0:
-                cell.product_sku = None
-
-            self.session.commit()
-            return True
-        return False
+        """
+        Забирает товар из ячейки. Списание попадает в журнал остатков и записывается в БД
+        вместе с другими изменениями по порогу размера журнала или по таймеру.
+        """
+        return self.state.remove(cell_id, count)
 
     def is_moving_cell(self, cell: tuple[int, int]) -> bool:
         x, y = cell
-        if x > max(self.size) or y > max(self.size) or x < 0 or y < 0:
-            return True
+        walkable = self.walkable_grid()
+        if 0 <= x < walkable.shape[0] and 0 <= y < walkable.shape[1]:
+            return bool(walkable[x, y])
+        return True
+
+    def walkable_grid(self) -> np.ndarray:
+        """
+        Сетка проходимости: walkable[x, y] истинно, если в точке нет ячейки хранения.
+        Точки за пределами сетки проходимы. Сетка пересчитывается только при изменении раскладки.
+        """
+        layout = self.state.layout_hash
+        if self._walkable[0] != layout:
+            grid = self.precomputed.get_or_build('walkable', layout, self._build_walkable)
+            self._walkable = (layout, grid)
+        return self._walkable[1]
 
-        return not any(self.session.query(Cell).filter(Cell.x == x, Cell.y == y).all())
+    def _patch_walkable(self, grid: np.ndarray, removed: list[tuple[int, int]], added: list[tuple[int, int]]) -> None:
+        """
+        Переносит точечное изменение раскладки на построенную до него сетку проходимости вместо пересчёта.
+        """
+        grid = np.array(grid)  # копия: сетка из кэша отображена в память только для чтения
+        for x, y in removed:
+            if x < grid.shape[0] and y < grid.shape[1]:
+                grid[x, y] = True
+        if added:
+            width = max(grid.shape[0], max(x for x, _ in added) + 1)
+            height = max(grid.shape[1], max(y for _, y in added) + 1)
+            if (width, height) != grid.shape:
+                grid = np.pad(grid, ((0, width - grid.shape[0]), (0, height - grid.shape[1])), constant_values=True)
+            grid[tuple(np.array(added).T)] = False
+        self._walkable = (self.state.layout_hash, grid)
+
+    def _build_walkable(self) -> np.ndarray:
+        arrays = self.state.arrays()
+        inside = (arrays['x'] >= 0) & (arrays['y'] >= 0)
+        xs, ys = arrays['x'][inside], arrays['y'][inside]
+        if not len(xs):
+            return np.ones((0, 0), dtype=bool)
+
+        grid = np.ones((int(xs.max()) + 1, int(ys.max()) + 1), dtype=bool)
+        grid[xs, ys] = False
+        return grid
 
     def add_workers(self, count: int) -> int:
         """
@@ -179,19 +262,23 @@ class Warehouse:
             result.append((product, random.randint(1, 5)))
 
         result = SelectionRequest(*result)
-        logging.debug(f"Добавлен новый запрос на отбор товаров: {result}")
+        requests_log.debug(f"Добавлен новый запрос на отбор товаров: {result}")
         return result
 
-    def fill(self) -> None:
+    def fill(self, progress: Optional[Progress] = None) -> None:
         """
-        Автоматически заполняет склад продуктами случайным образом.
+        Автоматически заполняет пустые ячейки склада продуктами случайным образом.
+        Случайное заполнение считается векторно и записывается в БД одним UPDATE.
+
+        Args:
+            progress (Progress): Необязательный обработчик прогресса (этап, сделано, всего).
 
         Raises:
             EmptyCellException: Если на складе нет ячеек.
         """
         logging.debug("Заполнение склада товарами")
-        cells = self.get_all_cells()
-        if not all(self.size) or not cells:
+        arrays = self.state.arrays()
+        if not all(self.size) or not len(arrays['cell_id']):
             logging.error("Ошибка при заполнении склада")
             raise EmptyCellException("На складе нет ни одной ячейки")
 
@@ -200,23 +287,34 @@ class Warehouse:
             logging.warn("Ошибка при заполнении склада")
             raise EmptyListOfProductsException("В базе данных нет ни одного продукта для создания запроса")
 
-        for cell in cells:
-            cell_id, x, y = cell.cell_id, cell.x, cell.y
+        rng = np.random.default_rng()
+        empty = arrays['cell_id'][arrays['count'] == 0]
+        cell_ids = empty[rng.random(len(empty)) < self.PROBABILITY_OF_FILLING_CELL]
+        chosen = rng.integers(len(products), size=len(cell_ids))
 
-            if self.PROBABILITY_OF_FILLING_CELL > random.random():
-                product = random.choice(products)
-                count = random.randint(1, product.max_amount)
-                self.add_product_to_cell(cell_id, count, product.sku, commit=False)
-        self.session.commit()
+        skus = np.array([product.sku for product in products], dtype=np.int64)[chosen]
+        limits = np.array([product.max_amount or self.MAX_COUNT_TO_ADD_ON_EMPTY_CELL for product in products],
+                          dtype=np.int64)[chosen]
+        counts = rng.integers(1, limits + 1) if len(cell_ids) else np.empty(0, dtype=np.int64)
+
+        try:
+            self.state.assign(cell_ids, skus, counts)
+        except SQLAlchemyError as e:
+            logging.error(f"Ошибка при работе с базой данных: {e}")
+            raise WarehouseException("Не удалось заполнить склад из-за ошибки базы данных")
 
-        logging.debug("Склад успешно заполнен")
+        if progress is not None:
+            progress("fill", len(cell_ids), len(cell_ids))
+        logging.debug(f"Склад успешно заполнен: заполнено {len(cell_ids)} ячеек")
 
-    def build(self, layout: list[list[bool]]) -> None:
+    def build(self, layout: list[list[bool]], progress: Optional[Progress] = None) -> None:
         """
         Создает склад на основе переданной карты (layout).
+        Ячейки записываются в БД через COPY порциями строк, после каждой порции вызывается progress.
 
         Args:
             layout (list[list[bool]]): Прямоугольная карта склада, где True - ячейка для складирования, False - проход.
+            progress (Progress): Необязательный обработчик прогресса (этап, сделано, всего).
 
         Raises:
             IllegalSizeException: Если передана пустая или некорректная карта.
@@ -225,39 +323,166 @@ class Warehouse:
         if not len(layout) or not len(layout[0]):
             logging.warn("Невозможно построить склад по заданным параметрам")
             raise IllegalSizeException("Нельзя создать склад с нулём ячеек")
+        if any(len(row) != len(layout[0]) for row in layout):
+            raise IncompleteMapException("Переданная карта ячеек имеет непрямоугольный размер")
+
         self.size = (len(layout), len(layout[0]))
         logging.info("Построение модели склада по заданным параметрам")
 
+        chunk = max(1, len(layout) // 20)
+        connection = db.engine.raw_connection()
         try:
-            # Удаление всех существующих ячеек
-            self.session.query(Cell).delete()
-            self.session.commit()
-
-            # Заполняем базу данных новыми ячейками
-            for x, row in enumerate(layout):
-                if len(row) != self.size[1]:
-                    raise IncompleteMapException("Переданная карта ячеек имеет непрямоугольный размер")
-
-                for y, is_storage_cell in enumerate(row):
-                    if is_storage_cell:
-                        cell = Cell(x=x, y=y, count=0, product_sku=None, zone_id=None)
-                        self.session.add(cell)
-
-            self.session.commit()
-            logging.info("Склад успешно построен")
-        except SQLAlchemyError as e:
-            self.session.rollback()
+            cursor = connection.cursor()
+            # Удаление всех существующих ячеек и запись новых в одной транзакции
+            cursor.execute("DELETE FROM cell")
+
+            for start in range(0, len(layout), chunk):
+                stop = min(start + chunk, len(layout))
+                buffer = io.StringIO()
+                for x in range(start, stop):
+                    buffer.writelines(f"{x},{y},0\n" for y, is_storage_cell in enumerate(layout[x]) if is_storage_cell)
+                buffer.seek(0)
+                cursor.copy_expert("COPY cell (x, y, count) FROM STDIN WITH (FORMAT csv)", buffer)
+
+                if progress is not None:
+                    progress("cells", stop, len(layout))
+
+            connection.commit()
+        except (SQLAlchemyError, db.engine.dialect.dbapi.Error) as e:
+            connection.rollback()
+            logging.error(f"Ошибка при работе с базой данных: {e}")
+            raise WarehouseException("Не удалось построить склад из-за ошибки базы данных")
+        finally:
+            connection.close()
+
+        self._rebuilt(progress)
+
+    def begin_upload(self, rows: int, cols: int) -> LayoutUpload:
+        """
+        Начинает загрузку карты склада по частям (см. LayoutUpload).
+        """
+        return self.uploads.begin(rows, cols)
+
+    def commit_upload(self, upload_id: str, progress: Optional[Progress] = None) -> None:
+        """
+        Завершает загрузку карты: в одной транзакции заменяет все ячейки склада ячейками из таблицы загрузки,
+        после чего перечитывает снимок и заполняет склад товарами.
+
+        Raises:
+            UnknownUploadException: Если загрузки нет.
+            IncompleteMapException: Если получены не все строки карты.
+        """
+        upload = self.uploads.get(upload_id)
+        if not upload.complete:
+            raise IncompleteMapException(f"Получено {upload.next_row} строк карты из {upload.rows}")
+        if not upload.cells:
+            raise IllegalSizeException("Нельзя создать склад с нулём ячеек")
+
+        logging.info(f"Построение модели склада по загрузке {upload_id}")
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM cell")
+            cursor.execute(f"INSERT INTO cell (x, y, count) SELECT x, y, 0 FROM {upload.table} ORDER BY x, y")
+            cursor.execute(f"DROP TABLE {upload.table}")
+            connection.commit()
+        except (SQLAlchemyError, db.engine.dialect.dbapi.Error) as e:
+            connection.rollback()
             logging.error(f"Ошибка при работе с базой данных: {e}")
             raise WarehouseException("Не удалось построить склад из-за ошибки базы данных")
+        finally:
+            connection.close()
 
-        self.fill()  # Заполняем склад продуктами
+        self.uploads.pop(upload_id)
+        self.size = (upload.rows, upload.cols)
+        if progress is not None:
+            progress("cells", upload.rows, upload.rows)
+        self._rebuilt(progress)
+
+    def _rebuilt(self, progress: Optional[Progress] = None) -> None:
+        self.state.reload(self._products_by_sku())
+        logging.info(f"Склад успешно построен: {len(self.state)} ячеек")
+
+        self.fill(progress)  # Заполняем склад продуктами
+
+    def update_layout(self, add: Sequence[tuple[int, int]] = (), remove: Sequence[tuple[int, int]] = (),
+                      start: Optional[tuple[int, int]] = None, discard_stock: bool = False) -> dict:
+        """
+        Точечно изменяет склад без перестроения: добавляет пустые ячейки хранения, удаляет ячейки
+        и переносит стартовую точку. Снимок склада, сетка проходимости и кластеры обновляются
+        только в изменённых точках, поэтому изменение одного стеллажа не требует полной перестройки.
+
+        Args:
+            add: Координаты новых ячеек хранения (сейчас в этих точках проход).
+            remove: Координаты удаляемых ячеек.
+            start: Новая стартовая точка; проверяется уже с учётом изменения.
+            discard_stock (bool): Разрешить удаление ячеек с товаром (товар списывается вместе с ячейкой).
+
+        Returns:
+            dict: Сколько ячеек добавлено и удалено, текущие размеры склада и стартовая точка.
+
+        Raises:
+            WrongTypeOfCellException: Если точка не подходит для изменения: добавление поверх ячейки
+                или стартовой точки, удаление несуществующей, зарезервированной или (без discard_stock)
+                заполненной ячейки, стартовая точка в ячейке хранения.
+        """
+        add = list(dict.fromkeys((int(x), int(y)) for x, y in add))
+        remove = list(dict.fromkeys((int(x), int(y)) for x, y in remove))
+        start = (int(start[0]), int(start[1])) if start is not None else self.start_cords
+
+        removed = dict()
+        for cell in remove:
+            record = self.state.cell_at(cell)
+            if record is None:
+                raise WrongTypeOfCellException(f"В точке {cell} нет ячейки склада")
+            if record.count and not discard_stock:
+                raise WrongTypeOfCellException(f"В ячейке {cell} лежит товар")
+            removed[record.cell_id] = cell
+
+        for cell in add:
+            if min(cell) < 0:
+                raise WrongTypeOfCellException(f"Координаты {cell} вне склада")
+            if self.state.has_cell(cell) and cell not in remove:
+                raise WrongTypeOfCellException(f"В точке {cell} уже есть ячейка склада")
+        if start in add or (self.state.has_cell(start) and start not in remove):
+            raise WrongTypeOfCellException("Стартовой точке соответствует ячейка склада")
+
+        # Проверка резервов и удаление ячеек не разделяются: пока ячейки удаляются, резервы в них не оформляются
+        reserved = self.solver.reservations.retire(removed)
+        if reserved:
+            raise WrongTypeOfCellException(f"Товар в ячейке {removed[reserved[0]]} зарезервирован под выданный маршрут")
+        try:
+            walkable = self.walkable_grid()
+            try:
+                self.state.patch_layout(removed, add)
+            except SQLAlchemyError as e:
+                logging.error(f"Ошибка при работе с базой данных: {e}")
+                raise WarehouseException("Не удалось изменить склад из-за ошибки базы данных")
+
+            self._patch_walkable(walkable, remove, add)
+            self.solver.clusters_controller.discard_cells(list(removed))
+        finally:
+            self.solver.reservations.unretire(removed)
+        self.size = self.init_size()
+        if start != self.start_cords:
+            self.set_start(start)
+
+        logging.info(f"Склад изменён: добавлено {len(add)} ячеек, удалено {len(remove)}")
+        return {
+            "added": len(add),
+            "removed": len(remove),
+            "cells": len(self.state),
+            "size": list(self.size),
+            "start": list(self.start_cords)
+        }
 
     def is_empty_cell(self, cell: tuple[int, int]) -> bool:
         x, y = cell
         if x > max(self.size) or y > max(self.size):
             return False
 
-        return self.session.query(Cell).filter(Cell.x == x, Cell.y == y).first().count == 0
+        cell = self.state.cell_at((x, y))
+        return cell is not None and cell.count == 0
 
     def set_start(self, cell: tuple[int, int]) -> None:
         """
@@ -280,6 +505,8 @@ class Warehouse:
     def get_start(self) -> tuple[int, int]:
         return self.start_cords
 
-    async def solve(self, request: Optional[SelectionRequest]) -> Optional[dict]:
-        result = await self.solver.solve(request)
-        return result
+    async def solve(self, request: Optional[SelectionRequest], worker_id=None):
+        return await self.solver.solve(request, worker_id)
+
+    async def solve_many(self, requests: list[SelectionRequest], worker_id=None):
+        return await self.solver.solve_many(requests, worker_id)
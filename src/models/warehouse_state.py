@@ -0,0 +1,552 @@
+import hashlib
+import logging
+import threading
+from collections.abc import Callable, Iterable, Mapping
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.models.product import Product
+from src.models.queries import SNAPSHOT_CELLS
+from src.parsers.db_parser import db
+
+NO_PRODUCT = -1
+
+# Наблюдатель изменений остатков: cell_id -> (новое количество, артикул или None)
+Observer = Callable[[dict[int, tuple[int, Optional[int]]]], None]
+
+# Пакетная установка содержимого ячеек одним оператором: значения передаются тремя массивами
+BULK_UPDATE = text("""
+    UPDATE cell
+    SET product_sku = v.product_sku, count = v.count
+    FROM unnest(CAST(:cell_ids AS integer[]), CAST(:product_skus AS integer[]), CAST(:counts AS integer[]))
+        AS v(cell_id, product_sku, count)
+    WHERE cell.cell_id = v.cell_id
+""")
+
+# Пакетное применение накопленных изменений остатков: к количеству прибавляется дельта,
+# артикул меняется, только если он был назначен в памяти, и обнуляется у опустевших ячеек
+DELTA_UPDATE = text("""
+    UPDATE cell
+    SET count = cell.count + v.delta,
+        product_sku = CASE
+            WHEN cell.count + v.delta <= 0 THEN NULL
+            WHEN v.product_sku IS NOT NULL THEN v.product_sku
+            ELSE cell.product_sku
+        END
+    FROM unnest(CAST(:cell_ids AS integer[]), CAST(:deltas AS integer[]), CAST(:product_skus AS integer[]))
+        AS v(cell_id, delta, product_sku)
+    WHERE cell.cell_id = v.cell_id
+""")
+
+# Точечное изменение раскладки: удаление ячеек и добавление новых пустых ячеек в одной транзакции
+DELETE_CELLS = text("DELETE FROM cell WHERE cell_id = ANY(CAST(:cell_ids AS integer[]))")
+INSERT_CELLS = text("""
+    INSERT INTO cell (x, y, count)
+    SELECT v.x, v.y, 0 FROM unnest(CAST(:xs AS integer[]), CAST(:ys AS integer[])) AS v(x, y)
+    RETURNING cell_id, x, y
+""")
+
+
+class InventoryJournal:
+    """
+    Журнал изменений остатков для отложенной записи (write-behind).
+
+    Изменения одной ячейки схлопываются в одну запись (суммарная дельта и последний назначенный артикул),
+    поэтому сколько бы отборов ни пришлось на ячейку между сбросами, в БД уйдёт одна строка.
+    Не потокобезопасен сам по себе - защищается блокировкой владельца.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: dict[int, list] = dict()
+        self.recorded = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def record(self, cell_id: int, delta: int, product_sku: Optional[int] = None) -> bool:
+        """
+        Добавляет изменение ячейки.
+
+        :return: True, если журнал достиг порога размера и его пора сбросить.
+        """
+        self.recorded += 1
+        entry = self._entries.get(cell_id)
+        if entry is None:
+            self._entries[cell_id] = [delta, product_sku]
+        else:
+            self.coalesced += 1
+            entry[0] += delta
+            if product_sku is not None:
+                entry[1] = product_sku
+        return len(self._entries) >= self.max_entries
+
+    def drain(self) -> dict[int, list]:
+        entries, self._entries = self._entries, dict()
+        return entries
+
+    def restore(self, entries: dict[int, list]) -> None:
+        """
+        Возвращает в журнал записи, которые не удалось сбросить, объединяя их с более свежими.
+        """
+        for cell_id, (delta, product_sku) in entries.items():
+            entry = self._entries.get(cell_id)
+            if entry is None:
+                self._entries[cell_id] = [delta, product_sku]
+            else:
+                entry[0] += delta
+                if entry[1] is None:
+                    entry[1] = product_sku
+
+    def pending(self) -> list[tuple[int, tuple[int, Optional[int]]]]:
+        return [(cell_id, (delta, product_sku)) for cell_id, (delta, product_sku) in self._entries.items()]
+
+    def discard(self, cell_ids: Iterable[int]) -> None:
+        for cell_id in cell_ids:
+            self._entries.pop(int(cell_id), None)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._entries),
+            "recorded": self.recorded,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CellRecord:
+    """
+    Лёгкое представление ячейки из снимка склада. Содержит те же поля, что и ORM-модель Cell,
+    но не привязано к сессии и может свободно передаваться между потоками.
+    """
+    __slots__ = ('cell_id', 'x', 'y', 'product_sku', 'count', 'product')
+
+    def __init__(self, cell_id: int, x: int, y: int, product_sku: Optional[int], count: int,
+                 product: Optional[Product]):
+        self.cell_id = cell_id
+        self.x = x
+        self.y = y
+        self.product_sku = product_sku
+        self.count = count
+        self.product = product
+
+    def __hash__(self):
+        return hash(self.cell_id)
+
+    def __eq__(self, other):
+        return isinstance(other, CellRecord) and self.cell_id == other.cell_id
+
+    def __str__(self):
+        return f"<Cell [{self.x}, {self.y}]: {self.count} with sku={self.product_sku}>"
+
+
+class WarehouseState:
+    """
+    Снимок склада в памяти в виде структуры массивов.
+
+    Ячейки хранятся в параллельных numpy-массивах (cell_id, x, y, product_sku, count), дополнительно
+    поддерживаются индексы (x, y) -> позиция, cell_id -> позиция и артикул -> позиции.
+    Чтения обслуживаются из памяти (в том числе собственные несброшенные изменения), изменения сразу
+    применяются к снимку и накапливаются в журнале остатков, который фоновый поток сбрасывает в БД
+    одним UPDATE по достижении порога размера или по таймеру.
+    Чтения и изменения массивов выполняются под общей блокировкой: patch_layout переносит строки
+    внутри массивов и заменяет сами массивы.
+    Счётчик `version` увеличивается при любом изменении, по нему внешние кэши определяют устаревание.
+    `layout_hash` зависит только от расположения ячеек и меняется лишь при перечитывании снимка
+    или точечном изменении раскладки (patch_layout).
+    """
+
+    def __init__(self, batch_size: int = 512, flush_interval: float = 1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.version = 0
+        self.layout_hash = ''
+
+        self.cell_ids = np.empty(0, dtype=np.int64)
+        self.xs = np.empty(0, dtype=np.int64)
+        self.ys = np.empty(0, dtype=np.int64)
+        self.skus = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+        self._by_xy: dict[tuple[int, int], int] = dict()
+        self._by_id: dict[int, int] = dict()
+        self._by_sku: dict[int, set[int]] = dict()
+        self._products: Mapping[int, Product] = dict()
+
+        self._lock = threading.Lock()
+        self._observers: list[Observer] = list()
+        self._journal = InventoryJournal(batch_size)
+        # Сериализует сбросы журнала и перечитывание снимка, чтобы не потерять изменения, которые пишутся прямо сейчас
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    def reload(self, products: Optional[Mapping[int, Product]] = None) -> None:
+        """
+        Перечитывает ячейки из БД. Несброшенные изменения предварительно записываются.
+        """
+        with self._flush_lock:
+            self._flush()
+            with db.engine.connect() as conn:
+                rows = conn.execute(SNAPSHOT_CELLS).all()
+            self.load(rows, products)
+
+    def load(self, rows: Iterable[tuple], products: Optional[Mapping[int, Product]] = None) -> None:
+        """
+        Заполняет снимок из строк (cell_id, x, y, product_sku, count).
+        Изменения из журнала, ещё не записанные в БД, применяются поверх загруженных строк.
+        """
+        rows = list(rows)
+        with self._lock:
+            self.cell_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            self.xs = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            self.ys = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+            self.skus = np.fromiter((NO_PRODUCT if row[3] is None else row[3] for row in rows),
+                                    dtype=np.int64, count=len(rows))
+            self.counts = np.fromiter((row[4] for row in rows), dtype=np.int64, count=len(rows))
+
+            self._by_xy = {(int(x), int(y)): i for i, (x, y) in enumerate(zip(self.xs, self.ys))}
+            self._by_id = {int(cell_id): i for i, cell_id in enumerate(self.cell_ids)}
+            self.layout_hash = self._layout_hash()
+
+            for cell_id, (delta, product_sku) in self._journal.pending():
+                i = self._by_id.get(cell_id)
+                if i is None:
+                    continue
+                self.counts[i] += delta
+                if self.counts[i] <= 0:
+                    self.skus[i] = NO_PRODUCT
+                elif product_sku is not None:
+                    self.skus[i] = product_sku
+
+            self._by_sku = dict()
+            for i, sku in enumerate(self.skus):
+                if sku != NO_PRODUCT:
+                    self._by_sku.setdefault(int(sku), set()).add(i)
+
+            if products is not None:
+                self._products = products
+            self.version += 1
+
+    def _layout_hash(self) -> str:
+        # Не зависит от порядка ячеек в массивах: снимок после patch_layout и перечитанный снимок совпадают
+        order = np.argsort(self.cell_ids, kind='stable')
+        return hashlib.sha1(
+            self.cell_ids[order].tobytes() + self.xs[order].tobytes() + self.ys[order].tobytes()
+        ).hexdigest()
+
+    def set_products(self, products: Mapping[int, Product]) -> None:
+        with self._lock:
+            self._products = products
+            self.version += 1
+
+    def __len__(self) -> int:
+        return len(self.cell_ids)
+
+    def size(self) -> tuple[int, int]:
+        with self._lock:
+            if not len(self.cell_ids):
+                return 0, 0
+            return int(self.xs.max()), int(self.ys.max())
+
+    def _record(self, i: int) -> CellRecord:
+        # Вызывается под self._lock: patch_layout переставляет строки массивов
+        sku = int(self.skus[i])
+        sku = None if sku == NO_PRODUCT else sku
+        return CellRecord(int(self.cell_ids[i]), int(self.xs[i]), int(self.ys[i]), sku, int(self.counts[i]),
+                          self._products.get(sku) if sku is not None else None)
+
+    def cells(self) -> list[CellRecord]:
+        with self._lock:
+            return [self._record(i) for i in range(len(self.cell_ids))]
+
+    def cell_by_id(self, cell_id: int) -> Optional[CellRecord]:
+        with self._lock:
+            i = self._by_id.get(cell_id)
+            return self._record(i) if i is not None else None
+
+    def cell_at(self, cell: tuple[int, int]) -> Optional[CellRecord]:
+        with self._lock:
+            i = self._by_xy.get(cell)
+            return self._record(i) if i is not None else None
+
+    def has_cell(self, cell: tuple[int, int]) -> bool:
+        return cell in self._by_xy
+
+    def count(self, cell_id: int) -> int:
+        with self._lock:
+            i = self._by_id.get(cell_id)
+            return int(self.counts[i]) if i is not None else 0
+
+    def cells_by_sku(self, sku: int) -> list[CellRecord]:
+        with self._lock:
+            return [self._record(i) for i in sorted(self._by_sku.get(sku, ()))]
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        Согласованная копия массивов снимка.
+        """
+        with self._lock:
+            return {
+                'cell_id': self.cell_ids.copy(),
+                'x': self.xs.copy(),
+                'y': self.ys.copy(),
+                'product_sku': self.skus.copy(),
+                'count': self.counts.copy()
+            }
+
+    def products(self) -> Mapping[int, Product]:
+        return self._products
+
+    def add(self, cell_id: int, count: int, product_sku: Optional[int] = None) -> bool:
+        """
+        Добавляет товар в ячейку.
+
+        :raises RuntimeError: Если ячейка пуста, а артикул не передан.
+        :return: False, если ячейки нет.
+        """
+        with self._lock:
+            i = self._by_id.get(cell_id)
+            if i is None:
+                return False
+
+            assigned = None
+            if self.skus[i] == NO_PRODUCT:
+                if product_sku is None:
+                    raise RuntimeError("Невозможно определить тип товара в ячейке")
+                self.skus[i] = assigned = product_sku
+                self._by_sku.setdefault(product_sku, set()).add(i)
+
+            self.counts[i] += count
+            self._stage(cell_id, count, assigned)
+            return True
+
+    def remove(self, cell_id: int, count: int) -> bool:
+        """
+        Забирает товар из ячейки.
+
+        :return: False, если ячейки нет или в ней недостаточно товара.
+        """
+        with self._lock:
+            i = self._by_id.get(cell_id)
+            if i is None or self.counts[i] < count:
+                return False
+
+            self.counts[i] -= count
+            if self.counts[i] <= 0:
+                self._by_sku.get(int(self.skus[i]), set()).discard(i)
+                self.skus[i] = NO_PRODUCT
+
+            self._stage(cell_id, -count)
+            return True
+
+    def _stage(self, cell_id: int, delta: int, product_sku: Optional[int] = None) -> None:
+        # Вызывается под self._lock
+        self.version += 1
+        if self._journal.record(cell_id, delta, product_sku):
+            self._wakeup.set()
+        self._notify([self._by_id[cell_id]])
+
+    def observe(self, observer: Observer) -> None:
+        """
+        Подписывает наблюдателя на изменения остатков. Наблюдатель вызывается из того потока,
+        который изменил ячейку, под блокировкой снимка, поэтому должен только передавать изменения дальше.
+        """
+        with self._lock:
+            self._observers.append(observer)
+
+    def unobserve(self, observer: Observer) -> None:
+        with self._lock:
+            if observer in self._observers:
+                self._observers.remove(observer)
+
+    def _notify(self, positions: Iterable[int], changes: Optional[dict] = None) -> None:
+        # Вызывается под self._lock
+        if not self._observers:
+            return
+
+        changes = dict(changes or ())
+        for i in positions:
+            sku = int(self.skus[i])
+            changes[int(self.cell_ids[i])] = (int(self.counts[i]), None if sku == NO_PRODUCT else sku)
+        for observer in self._observers:
+            try:
+                observer(changes)
+            except Exception as e:
+                logging.error(f"Ошибка наблюдателя изменений склада: {e}")
+
+    def assign(self, cell_ids: np.ndarray, product_skus: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Массово задаёт содержимое ячеек: одним UPDATE в БД и одной векторной операцией в снимке.
+
+        :raises SQLAlchemyError: Если запись в БД не удалась (снимок в этом случае не меняется).
+        """
+        if not len(cell_ids):
+            return
+
+        with db.engine.begin() as conn:
+            conn.execute(BULK_UPDATE, {
+                'cell_ids': [int(cell_id) for cell_id in cell_ids],
+                'product_skus': [None if sku == NO_PRODUCT else int(sku) for sku in product_skus],
+                'counts': [int(count) for count in counts]
+            })
+
+        with self._lock:
+            positions = np.fromiter((self._by_id[int(cell_id)] for cell_id in cell_ids),
+                                    dtype=np.int64, count=len(cell_ids))
+            self.skus[positions] = product_skus
+            self.counts[positions] = counts
+            # Абсолютные значения перекрывают ещё не записанные дельты этих ячеек
+            self._journal.discard(cell_ids)
+
+            self._by_sku = dict()
+            for i in np.flatnonzero(self.skus != NO_PRODUCT):
+                self._by_sku.setdefault(int(self.skus[i]), set()).add(int(i))
+            self.version += 1
+            self._notify(positions)
+
+    def patch_layout(self, removed: Iterable[int], added: Iterable[tuple[int, int]]) -> list[CellRecord]:
+        """
+        Точечно меняет раскладку: удаляет ячейки removed (cell_id) вместе с их содержимым и добавляет
+        пустые ячейки в точках added. В БД изменения записываются одной транзакцией, снимок не перечитывается.
+
+        На место удалённой ячейки в массивах переносится последняя, поэтому индексы обновляются только
+        для перенесённых ячеек, и стоимость изменения зависит от его размера, а не от размера склада.
+        Несброшенные изменения остатков удалённых ячеек отбрасываются.
+
+        :raises SQLAlchemyError: Если запись в БД не удалась (снимок в этом случае не меняется).
+        :return: Добавленные ячейки.
+        """
+        removed = [int(cell_id) for cell_id in removed]
+        added = [(int(x), int(y)) for x, y in added]
+        if not removed and not added:
+            return list()
+
+        with db.engine.begin() as conn:
+            if removed:
+                conn.execute(DELETE_CELLS, {'cell_ids': removed})
+            rows = conn.execute(INSERT_CELLS, {
+                'xs': [x for x, _ in added],
+                'ys': [y for _, y in added]
+            }).all() if added else list()
+
+        with self._lock:
+            for cell_id in removed:
+                i = self._by_id.pop(cell_id, None)
+                if i is None:
+                    continue
+                del self._by_xy[(int(self.xs[i]), int(self.ys[i]))]
+                if self.skus[i] != NO_PRODUCT:
+                    self._by_sku.get(int(self.skus[i]), set()).discard(i)
+
+                last = len(self.cell_ids) - 1
+                if i != last:
+                    for array in (self.cell_ids, self.xs, self.ys, self.skus, self.counts):
+                        array[i] = array[last]
+                    self._by_id[int(self.cell_ids[i])] = i
+                    self._by_xy[(int(self.xs[i]), int(self.ys[i]))] = i
+                    if self.skus[i] != NO_PRODUCT:
+                        positions = self._by_sku[int(self.skus[i])]
+                        positions.discard(last)
+                        positions.add(i)
+
+                self.cell_ids, self.xs, self.ys = self.cell_ids[:last], self.xs[:last], self.ys[:last]
+                self.skus, self.counts = self.skus[:last], self.counts[:last]
+            self._journal.discard(removed)
+
+            offset = len(self.cell_ids)
+            if rows:
+                self.cell_ids = np.concatenate((self.cell_ids, np.fromiter((row[0] for row in rows), dtype=np.int64)))
+                self.xs = np.concatenate((self.xs, np.fromiter((row[1] for row in rows), dtype=np.int64)))
+                self.ys = np.concatenate((self.ys, np.fromiter((row[2] for row in rows), dtype=np.int64)))
+                self.skus = np.concatenate((self.skus, np.full(len(rows), NO_PRODUCT, dtype=np.int64)))
+                self.counts = np.concatenate((self.counts, np.zeros(len(rows), dtype=np.int64)))
+            for i, (cell_id, x, y) in enumerate(rows, start=offset):
+                self._by_id[int(cell_id)] = i
+                self._by_xy[(int(x), int(y))] = i
+
+            self.layout_hash = self._layout_hash()
+            self.version += 1
+            self._notify(range(offset, len(self.cell_ids)), {cell_id: (0, None) for cell_id in removed})
+            return [self._record(i) for i in range(offset, len(self.cell_ids))]
+
+    def request_flush(self) -> None:
+        """
+        Просит фоновый поток записи сбросить накопленные изменения, не дожидаясь таймера.
+        """
+        self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Синхронно записывает журнал остатков в БД одним пакетным UPDATE.
+
+        :return: Количество записанных ячеек.
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        # Вызывается под self._flush_lock
+        with self._lock:
+            entries = self._journal.drain()
+        if not entries:
+            return 0
+
+        params = {
+            'cell_ids': list(entries),
+            'deltas': [delta for delta, _ in entries.values()],
+            'product_skus': [product_sku for _, product_sku in entries.values()]
+        }
+
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(DELTA_UPDATE, params)
+        except SQLAlchemyError as e:
+            logging.error(f"Не удалось записать изменения ячеек в БД: {e}")
+            with self._lock:
+                self._journal.restore(entries)
+            return 0
+
+        with self._lock:
+            self._journal.flushes += 1
+            self._journal.flushed_rows += len(entries)
+        logging.debug(f"В БД записаны изменения {len(entries)} ячеек")
+        return len(entries)
+
+    def journal_stats(self) -> dict:
+        """
+        Показатели журнала остатков: размер, число схлопнутых изменений и сбросов.
+        """
+        with self._lock:
+            return self._journal.stats()
+
+    def start(self) -> None:
+        """
+        Запускает фоновый поток пакетной записи.
+        """
+        if self._writer is not None and self._writer.is_alive():
+            return
+        self._stopped.clear()
+        self._writer = threading.Thread(target=self._write_behind, daemon=True)
+        self._writer.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        self.flush()
+
+    def _write_behind(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
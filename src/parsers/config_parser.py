@@ -9,6 +9,30 @@ class Settings(BaseSettings):
     dbport: SecretStr
     wsauth: SecretStr
 
+    # Параметры пула соединений с БД (общие для синхронного и асинхронного движков)
+    dbpoolsize: int = 10
+    dbmaxoverflow: int = 20
+    dbpooltimeout: float = 30
+    dbpoolrecycle: int = 30 * 60
+
+    # Режим отдельного процесса решателя: сервер websocket не делит GIL с генетическим алгоритмом
+    solverprocess: bool = False
+    solverhealthinterval: float = 5
+    solverhealthtimeout: float = 30
+    solvermaxrestarts: int = 5
+    solverrestartwindow: float = 5 * 60
+
+    # Журналирование: общий уровень и уровни отдельных модулей в виде "websockets=INFO,src.server.server=WARNING"
+    loglevel: str = "DEBUG"
+    loglevels: str = ""
+    logfile: str = "logs/app.log"
+    logmaxbytes: int = 10 * 1024 * 1024
+    logbackups: int = 5
+    # Частые сообщения (на каждое входящее сообщение, каждый запрос) - не больше logsampleburst
+    # с одной строки кода за logsampleinterval секунд
+    logsampleinterval: float = 1
+    logsampleburst: int = 5
+
     class Config:
         env_file = 'env/config.env'
         env_file_encoding = 'utf-8'
@@ -1,19 +1,141 @@
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 from subprocess import run
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from typing import Iterator, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import shutil
 from datetime import datetime
 
 from src.server.base import Base
 from src.parsers.config_parser import config
 
+MIGRATIONS_DIR = os.path.join('db', 'migrations')
+MIGRATION_PATTERN = re.compile(r'V(\d+)__\w+\.sql')
+# Произвольный, но постоянный ключ advisory-блокировки для миграций
+MIGRATION_LOCK_ID = 7305001
+# Объекты, по которым распознаются миграции, применённые до появления schema_version (прежний init_tables
+# выполнял V1-V3 при каждом запуске): (вид объекта, имя). Миграции без записи здесь идемпотентны
+BASELINE_OBJECTS = {
+    1: (("table", "product"), ("table", "zone"), ("table", "cell"), ("table", '"user"'), ("table", "user_x_zone")),
+    2: tuple(("constraint", name) for name in (
+        "chk_product_time_select", "chk_product_time_ship", "chk_product_max_amount", "chk_product_max_per_hand",
+        "fk_cell_product", "fk_cell_zone", "chk_cell_count", "fk_user", "fk_zone", "uq_user_phone",
+        "chk_user_phone_format"
+    )),
+    3: (("trigger", "trg_clear_sku"),)
+}
+# Запросы проверки существования объекта по его виду
+BASELINE_QUERIES = {
+    "table": "SELECT to_regclass(:name) IS NOT NULL",
+    "constraint": "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = :name)",
+    "trigger": "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = :name AND NOT tgisinternal)"
+}
+
+# Сессия, в identity map которой оказалось больше объектов, считается подозрительной и попадает в лог
+MAX_IDENTITY_MAP = 10000
+
+SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+
+class PoolMetrics(object):
+    """
+    Показатели пула соединений: сколько раз брали соединение, сколько ждали свободного
+    и сколько его удерживали, а также число отказов по таймауту.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.hold_time = 0.0
+        self.max_hold = 0.0
+        self._lock = threading.Lock()
+
+    def waited(self, seconds: float, timeout: bool = False) -> None:
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def held(self, seconds: float) -> None:
+        with self._lock:
+            self.hold_time += seconds
+            self.max_hold = max(self.max_hold, seconds)
+
+    def as_dict(self, pool: Optional[QueuePool] = None) -> dict:
+        result = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_time": self.wait_time,
+            "avg_wait": self.wait_time / self.checkouts if self.checkouts else 0.0,
+            "max_wait": self.max_wait,
+            "hold_time": self.hold_time,
+            "max_hold": self.max_hold
+        }
+        if pool is not None:
+            result.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return result
+
+
+def metered_pool(pool_class: type, metrics: PoolMetrics) -> type:
+    """
+    Подкласс пула, который замеряет ожидание свободного соединения и время его удержания.
+    Пересоздание пула (engine.dispose) сохраняет класс, а значит и метрики.
+    """
+
+    class MeteredPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                record = super()._do_get()
+            except PoolTimeoutError:
+                metrics.waited(time.perf_counter() - started, timeout=True)
+                raise
+            metrics.waited(time.perf_counter() - started)
+            record.info['checked_out_at'] = time.perf_counter()
+            return record
+
+        def _do_return_conn(self, record):
+            checked_out_at = record.info.pop('checked_out_at', None)
+            if checked_out_at is not None:
+                metrics.held(time.perf_counter() - checked_out_at)
+            super()._do_return_conn(record)
+
+    MeteredPool.__name__ = f"Metered{pool_class.__name__}"
+    return MeteredPool
+
 
 class Database(object):
     """
     Класс Database представляет интерфейс для работы с базой данных склада.
     Реализует подключение к PostgreSQL, управление таблицами и выполнение запросов.
+
+    Предоставляет два интерфейса к одной БД:
+    - синхронный (`engine`, `session_scope`, драйвер psycopg2) - для фоновых потоков и массовой загрузки через COPY;
+    - асинхронный (`async_engine`, `async_session`, драйвер asyncpg) - для обработчиков websocket,
+      чтобы медленный запрос не останавливал цикл событий.
+
+    Общей сессии нет: каждый этап работы открывает свою короткую сессию и закрывает её по завершении,
+    поэтому identity map не растёт, а ORM-объекты не переходят между потоками в привязанном виде.
     """
 
     def __init__(self):
@@ -29,13 +151,31 @@ class Database(object):
             password = config.dbpassword.get_secret_value()
             host = config.dbhost.get_secret_value()
             port = config.dbport.get_secret_value()
-            url = f"postgresql://{user}:{password}@{host}:{port}/{dbname}"
+            url = f"{user}:{password}@{host}:{port}/{dbname}"
+
+            # pre_ping отсеивает соединения, разорванные сервером, recycle - слишком старые
+            pool = dict(
+                pool_size=config.dbpoolsize,
+                max_overflow=config.dbmaxoverflow,
+                pool_timeout=config.dbpooltimeout,
+                pool_recycle=config.dbpoolrecycle,
+                pool_pre_ping=True
+            )
+
+            self.pool_metrics = PoolMetrics()
+            self.async_pool_metrics = PoolMetrics()
 
-            self.engine = create_engine(url, future=True)
-            self.session = scoped_session(sessionmaker(bind=self.engine))
+            self.engine = create_engine(f"postgresql://{url}", future=True,
+                                        poolclass=metered_pool(QueuePool, self.pool_metrics), **pool)
+            self.session = sessionmaker(bind=self.engine, expire_on_commit=False)
+            self.async_engine = create_async_engine(
+                f"postgresql+asyncpg://{url}",
+                poolclass=metered_pool(AsyncAdaptedQueuePool, self.async_pool_metrics), **pool
+            )
+            self.async_session = async_sessionmaker(self.async_engine, expire_on_commit=False)
             self.base = Base
             logging.debug("БД успешно подключена")
-        except OperationalError | OSError as e:
+        except (OperationalError, OSError) as e:
             logging.error(f"Не удалось подключиться к БД: {e}")
             raise ConnectionError(f"Не удалось подключиться к БД: {e}")
 
@@ -43,34 +183,145 @@ class Database(object):
 
     def __del__(self):
         """
-        Завершение работы с базой данных.
-        Выполняет сохранение (commit) изменений и закрывает соединение.
+        Завершение работы с базой данных: закрывает соединения синхронного пула.
+        """
+        engine = getattr(self, 'engine', None)
+        if engine is not None:
+            engine.dispose()
+
+    async def dispose(self):
+        """
+        Закрывает соединения асинхронного пула. Вызывается до остановки цикла событий.
         """
-        self.__commit()
+        await self.async_engine.dispose()
 
-    def __commit(self):
+    @contextmanager
+    def session_scope(self, readonly: bool = False) -> Iterator[Session]:
         """
-        Приватный метод для сохранения изменений в базе данных.
+        Короткая сессия для одного этапа работы.
+
+        При выходе изменения фиксируются (для readonly - транзакция откатывается), при ошибке
+        откатываются, а сессия закрывается вместе со своей identity map. Загруженные объекты остаются
+        доступными в отсоединённом виде: expire_on_commit выключен.
         """
-        self.session.commit()
+        session = self.session()
+        try:
+            yield session
+            if readonly:
+                session.rollback()
+            else:
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            identities = len(session.identity_map)
+            if identities > MAX_IDENTITY_MAP:
+                logging.warning(f"В сессии было загружено {identities} объектов, "
+                                f"этап стоит перевести на Core-запросы или выборку пачками")
+            session.close()
+
+    def pool_stats(self) -> dict:
+        """
+        Показатели синхронного и асинхронного пулов соединений.
+        """
+        return {
+            "sync": self.pool_metrics.as_dict(self.engine.pool),
+            "async": self.async_pool_metrics.as_dict(self.async_engine.pool)
+        }
 
     def init_tables(self):
-        """Создаёт все таблицы в базе данных, если они ещё не существуют."""
+        """
+        Применяет ещё не применённые миграции из db/migrations и создаёт недостающие таблицы моделей.
+
+        Применённые версии хранятся в таблице schema_version, поэтому при обычном перезапуске
+        выполняется только один запрос к ней. Каждая миграция применяется в своей транзакции
+        под advisory-блокировкой, чтобы одновременно стартующие экземпляры не выполнили её дважды.
+        Миграции выполняются до create_all: таблицы создаёт сама миграция, а не модели.
+        """
         logging.debug("Проверка данных в БД")
+        started = time.perf_counter()
+        migrations = self.__migrations()
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(SCHEMA_VERSION_TABLE)
+            applied = set(connection.exec_driver_sql("SELECT version FROM schema_version").scalars())
+
+        pending = [migration for migration in migrations if migration[0] not in applied]
+        if not pending:
+            logging.debug(f"Схема БД актуальна (версия {max(applied, default=0)}), "
+                          f"проверка заняла {time.perf_counter() - started:.3f} с")
+            return
+
+        for version, name in pending:
+            with open(os.path.join(MIGRATIONS_DIR, name), 'r', encoding='utf-8') as file:
+                script = file.read()
+
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+                if connection.exec_driver_sql(
+                        f"SELECT 1 FROM schema_version WHERE version = {version}").first() is not None:
+                    continue  # Миграцию уже применил другой экземпляр
+
+                present = [
+                    connection.execute(text(BASELINE_QUERIES[kind]), {"name": obj}).scalar()
+                    for kind, obj in BASELINE_OBJECTS.get(version, ())
+                ]
+                if present and all(present):
+                    # БД, размеченная до появления schema_version: миграция уже применена целиком
+                    logging.warning(f"Объекты миграции {name} уже существуют, она отмечена как применённая")
+                elif any(present):
+                    raise RuntimeError(f"Миграция {name} применена частично, схему БД нужно исправить вручную")
+                else:
+                    logging.debug(f"Выполнение миграции из {name}")
+                    connection.exec_driver_sql(script)
+
+                connection.execute(
+                    text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                    {"version": version, "name": name}
+                )
+
         logging.debug("Создание таблиц")
         self.base.metadata.create_all(self.engine)
-        names = (
-            'V1__create_tables.sql',
-            'V2__add_constraints.sql',
-            'V3__add_triggers.sql'
-        )
 
-        with self.engine.connect() as connection:
-            for f in names:
-                with open(rf'db/migrations/{f}', 'r', encoding='utf-8') as file:
-                    logging.debug(f"Выполнение миграции из {f}")
-                    connection.exec_driver_sql(file.read())
-        logging.debug("Проверка выполнена успешно")
+        logging.debug(f"Проверка выполнена успешно за {time.perf_counter() - started:.3f} с")
+
+    @staticmethod
+    def __migrations() -> list[tuple[int, str]]:
+        """
+        Файлы миграций вида V<номер>__<описание>.sql в порядке возрастания номера.
+        """
+        migrations = list()
+        for name in os.listdir(MIGRATIONS_DIR):
+            match = MIGRATION_PATTERN.fullmatch(name)
+            if match:
+                migrations.append((int(match.group(1)), name))
+        return sorted(migrations)
+
+
+class LazyDatabase(object):
+    """
+    Ленивая обёртка над Database: подключение к БД и проверка схемы выполняются
+    при первом обращении к атрибуту, а не при импорте модуля.
+    """
+
+    def __init__(self):
+        self._instance: Optional[Database] = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialised(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Database:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = Database()
+        return self._instance
+
+    def __getattr__(self, item):
+        return getattr(self.get(), item)
 
 
-db = Database()
+db = LazyDatabase()
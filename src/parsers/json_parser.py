@@ -1,14 +1,34 @@
+import asyncio
 import json
 import logging
 from typing import Optional
 from datetime import datetime, timedelta
 
+from sqlalchemy import delete
+from sqlalchemy.exc import SQLAlchemyError
+
 from src.algorithm.app import Algorithm
 from src.exceptions.parser_exceptions import ExecutionError
-from src.exceptions.warehouse_exceptions import EmptyListOfProductsException, IllegalSizeException, IncompleteMapException
+from src.exceptions.warehouse_exceptions import (EmptyListOfProductsException, IllegalSizeException, IncompleteMapException,
+                                                 BuildException, UnknownUploadException, UploadOffsetException,
+                                                 WrongTypeOfCellException)
 from src.models.product import Product
+from src.models.selection_request import SelectionRequest, Priority
 from src.models.warehouse_on_db import Warehouse
 from src.parsers.db_parser import db
+from src.server.broadcast import hub
+from src.server.codec import Route, unpack_layout, stats as codec_stats
+from src.server.limits import stats as limit_stats
+from src.server.solver_process import LOCAL_COMMANDS, SolverProcess
+
+# Рекомендуемый размер порции при загрузке карты по частям (в ячейках)
+UPLOAD_CHUNK_CELLS = 256 * 1024
+# Наибольшее число заказов в одной команде submit_orders
+MAX_ORDERS = 1000
+# Сколько команда run ждёт маршрут, прежде чем освободить цикл приёма клиента (в секундах)
+ROUTE_WAIT_TIMEOUT = 30
+# Фоновые задачи, отправляющие маршруты по заказам (ссылки держатся до завершения задач)
+_order_streams: set[asyncio.Task] = set()
 
 
 class ParserManager:
@@ -22,21 +42,46 @@ class ParserManager:
 
     def __init__(self):
         """
-        Инициализирует объект ParserManager, создавая склад и определяя список поддерживаемых команд.
+        Инициализирует объект ParserManager и определяет список поддерживаемых команд.
+        Склад создаётся лениво, при первом обращении к `warehouse`.
         """
         logging.debug("Инициализация менеджера запросов")
-        self.warehouse = Algorithm().warehouse
+        self._warehouse: Optional[Warehouse] = None
+        # Процесс решателя, если склад работает в отдельном процессе (см. src.server.solver_process)
+        self.remote: Optional[SolverProcess] = None
         self.namespace = {
             "create_warehouse": build_map,
-            "server_status": do_nothing,
+            "upload_layout_begin": upload_layout_begin,
+            "upload_layout_chunk": upload_layout_chunk,
+            "upload_layout_commit": upload_layout_commit,
+            "upload_layout_abort": upload_layout_abort,
+            "server_status": server_status,
             "create_product_type": create_product,
             "delete_product_type": delete_product,
             "list_product_types": product_list,
             "worker_free_report": do_nothing,
-            "update_warehouse": do_nothing,
+            "update_warehouse": update_map,
+            "confirm_route": confirm_route,
+            "subscribe": subscribe,
+            "unsubscribe": unsubscribe,
+            "submit_orders": submit_orders,
             "run": solve
         }
 
+    @property
+    def loaded(self) -> bool:
+        """
+        Склад уже создан (в этом процессе).
+        """
+        return self._warehouse is not None
+
+    @property
+    def warehouse(self) -> Warehouse:
+        if self._warehouse is None:
+            logging.debug("Создание склада")
+            self._warehouse = Algorithm().warehouse
+        return self._warehouse
+
     def __call__(self, *args, **kwargs):
         """
         Вызывает соответствующую функцию из `namespase` в зависимости от переданного типа команды.
@@ -68,9 +113,12 @@ class ParserManager:
         :return: Результат выполнения команды.
         :raises ExecutionError: Если данные команды некорректны.
         """
-        data['warehouse'] = self.warehouse
         if not isinstance(data, dict) or 'type' not in data:
             raise ExecutionError("Ошибка обработки команды")
+        if self.remote is not None and data['type'] not in LOCAL_COMMANDS:
+            return self.remote.execute(data)
+        if self.remote is None:
+            data['warehouse'] = self.warehouse
         return self(data['type'], data)
 
 
@@ -92,28 +140,61 @@ async def undefined_function(*args, **kwargs) -> dict:
     }
 
 
+async def server_status(data: dict) -> dict:
+    """
+    Показатели сервера: объём и время сериализации по форматам сообщений, состояние рассылки
+    (в том числе выброшенные и схлопнутые сообщения), отклонённые по частоте команды и, в режиме отдельного процесса решателя, его живость и число перезапусков.
+    """
+    return {
+        "type": "response",
+        "code": 200,
+        "status": "ok",
+        "data": {
+            "codecs": codec_stats(),
+            "broadcast": hub.stats(),
+            "limits": limit_stats.as_dict(),
+            "solver_process": manager.remote.stats() if manager.remote is not None else None
+        }
+    }
+
+
+def build_progress_reporter(websocket, operation: str):
+    """
+    Создаёт обработчик прогресса, который можно вызывать из рабочего потока:
+    сообщения о ходе операции отправляются клиенту через event loop.
+    """
+    loop = asyncio.get_running_loop()
+
+    def report(stage: str, done: int, total: int) -> None:
+        logging.debug(f"{operation}: {stage} {done}/{total}")
+        if websocket is None:
+            return
+
+        message = {
+            "type": "progress",
+            "operation": operation,
+            "stage": stage,
+            "done": done,
+            "total": total
+        }
+        # Неотправленный прогресс той же операции заменяется более свежим
+        loop.call_soon_threadsafe(hub.send, websocket, message, ("progress", operation))
+
+    return report
+
+
 async def build_map(data: dict) -> dict:
     try:
-        if 'payload' not in data or 'layout' not in data['payload']:
+        if 'payload' not in data or ('layout' not in data['payload'] and 'layout_packed' not in data['payload']):
             raise ValueError()
         warehouse = data['warehouse']
+        progress = build_progress_reporter(data.get('websocket'), "create_warehouse")
         data = data['payload']
-        warehouse.build(data["layout"])
-
-        if 'add_workers' in data:
-            warehouse.add_workers(data['add_workers'])
-        if 'remove_workers' in data:
-            warehouse.remove_workers(data['remove_workers'])
-        if 'workers_count' in data:
-            warehouse.set_workers(data['workers_count'])
-
-        if 'filling_rules' in data:
-            data = data['filling_rules']
-
-            if 'empty_cell_ratio' in data:
-                warehouse.EMPTY_CELL_RATIO = float(data['empty_cell_ratio'])
-            if 'heavily_filled_ratio' in data:
-                warehouse.HEAVILY_FILLED_RATIO = float(data['heavily_filled_ratio'])
+        # Компактная форма карты: строки упакованы побитно (см. src.server.codec.pack_layout)
+        layout = unpack_layout(data['layout_packed']) if 'layout_packed' in data else data['layout']
+        # Построение выполняется в отдельном потоке, чтобы не блокировать event loop
+        await asyncio.get_running_loop().run_in_executor(None, warehouse.build, layout, progress)
+        apply_build_settings(warehouse, data)
 
         return {
             "type": "response",
@@ -144,10 +225,229 @@ async def build_map(data: dict) -> dict:
         }
 
 
+async def update_map(data: dict) -> dict:
+    """
+    Точечное изменение склада без перестроения.
+
+    payload: {"add": [[x, y], ...], "remove": [[x, y], ...], "set_start": [x, y], "discard_stock": false}
+    Все поля необязательны; изменение применяется целиком или не применяется вовсе.
+    """
+    try:
+        if 'payload' not in data:
+            raise ValueError()
+        warehouse = data['warehouse']
+        data = data['payload']
+        if not any(key in data for key in ('add', 'remove', 'set_start')):
+            raise ValueError()
+
+        result = await warehouse.solver.change_layout(
+            lambda: warehouse.update_layout(
+                add=data.get('add', ()),
+                remove=data.get('remove', ()),
+                start=data.get('set_start'),
+                discard_stock=bool(data.get('discard_stock', False))
+            )
+        )
+        return {
+            "type": "response",
+            "code": 200,
+            "status": "ok",
+            "message": f"Склад изменён: добавлено ячеек {result['added']}, удалено {result['removed']}",
+            "data": result
+        }
+    except WrongTypeOfCellException as e:
+        return {
+            "type": "response",
+            "code": 409,
+            "status": "error",
+            "message": str(e)
+        }
+    except (KeyError, TypeError, ValueError):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Некорректный формат запроса"
+        }
+
+
+def apply_build_settings(warehouse: Warehouse, data: dict) -> None:
+    """
+    Применяет необязательные параметры построения склада: число работников и правила заполнения.
+    """
+    if 'add_workers' in data:
+        warehouse.add_workers(data['add_workers'])
+    if 'remove_workers' in data:
+        warehouse.remove_workers(data['remove_workers'])
+    if 'workers_count' in data:
+        warehouse.set_workers(data['workers_count'])
+
+    if 'filling_rules' in data:
+        data = data['filling_rules']
+
+        if 'empty_cell_ratio' in data:
+            warehouse.EMPTY_CELL_RATIO = float(data['empty_cell_ratio'])
+        if 'heavily_filled_ratio' in data:
+            warehouse.HEAVILY_FILLED_RATIO = float(data['heavily_filled_ratio'])
+
+
+def upload_error(e: Exception) -> dict:
+    """
+    Ответ на ошибку при загрузке карты склада по частям.
+    """
+    if isinstance(e, UnknownUploadException):
+        return {
+            "type": "response",
+            "code": 404,
+            "status": "error",
+            "message": "Загрузка не найдена, её нужно начать заново"
+        }
+    if isinstance(e, UploadOffsetException):
+        return {
+            "type": "response",
+            "code": 409,
+            "status": "error",
+            "message": str(e),
+            "data": {
+                "next_row": e.next_row
+            }
+        }
+    if isinstance(e, EmptyListOfProductsException):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Перед созданием склада необходимо создать хранимые товары"
+        }
+    if isinstance(e, (IllegalSizeException, IncompleteMapException)):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": f"Некорректные размеры склада: {e}"
+        }
+    return {
+        "type": "response",
+        "code": 400,
+        "status": "error",
+        "message": "Некорректный формат запроса"
+    }
+
+
+async def upload_layout_begin(data: dict) -> dict:
+    """
+    Начало (или возобновление) загрузки карты склада по частям.
+
+    payload: {"rows": <число строк>, "cols": <число столбцов>} - новая загрузка;
+             {"upload_id": <идентификатор>} - возобновление после переподключения.
+    В ответе - идентификатор загрузки, строка, с которой ожидается следующая порция,
+    и рекомендуемый размер порции в строках.
+    """
+    try:
+        if 'payload' not in data:
+            raise ValueError()
+        warehouse = data['warehouse']
+        data = data['payload']
+        loop = asyncio.get_running_loop()
+
+        if 'upload_id' in data:
+            upload = warehouse.uploads.get(str(data['upload_id']))
+        else:
+            upload = await loop.run_in_executor(None, warehouse.begin_upload, int(data['rows']), int(data['cols']))
+
+        return {
+            "type": "response",
+            "code": 201,
+            "status": "ok",
+            "message": f"Загрузка карты {upload.upload_id}: ожидается строка {upload.next_row} из {upload.rows}",
+            "data": {
+                **upload.status(),
+                "chunk_rows": max(1, UPLOAD_CHUNK_CELLS // upload.cols)
+            }
+        }
+    except (KeyError, TypeError, ValueError, BuildException) as e:
+        return upload_error(e)
+
+
+async def upload_layout_chunk(data: dict) -> dict:
+    """
+    Очередная порция строк карты.
+
+    payload: {"upload_id": ..., "offset": <номер первой строки порции>, "rows": [[bool, ...], ...]}
+             либо вместо rows - "rows_packed" в формате src.server.codec.pack_layout.
+    Подтверждение содержит следующую ожидаемую строку; повтор уже записанной порции безопасен.
+    """
+    try:
+        if 'payload' not in data:
+            raise ValueError()
+        warehouse = data['warehouse']
+        data = data['payload']
+        upload = warehouse.uploads.get(str(data['upload_id']))
+        rows = unpack_layout(data['rows_packed']) if 'rows_packed' in data else data['rows']
+
+        next_row = await asyncio.get_running_loop().run_in_executor(None, upload.write, int(data['offset']), rows)
+        return {
+            "type": "response",
+            "code": 202,
+            "status": "ok",
+            "message": f"Получено строк карты: {next_row} из {upload.rows}",
+            "data": upload.status()
+        }
+    except (KeyError, TypeError, ValueError, BuildException) as e:
+        return upload_error(e)
+
+
+async def upload_layout_commit(data: dict) -> dict:
+    """
+    Завершение загрузки: склад атомарно заменяется загруженной картой и заполняется товарами.
+    payload: {"upload_id": ...} и те же необязательные параметры, что у create_warehouse.
+    """
+    try:
+        if 'payload' not in data:
+            raise ValueError()
+        warehouse = data['warehouse']
+        progress = build_progress_reporter(data.get('websocket'), "upload_layout")
+        data = data['payload']
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, warehouse.commit_upload, str(data['upload_id']), progress
+        )
+        apply_build_settings(warehouse, data)
+
+        return {
+            "type": "response",
+            "code": 201,
+            "status": "ok",
+            "message": "Склад успешно создан и предзаполнен товарами"
+        }
+    except (KeyError, TypeError, ValueError, BuildException, EmptyListOfProductsException) as e:
+        return upload_error(e)
+
+
+async def upload_layout_abort(data: dict) -> dict:
+    try:
+        if 'payload' not in data:
+            raise ValueError()
+        warehouse = data['warehouse']
+        upload_id = str(data['payload']['upload_id'])
+
+        if not await asyncio.get_running_loop().run_in_executor(None, warehouse.uploads.abort, upload_id):
+            raise UnknownUploadException(upload_id)
+        return {
+            "type": "response",
+            "code": 200,
+            "status": "ok",
+            "message": f"Загрузка {upload_id} отменена"
+        }
+    except (KeyError, TypeError, ValueError, BuildException) as e:
+        return upload_error(e)
+
+
 async def create_product(data: dict) -> dict:
     try:
         if 'payload' not in data:
             raise ValueError()
+        warehouse = data['warehouse']
         data = data['payload']
         skus = list()
 
@@ -162,7 +462,7 @@ async def create_product(data: dict) -> dict:
             max_per_hand = product['max_per_hand'] if 'max_per_hand' in product else 8
             product_type = product['product_type'] if 'product_type' in product else None
 
-            with db.session() as session:
+            async with db.async_session() as session:
                 try:
                     product = Product(
                         sku=sku,
@@ -175,11 +475,14 @@ async def create_product(data: dict) -> dict:
                     )
 
                     session.add(product)
-                    session.commit()
+                    await session.commit()
                     skus.append(sku)
                     logging.debug(f"Создан новый тип товара: {product}")
                 except SQLAlchemyError:
-                    session.rollback()
+                    await session.rollback()
+
+        if skus:
+            await warehouse.refresh_products()
 
         return {
             "type": "response",
@@ -198,25 +501,28 @@ async def create_product(data: dict) -> dict:
 
 async def delete_product(data: dict) -> dict:
     try:
-        if 'payload' not in data:
+        if 'payload' not in data or 'skus' not in data['payload']:
             raise ValueError()
+        warehouse = data['warehouse']
         data = data['payload']
         skus = list()
 
-        if 'skus' not in data['payload']:
+        if not all(isinstance(sku, int) and not isinstance(sku, bool) for sku in data['skus']):
             raise ValueError()
-        for sku in skus:
-            if not isinstance(sku, int):
-                raise ValueError()
-            sku = product['sku']
 
-            with db.session() as session:
-                try:
-                    session.query(Product).filter(Product.sku == sku).delete()
-                    session.commit()
-                    skus.append(sku)
-                except SQLAlchemyError:
-                    session.rollback()
+        async with db.async_session() as session:
+            try:
+                result = await session.execute(
+                    delete(Product).where(Product.sku.in_(data['skus'])).returning(Product.sku)
+                )
+                skus = sorted(result.scalars().all())
+                await session.commit()
+            except SQLAlchemyError:
+                await session.rollback()
+                skus = list()
+
+        if skus:
+            await warehouse.refresh_products()
 
         return {
             "type": "response",
@@ -234,10 +540,7 @@ async def delete_product(data: dict) -> dict:
 
 
 async def product_list(data: dict) -> dict:
-    products = db.session.query(Product).all()
-    products = list(map(lambda x: x.__dict__, products))
-    for product in products:
-        del product['_sa_instance_state']
+    products = data['warehouse'].catalogue.payload()
 
     return {
         "type": "response",
@@ -265,24 +568,288 @@ async def relieve_worker(data: dict) -> dict:
         }
 
 
+async def confirm_route(data: dict) -> dict:
+    """
+    Подтверждение (или отмена) выданного маршрута: резерв под маршрут списывается со склада либо снимается.
+    """
+    try:
+        if 'payload' not in data or 'route_id' not in data['payload']:
+            raise ValueError()
+        warehouse = data['warehouse']
+        data = data['payload']
+        picked = data.get('status', 'picked') == 'picked'
+        allocation = warehouse.solver.confirm_route(int(data['route_id']), picked)
+
+        return {
+            "type": "response",
+            "code": 200,
+            "status": "ok",
+            "message": f"Маршрут {data['route_id']} {'подтверждён' if picked else 'отменён'}, "
+                       f"затронуто ячеек: {len(allocation)}"
+        }
+    except ValueError:
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Некорректный формат запроса"
+        }
+
+
+async def subscribe(data: dict) -> dict:
+    """
+    Подписка клиента на темы рассылки: `routes`, `routes.<worker_id>`, `inventory`, `solver`.
+
+    payload: {"topics": [...], "since": {"<тема>": <номер последнего полученного события>}}
+    Если для темы передан номер, пропущенные события досылаются из буфера сервера. Признак complete = false
+    означает, что буфера не хватило и клиенту нужно перечитать состояние целиком.
+    """
+    try:
+        if 'payload' not in data or 'websocket' not in data or not isinstance(data['payload'].get('topics'), list):
+            raise ValueError()
+        websocket = data['websocket']
+        data = data['payload']
+        since = data.get('since') or dict()
+
+        unknown = [topic for topic in data['topics'] if not isinstance(topic, str) or not hub.knows(topic)]
+        if unknown:
+            return {
+                "type": "response",
+                "code": 404,
+                "status": "error",
+                "message": f"Неизвестные темы: {unknown}"
+            }
+
+        subscriptions = [
+            hub.subscribe(websocket, topic, int(since[topic]) if since.get(topic) is not None else None)
+            for topic in data['topics']
+        ]
+        return {
+            "type": "response",
+            "code": 200,
+            "status": "ok",
+            "message": f"Оформлено подписок: {len(subscriptions)}",
+            "data": {
+                "subscriptions": subscriptions
+            }
+        }
+    except (ValueError, TypeError, AttributeError):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Некорректный формат запроса"
+        }
+
+
+async def unsubscribe(data: dict) -> dict:
+    """
+    Отписка клиента от тем. payload: {"topics": [...]}
+    """
+    try:
+        if 'payload' not in data or 'websocket' not in data or not isinstance(data['payload'].get('topics'), list):
+            raise ValueError()
+
+        for topic in data['payload']['topics']:
+            hub.unsubscribe(data['websocket'], topic)
+
+        return {
+            "type": "response",
+            "code": 200,
+            "status": "ok",
+            "message": f"Отменено подписок: {len(data['payload']['topics'])}"
+        }
+    except (ValueError, AttributeError):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Некорректный формат запроса"
+        }
+
+
+def parse_order(order, products: dict[int, Product]) -> SelectionRequest:
+    """
+    Проверяет заказ и собирает из него запрос на выборку.
+
+    :param order: {"items": {"<sku>": <количество>, ...}, "deadline": <секунд от текущего момента или ISO 8601>,
+        "priority": "urgent" | "high" | "normal" | "low"}. Дедлайн со смещением переводится в местное время.
+    :param products: Каталог товаров по артикулу.
+    :raises ValueError: С описанием причины, если заказ некорректен.
+    """
+    if not isinstance(order, dict) or not isinstance(order.get('items'), dict) or not order['items']:
+        raise ValueError("Заказ должен содержать непустой словарь items")
+
+    items = list()
+    for sku, count in order['items'].items():
+        product = products.get(int(sku))
+        if product is None:
+            raise ValueError(f"Неизвестный артикул {sku}")
+        if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+            raise ValueError(f"Некорректное количество товара {sku}: {count}")
+        items.append((product, count))
+
+    deadline = order.get('deadline')
+    if isinstance(deadline, (int, float)) and not isinstance(deadline, bool):
+        deadline = datetime.now() + timedelta(seconds=deadline)
+    elif isinstance(deadline, str):
+        deadline = datetime.fromisoformat(deadline)
+        if deadline.tzinfo is not None:
+            # Все дедлайны решателя - местное время без часового пояса
+            deadline = deadline.astimezone().replace(tzinfo=None)
+    elif deadline is not None:
+        raise ValueError("Некорректный дедлайн")
+
+    priority = order.get('priority', 'normal')
+    if isinstance(priority, str):
+        if priority.upper() not in Priority.__members__:
+            raise ValueError(f"Неизвестный приоритет {priority}")
+        priority = Priority[priority.upper()]
+
+    return SelectionRequest(*items, deadline=deadline, priority=Priority(priority))
+
+
+async def submit_orders(data: dict) -> dict:
+    """
+    Пакетная постановка заказов.
+
+    payload: {"orders": [{"order_id": ..., "items": {"<sku>": <количество>}, "deadline": ..., "priority": ...}, ...],
+              "worker_id": <необязательный получатель маршрутов>}
+    Заказы проверяются по каталогу одним проходом, корректные ставятся в очередь решателя за один шаг.
+    Ответ содержит подтверждение по каждому заказу (принят с request_id или отклонён с причиной);
+    затем по мере построения клиенту приходят сообщения `order_route` с маршрутом каждого заказа
+    и итоговое `orders_done`.
+    """
+    try:
+        if 'payload' not in data or not isinstance(data['payload'].get('orders'), list):
+            raise ValueError()
+        warehouse = data['warehouse']
+        websocket = data.get('websocket')
+        worker_id = data['payload'].get('worker_id')
+        orders = data['payload']['orders']
+        if len(orders) > MAX_ORDERS:
+            return {
+                "type": "response",
+                "code": 413,
+                "status": "error",
+                "message": f"В одной команде можно передать не более {MAX_ORDERS} заказов"
+            }
+
+        products = warehouse.catalogue.by_sku()
+        acks, accepted = list(), list()
+        for i, order in enumerate(orders):
+            order_id = order.get('order_id', i) if isinstance(order, dict) else i
+            try:
+                request = parse_order(order, products)
+            except (ValueError, TypeError, OverflowError) as e:
+                acks.append({"order_id": order_id, "status": "rejected", "reason": str(e)})
+                continue
+            acks.append({"order_id": order_id, "status": "accepted", "request_id": request.request_id})
+            accepted.append((order_id, request))
+
+        futures = await warehouse.solve_many([request for _, request in accepted],
+                                             None if worker_id is None else str(worker_id))
+        if accepted and websocket is not None:
+            task = asyncio.create_task(stream_order_routes(websocket, [
+                (order_id, request.request_id, future) for (order_id, request), future in zip(accepted, futures)
+            ]))
+            _order_streams.add(task)
+            task.add_done_callback(_order_streams.discard)
+            keep = getattr(websocket, 'keep', None)
+            if keep is not None:
+                # Клиент команды в процессе решателя: основной процесс помнит его, пока идут маршруты
+                keep(task)
+
+        return {
+            "type": "response",
+            "code": 202,
+            "status": "ok",
+            "message": f"Принято заказов: {len(accepted)} из {len(orders)}",
+            "data": {
+                "orders": acks
+            }
+        }
+    except (ValueError, AttributeError):
+        return {
+            "type": "response",
+            "code": 400,
+            "status": "error",
+            "message": "Некорректный формат запроса"
+        }
+
+
+async def stream_order_routes(websocket, orders: list[tuple]) -> None:
+    """
+    Отправляет клиенту маршрут каждого заказа по мере готовности, затем итоговое сообщение.
+    """
+    async def wait(order_id, request_id, future: asyncio.Future) -> tuple:
+        try:
+            return order_id, request_id, await future, None
+        except Exception as e:
+            return order_id, request_id, None, e
+
+    completed = failed = 0
+    for result in asyncio.as_completed([wait(*order) for order in orders]):
+        order_id, request_id, route, error = await result
+        message = {"type": "order_route", "order_id": order_id, "request_id": request_id}
+        if error is None and route:
+            message.update(status="ok", data={"moving_cells": [Route(route)]})
+            completed += 1
+        else:
+            message.update(status="error", message=f"Маршрут не построен: {error}" if error else "Маршрут не построен")
+            failed += 1
+        if not hub.send(websocket, message):
+            return
+
+    hub.send(websocket, {
+        "type": "orders_done",
+        "data": {
+            "completed": completed,
+            "failed": failed
+        }
+    })
+
+
+# Тестовый запрос создаётся не чаще раза в 33 секунды, остальные вызовы run ничего не ставят в очередь
 time_anchor = datetime.now() - timedelta(days=1)
 
 
-async def solve(data: dict) -> Optional[list]:
+async def solve(data: dict) -> Optional[list | dict]:
+    """
+    Создаёт новый запрос на выборку (не чаще раза в 33 секунды) и дожидается построенного для него маршрута.
+    """
     global time_anchor
     data['request'] = None
     if datetime.now() - time_anchor > timedelta(seconds=33):
         time_anchor = datetime.now()
         warehouse = data['warehouse']
-        request = warehouse.generate_new_request()
-        data['request'] = request
+        data['request'] = warehouse.generate_new_request()
 
     return await check(data)
 
 
-async def check(data: dict) -> Optional[list]:
+async def check(data: dict) -> Optional[list | dict]:
     warehouse = data['warehouse']
-    result = await warehouse.solve(data['request'])
+    # Каналы работников и темы routes.<worker_id> адресуются строковым идентификатором
+    worker_id = data.get('worker_id')
+    future = await warehouse.solve(data['request'], None if worker_id is None else str(worker_id))
+    if future is None:
+        return None
+
+    try:
+        # shield: по таймауту отпускается только клиент, запрос остаётся в очереди и маршрут придёт в канал работника
+        result = await asyncio.wait_for(asyncio.shield(future), ROUTE_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # Ошибку, которой решатель может позже завершить future, забираем, чтобы она не попала в лог как непрочитанная
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return {
+            "type": "response",
+            "code": 202,
+            "status": "ok",
+            "message": f"Маршрут для запроса {data['request'].request_id} ещё строится",
+            "request_id": data['request'].request_id
+        }
+
     if result:
         return result
     return None
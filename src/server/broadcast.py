@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Optional, Union
+
+from websockets.asyncio.server import ServerConnection
+from websockets.exceptions import ConnectionClosed
+
+from src.server.codec import Codec, negotiated
+
+# Источник событий темы: корутина, которая работает, пока у темы есть подписчики, и публикует в неё события
+Producer = Callable[['TopicHub', str], Awaitable[None]]
+
+
+class SendQueue:
+    """
+    Ограниченная очередь исходящих сообщений клиента.
+
+    Сообщения бывают трёх видов:
+    - события рассылки: при переполнении выбрасывается самое старое из них;
+    - сообщения с ключом (например, прогресс операции): новое сообщение с тем же ключом заменяет
+      ещё не отправленное, сохраняя его место в очереди;
+    - ответы на команды: не выбрасываются никогда, но если их накопилось больше `limit`, очередь
+      считается переполненной и клиента нужно отключить.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.limit = 2 * maxsize
+        self.dropped = 0
+        self.coalesced = 0
+        # Элементы: [сообщение, ключ, можно ли выбросить]
+        self._items: deque[list] = deque()
+        self._keys: dict[Hashable, list] = dict()
+        self._ready = asyncio.Event()
+
+    def put(self, payload: Union[str, bytes], key: Optional[Hashable] = None, droppable: bool = True) -> bool:
+        """
+        :return: False, если очередь была заполнена: ради нового сообщения выброшено старое
+            или выбросить было нечего.
+        """
+        if key is not None and key in self._keys:
+            self._keys[key][0] = payload
+            self.coalesced += 1
+            return True
+
+        accepted = len(self._items) < self.maxsize
+        if not accepted:
+            victim = next((item for item in self._items if item[2]), None)
+            if victim is not None:
+                self._items.remove(victim)
+                if victim[1] is not None:
+                    del self._keys[victim[1]]
+                self.dropped += 1
+
+        item = [payload, key, droppable]
+        self._items.append(item)
+        if key is not None:
+            self._keys[key] = item
+        self._ready.set()
+        return accepted
+
+    @property
+    def overflowed(self) -> bool:
+        return len(self._items) > self.limit
+
+    async def get(self) -> Union[str, bytes]:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+
+        payload, key, _ = self._items.popleft()
+        if key is not None:
+            del self._keys[key]
+        return payload
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def full(self) -> bool:
+        return len(self._items) >= self.maxsize
+
+
+class Subscriber:
+    """
+    Подключённый клиент: согласованный с ним формат сообщений, его темы
+    и ограниченная очередь исходящих сообщений, которую разбирает отдельная задача отправки.
+    """
+
+    def __init__(self, websocket: ServerConnection, maxsize: int):
+        self.websocket = websocket
+        self.codec: Codec = negotiated(websocket)
+        self.topics: set[str] = set()
+        self.queue = SendQueue(maxsize)
+        self.sent = 0
+        self.dropped = 0
+        # Сколько публикаций подряд клиент не успевал разобрать очередь
+        self.lagging = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class Topic:
+    """
+    Тема рассылки: последовательные номера событий, буфер последних событий для догоняющих клиентов
+    и задача источника, если он есть. У темы с `coalesce` в очереди клиента держится только последнее
+    неотправленное событие (например, состояние решателя, где важно лишь текущее значение).
+    """
+
+    def __init__(self, name: str, replay: int, coalesce: bool = False):
+        self.name = name
+        self.coalesce = coalesce
+        self.sequence = 0
+        self.history: deque[tuple[int, dict]] = deque(maxlen=replay)
+        self.subscribers: set[Subscriber] = set()
+        self.producer: Optional[asyncio.Task] = None
+
+
+class TopicHub:
+    """
+    Рассылка событий по темам.
+
+    Клиент подписывается на темы (например, `routes`, `routes.<worker_id>`, `inventory`, `solver`), и сервер
+    отправляет ему только реальные изменения. Каждое событие темы получает следующий порядковый номер `seq`,
+    сериализуется один раз для каждого формата сообщений (JSON, MessagePack) и раскладывается по ограниченным
+    очередям подписчиков; каждую очередь разбирает своя задача отправки. Последние события темы хранятся в ограниченном буфере: переподключившийся клиент
+    передаёт последний полученный номер и получает пропущенное одним сообщением `replay`.
+
+    Все сообщения клиенту, включая ответы на команды и прогресс операций (см. `send`), идут через его
+    ограниченную очередь (SendQueue), поэтому сервер никогда не буферизует для одного клиента больше
+    фиксированного числа сообщений. Медленный клиент не тормозит остальных: при переполнении его очереди
+    самое старое событие выбрасывается, а если клиент отстаёт дольше `max_lag` сообщений подряд или
+    не забирает ответы на свои команды, соединение с ним закрывается.
+
+    Источник темы (см. `source`) запускается при появлении первого подписчика и останавливается,
+    когда уходит последний, поэтому без подписчиков ничего не вычисляется. Допустимые имена тем задаются
+    при регистрации источника; из тем с параметром без подписчиков хранятся только `idle_topics`
+    последних (ради буфера для переподключения), остальные удаляются.
+    """
+
+    def __init__(self, maxsize: int = 32, max_lag: int = 256, replay: int = 256, idle_topics: int = 64):
+        self.maxsize = maxsize
+        self.max_lag = max_lag
+        self.replay = replay
+        self.idle_topics = idle_topics
+        self.published = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnected = 0
+        self._topics: dict[str, Topic] = dict()
+        self._sources: dict[str, Producer] = dict()
+        self._parameters: dict[str, Optional[re.Pattern]] = dict()
+        self._coalesced_sources: set[str] = set()
+        # Темы с параметром, у которых не осталось подписчиков, от давних к недавним
+        self._idle: OrderedDict[str, None] = OrderedDict()
+        self._subscribers: dict[ServerConnection, Subscriber] = dict()
+
+    def source(self, prefix: str, producer: Producer, coalesce: Optional[bool] = None,
+               parameter: Optional[str] = None) -> None:
+        """
+        Регистрирует источник для темы `prefix` и тем вида `prefix.<параметр>`.
+
+        :param coalesce: Держать в очереди клиента только последнее событие темы. None - не менять.
+        :param parameter: Регулярное выражение допустимого параметра темы. None - у темы нет параметра.
+        """
+        self._sources[prefix] = producer
+        self._parameters[prefix] = re.compile(parameter) if parameter is not None else None
+        if coalesce is not None:
+            if coalesce:
+                self._coalesced_sources.add(prefix)
+            else:
+                self._coalesced_sources.discard(prefix)
+
+    def connect(self, websocket: ServerConnection) -> Subscriber:
+        """
+        Заводит для клиента очередь исходящих сообщений и задачу отправки.
+        """
+        subscriber = self._subscribers.get(websocket)
+        if subscriber is None:
+            subscriber = Subscriber(websocket, self.maxsize)
+            subscriber.task = asyncio.create_task(self._writer(subscriber))
+            self._subscribers[websocket] = subscriber
+        return subscriber
+
+    def disconnect(self, websocket: ServerConnection) -> None:
+        """
+        Отписывает клиента от всех тем и останавливает отправку ему сообщений.
+        """
+        subscriber = self._subscribers.get(websocket)
+        if subscriber is None:
+            return
+
+        self.unsubscribe(websocket)
+        del self._subscribers[websocket]
+        subscriber.task.cancel()
+
+    def send(self, websocket, message: dict, key: Optional[Hashable] = None) -> bool:
+        """
+        Отправляет сообщение одному клиенту через его очередь.
+        Без ключа сообщение - ответ на команду и не выбрасывается; с ключом - заменяет ещё не отправленное
+        сообщение с тем же ключом (например, прогресс той же операции).
+        Подключения, которые рассылка не обслуживает (клиент команды в процессе решателя), передают
+        сообщение дальше своим методом relay.
+
+        :return: False, если клиент не подключён или был отключён из-за переполнения очереди.
+        """
+        subscriber = self._subscribers.get(websocket)
+        if subscriber is None:
+            relay = getattr(websocket, 'relay', None)
+            if relay is not None:
+                relay(message, key)
+                return True
+            return False
+
+        payload = subscriber.codec.encode(message)
+        if not self._enqueue(subscriber, payload, key, droppable=key is not None):
+            self._drop_slow(subscriber)
+            return False
+        return True
+
+    def knows(self, topic: str) -> bool:
+        prefix, dot, parameter = topic.partition('.')
+        if prefix not in self._sources:
+            return False
+        if not dot:
+            return True
+        pattern = self._parameters.get(prefix)
+        return pattern is not None and pattern.fullmatch(parameter) is not None
+
+    def subscribe(self, websocket: ServerConnection, topic: str, since: Optional[int] = None) -> dict:
+        """
+        Подписывает клиента на тему.
+
+        :param since: Номер последнего полученного клиентом события. Если передан, пропущенные события
+            из буфера отправляются клиенту сразу после подписки.
+        :return: Описание подписки: текущий номер темы, сколько событий досылается и хватило ли буфера.
+        :raises ValueError: Если такой темы нет (см. knows).
+        """
+        if not self.knows(topic):
+            raise ValueError(f"Неизвестная тема {topic}")
+        subscriber = self.connect(websocket)
+
+        self._idle.pop(topic, None)
+        state = self._topic(topic)
+        state.subscribers.add(subscriber)
+        subscriber.topics.add(topic)
+
+        producer = self._sources.get(topic.split('.', 1)[0])
+        if producer is not None and (state.producer is None or state.producer.done()):
+            state.producer = asyncio.create_task(producer(self, topic))
+
+        missed, complete = list(), True
+        if since is not None:
+            missed = [message for seq, message in state.history if seq > since]
+            # Буфер не покрывает весь пропуск (или нумерация началась заново после перезапуска сервера):
+            # клиенту нужно перечитать состояние целиком
+            oldest = state.history[0][0] if state.history else state.sequence + 1
+            complete = oldest - 1 <= since <= state.sequence
+            if missed:
+                replay = subscriber.codec.encode({"type": "replay", "topic": topic, "events": missed})
+                self._enqueue(subscriber, replay, droppable=False)
+
+        return {"topic": topic, "seq": state.sequence, "replayed": len(missed), "complete": complete}
+
+    def unsubscribe(self, websocket: ServerConnection, topic: Optional[str] = None) -> None:
+        """
+        Отписывает клиента от темы, а без темы - от всех тем. Очередь сообщений клиента остаётся до disconnect.
+        """
+        subscriber = self._subscribers.get(websocket)
+        if subscriber is None:
+            return
+
+        for name in ([topic] if topic is not None else list(subscriber.topics)):
+            subscriber.topics.discard(name)
+            state = self._topics.get(name)
+            if state is None:
+                continue
+            state.subscribers.discard(subscriber)
+            if not state.subscribers:
+                self._release(state)
+
+    def publish(self, topic: str, message: dict) -> int:
+        """
+        Публикует событие в тему: дополняет сообщение полями `topic` и `seq`, сериализует его один раз
+        на каждый используемый подписчиками формат и ставит в очереди всех подписчиков темы.
+
+        :return: Количество подписчиков, получивших событие в очередь.
+        """
+        state = self._topics.get(topic)
+        if state is None:
+            # Источник уже остановлен, а тема удалена
+            return 0
+        state.sequence += 1
+        message = {**message, "topic": topic, "seq": state.sequence}
+        state.history.append((state.sequence, message))
+        self.published += 1
+
+        payloads: dict[str, Union[str, bytes]] = dict()
+        key = topic if state.coalesce else None
+        slow = list()
+        for subscriber in state.subscribers:
+            codec = subscriber.codec
+            if codec.name not in payloads:
+                payloads[codec.name] = codec.encode(message)
+            if not self._enqueue(subscriber, payloads[codec.name], key):
+                slow.append(subscriber)
+        receivers = len(state.subscribers)
+        for subscriber in slow:
+            self._drop_slow(subscriber)
+        return receivers
+
+    def _topic(self, topic: str) -> Topic:
+        if topic not in self._topics:
+            coalesce = topic.split('.', 1)[0] in self._coalesced_sources
+            self._topics[topic] = Topic(topic, self.replay, coalesce)
+        return self._topics[topic]
+
+    def _release(self, state: Topic) -> None:
+        """
+        Останавливает источник темы без подписчиков. Тему с параметром откладывает в ограниченный список
+        простаивающих, вытесняя из него самую давнюю.
+        """
+        if state.producer is not None:
+            state.producer.cancel()
+            state.producer = None
+        if '.' not in state.name:
+            return
+
+        self._idle[state.name] = None
+        self._idle.move_to_end(state.name)
+        while len(self._idle) > self.idle_topics:
+            name, _ = self._idle.popitem(last=False)
+            self._topics.pop(name, None)
+
+    def _enqueue(self, subscriber: Subscriber, payload: Union[str, bytes],
+                 key: Optional[Hashable] = None, droppable: bool = True) -> bool:
+        """
+        :return: False, если клиент отстаёт слишком долго и его нужно отключить.
+        """
+        queue = subscriber.queue
+        dropped, coalesced = queue.dropped, queue.coalesced
+        accepted = queue.put(payload, key, droppable)
+        subscriber.dropped += queue.dropped - dropped
+        self.dropped += queue.dropped - dropped
+        self.coalesced += queue.coalesced - coalesced
+
+        if accepted:
+            subscriber.lagging = 0
+            return True
+        subscriber.lagging += 1
+        return subscriber.lagging <= self.max_lag and not queue.overflowed
+
+    def _drop_slow(self, subscriber: Subscriber) -> None:
+        if subscriber.websocket not in self._subscribers:
+            return
+        logging.warning(f"Клиент {subscriber.websocket.id} не успевает получать сообщения и будет отключён")
+        self.disconnected += 1
+        self.disconnect(subscriber.websocket)
+        asyncio.create_task(subscriber.websocket.close(1013, "Клиент не успевает получать сообщения"))
+
+    async def _writer(self, subscriber: Subscriber) -> None:
+        try:
+            while True:
+                payload = await subscriber.queue.get()
+                await subscriber.websocket.send(payload)
+                subscriber.sent += 1
+        except ConnectionClosed:
+            logging.debug(f"Клиент {subscriber.websocket.id} отключился от рассылки")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка при отправке сообщения клиенту {subscriber.websocket.id}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "topics": {name: len(state.subscribers) for name, state in self._topics.items() if state.subscribers},
+            "published": self.published,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "disconnected": self.disconnected,
+            "queued": sum(subscriber.queue.qsize() for subscriber in self._subscribers.values())
+        }
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def __contains__(self, websocket: ServerConnection) -> bool:
+        return websocket in self._subscribers
+
+
+# Общая рассылка сервера: источники тем регистрирует src.server.server
+hub = TopicHub()
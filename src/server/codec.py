@@ -0,0 +1,232 @@
+"""
+Кодирование сообщений websocket.
+
+Формат согласуется при подключении через подпротокол websocket (Sec-WebSocket-Protocol):
+- `warehouse.msgpack` - MessagePack в бинарных кадрах, маршруты кодируются отрезками направлений;
+- `warehouse.json` или отсутствие подпротокола - прежний JSON в текстовых кадрах.
+Текстовые кадры от клиента всегда разбираются как JSON, поэтому JSON остаётся запасным вариантом
+для любого соединения.
+"""
+import base64
+import json
+import threading
+import time
+from collections.abc import Sequence
+from typing import Optional, Union
+
+import msgpack
+import numpy as np
+
+# Направления отрезков маршрута: (dx, dy) единичного шага -> код
+DIRECTIONS = {(1, 0): 0, (-1, 0): 1, (0, 1): 2, (0, -1): 3}
+STEPS = {code: step for step, code in DIRECTIONS.items()}
+# Маркер отрезка, который нельзя выразить направлением: за ним следуют dx, dy и признак товара
+ESCAPE = -1
+
+
+class Route(list):
+    """
+    Маршрут [(x, y, "product"|"passage"), ...]. В JSON передаётся как обычный список точек,
+    в MessagePack - в виде отрезков направлений (см. encode_route).
+    """
+
+
+def _sign(value: int) -> int:
+    return (value > 0) - (value < 0)
+
+
+def encode_route(route: Sequence) -> dict:
+    """
+    Кодирует маршрут отрезками: после начальной точки каждый отрезок - одно целое
+    `длина << 3 | товар << 2 | направление`. Короткие отрезки занимают в MessagePack один байт.
+    """
+    if not route:
+        return {"start": None, "runs": []}
+
+    x0, y0, kind = route[0]
+    runs = list()
+    px, py = x0, y0
+    for x, y, kind_ in route[1:]:
+        dx, dy = x - px, y - py
+        product = int(kind_ == 'product')
+        if (dx == 0) != (dy == 0):
+            runs.append((abs(dx) + abs(dy)) << 3 | product << 2 | DIRECTIONS[(_sign(dx), _sign(dy))])
+        else:
+            runs.extend((ESCAPE, dx, dy, product))
+        px, py = x, y
+    return {"start": [x0, y0, int(kind == 'product')], "runs": runs}
+
+
+def decode_route(encoded: dict) -> list[tuple[int, int, str]]:
+    """
+    Обратное преобразование encode_route.
+    """
+    if encoded["start"] is None:
+        return list()
+
+    x, y, product = encoded["start"]
+    route = [(x, y, "product" if product else "passage")]
+    runs, i = encoded["runs"], 0
+    while i < len(runs):
+        if runs[i] == ESCAPE:
+            dx, dy, product = runs[i + 1:i + 4]
+            i += 4
+        else:
+            length, product = runs[i] >> 3, runs[i] >> 2 & 1
+            step_x, step_y = STEPS[runs[i] & 3]
+            dx, dy = step_x * length, step_y * length
+            i += 1
+        x, y = x + dx, y + dy
+        route.append((x, y, "product" if product else "passage"))
+    return route
+
+
+def pack_layout(layout) -> dict:
+    """
+    Упаковывает карту склада побитно: каждая строка дополняется до целого числа байт.
+    """
+    layout = np.asarray(layout, dtype=bool)
+    return {"rows": layout.shape[0], "cols": layout.shape[1], "bits": np.packbits(layout, axis=1).tobytes()}
+
+
+def unpack_layout(packed: dict) -> np.ndarray:
+    """
+    Распаковывает карту склада, упакованную pack_layout. В JSON поле bits передаётся строкой base64.
+
+    :raises ValueError: Если размер данных не соответствует заявленным размерам карты.
+    """
+    try:
+        rows, cols, bits = int(packed["rows"]), int(packed["cols"]), packed["bits"]
+        if isinstance(bits, str):
+            bits = base64.b64decode(bits)
+    except (KeyError, TypeError) as e:
+        raise ValueError("Некорректная упакованная карта") from e
+
+    row_bytes = (cols + 7) // 8
+    if rows < 0 or cols < 0 or len(bits) != rows * row_bytes:
+        raise ValueError("Размер упакованной карты не соответствует её размерам")
+    data = np.frombuffer(bits, dtype=np.uint8).reshape(rows, row_bytes)
+    return np.unpackbits(data, axis=1, count=cols).astype(bool)
+
+
+class Codec:
+    """
+    Формат сообщений с учётом объёма и времени сериализации.
+    """
+    name: str = ""
+    binary: bool = False
+
+    def __init__(self):
+        self.encoded = 0
+        self.encoded_bytes = 0
+        self.encode_time = 0.0
+        self.decoded = 0
+        self.decoded_bytes = 0
+        self.decode_time = 0.0
+        self._lock = threading.Lock()
+
+    def encode(self, message: dict) -> Union[str, bytes]:
+        started = time.perf_counter()
+        payload = self._encode(message)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.encoded += 1
+            self.encoded_bytes += len(payload)
+            self.encode_time += elapsed
+        return payload
+
+    def decode(self, payload: Union[str, bytes]) -> dict:
+        started = time.perf_counter()
+        message = self._decode(payload)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.decoded += 1
+            self.decoded_bytes += len(payload)
+            self.decode_time += elapsed
+        return message
+
+    def _encode(self, message: dict) -> Union[str, bytes]:
+        raise NotImplementedError()
+
+    def _decode(self, payload: Union[str, bytes]) -> dict:
+        raise NotImplementedError()
+
+    def stats(self) -> dict:
+        return {
+            "encoded": self.encoded,
+            "encoded_bytes": self.encoded_bytes,
+            "bytes_per_message": self.encoded_bytes / self.encoded if self.encoded else 0.0,
+            "encode_time": self.encode_time,
+            "decoded": self.decoded,
+            "decoded_bytes": self.decoded_bytes,
+            "decode_time": self.decode_time
+        }
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def _encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+    def _decode(self, payload: Union[str, bytes]) -> dict:
+        return json.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    @staticmethod
+    def _default(obj):
+        # strict_types: подклассы list (маршруты) и кортежи попадают сюда, а не упаковываются как массивы
+        if isinstance(obj, Route):
+            return encode_route(obj)
+        if isinstance(obj, (tuple, list)):
+            return list(obj)
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"Тип {type(obj).__name__} не поддерживается MessagePack")
+
+    def _encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True, strict_types=True, default=self._default)
+
+    def _decode(self, payload: Union[str, bytes]) -> dict:
+        return msgpack.unpackb(payload, raw=False)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+
+# Подпротоколы в порядке предпочтения сервера
+CODECS: dict[str, Codec] = {
+    "warehouse.msgpack": MSGPACK,
+    "warehouse.json": JSON
+}
+
+
+def select_subprotocol(connection, subprotocols: Sequence[str]) -> Optional[str]:
+    """
+    Выбор подпротокола при подключении. Клиент без подпротокола подключается без него и получает JSON.
+    """
+    for subprotocol in CODECS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+def negotiated(websocket) -> Codec:
+    return CODECS.get(getattr(websocket, 'subprotocol', None), JSON)
+
+
+def decode(codec: Codec, payload: Union[str, bytes]) -> dict:
+    """
+    Разбирает сообщение клиента: текстовые кадры - всегда JSON, бинарные - согласованным форматом.
+    """
+    if isinstance(payload, str):
+        return JSON.decode(payload)
+    return codec.decode(payload)
+
+
+def stats() -> dict:
+    return {codec.name: codec.stats() for codec in CODECS.values()}
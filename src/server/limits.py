@@ -0,0 +1,108 @@
+"""
+Ограничение частоты входящих команд.
+
+Для каждого подключения и каждого типа команды заводится корзина токенов (token bucket): команда
+расходует токен, токены восполняются с постоянной скоростью до ёмкости корзины. Ёмкость задаёт
+допустимый всплеск, скорость - среднюю частоту. Команда без токена не выполняется, клиент получает
+ответ 429 с временем, через которое можно повторить.
+"""
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
+from typing import Optional
+
+# Скорость (команд в секунду) и ёмкость корзины по типам команд
+RATE_LIMITS: dict[str, tuple[float, float]] = {
+    "create_warehouse": (0.1, 1),
+    "upload_layout_begin": (0.2, 2),
+    "upload_layout_chunk": (50, 100),
+    "upload_layout_commit": (0.1, 1),
+    "update_warehouse": (5, 10),
+    "create_product_type": (5, 20),
+    "delete_product_type": (5, 20),
+    "server_status": (2, 5),
+    "submit_orders": (1, 5),
+    "run": (5, 10)
+}
+# Остальные известные команды
+DEFAULT_LIMIT = (20, 40)
+# Общая корзина для сообщений без типа и неизвестных команд, чтобы их нельзя было разнести по разным корзинам
+OTHER = "*"
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> float:
+        """
+        Забирает токен.
+
+        :return: 0, если токен есть, иначе через сколько секунд он появится.
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class LimitStats:
+    """
+    Общие по серверу счётчики пропущенных и отклонённых команд.
+    """
+
+    def __init__(self):
+        self.allowed: Counter[str] = Counter()
+        self.throttled: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, command: str, allowed: bool) -> None:
+        with self._lock:
+            (self.allowed if allowed else self.throttled)[command] += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "allowed": sum(self.allowed.values()),
+                "throttled": dict(self.throttled)
+            }
+
+
+stats = LimitStats()
+
+
+class RateLimiter:
+    """
+    Корзины токенов одного подключения по типам команд.
+    """
+
+    def __init__(self, known: Optional[set[str]] = None, limits: Mapping[str, tuple[float, float]] = RATE_LIMITS,
+                 default: tuple[float, float] = DEFAULT_LIMIT):
+        self.known = known
+        self.limits = limits
+        self.default = default
+        self._buckets: dict[str, TokenBucket] = dict()
+
+    def check(self, command: Optional[str]) -> float:
+        """
+        :return: 0, если команду можно выполнить, иначе через сколько секунд её можно повторить.
+        """
+        if not isinstance(command, str) or (self.known is not None and command not in self.known):
+            command = OTHER
+
+        bucket = self._buckets.get(command)
+        if bucket is None:
+            bucket = self._buckets[command] = TokenBucket(*self.limits.get(command, self.default))
+
+        retry_after = bucket.take()
+        stats.record(command, not retry_after)
+        return retry_after
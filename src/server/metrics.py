@@ -0,0 +1,234 @@
+"""
+HTTP-эндпоинты мониторинга на порту websocket: `/healthz` и `/metrics` в текстовом формате Prometheus.
+
+Обычные GET-запросы перехватываются в `process_request` до рукопожатия websocket; запросы с заголовком
+`Upgrade: websocket` проходят дальше без изменений, на каком бы пути они ни были.
+"""
+import json
+import logging
+from http import HTTPStatus
+from typing import Optional, Union
+
+from src.parsers.db_parser import db
+from src.parsers.json_parser import manager
+from src.server.broadcast import hub
+from src.server.codec import stats as codec_stats
+from src.server.limits import stats as limit_stats
+from src.server.server import connected_clients
+from src.server.startup import profile
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Метрики пулов соединений с БД: (имя, тип, описание, поле Database.pool_stats)
+POOL_METRICS = (
+    ("db_pool_size", "gauge", "Размер пула соединений с БД", "size"),
+    ("db_pool_checked_out", "gauge", "Выданные соединения пула", "checked_out"),
+    ("db_pool_overflow", "gauge", "Соединения сверх размера пула", "overflow"),
+    ("db_pool_checkouts_total", "counter", "Выдачи соединений пула", "checkouts"),
+    ("db_pool_timeouts_total", "counter", "Отказы пула по таймауту", "timeouts"),
+    ("db_pool_wait_seconds_total", "counter", "Суммарное ожидание свободного соединения", "wait_time"),
+    ("db_pool_hold_seconds_total", "counter", "Суммарное время удержания соединений", "hold_time")
+)
+# Метрики форматов сообщений: (имя, описание, поле Codec.stats)
+CODEC_METRICS = (
+    ("messages_encoded_total", "Закодированные сообщения", "encoded"),
+    ("encoded_bytes_total", "Объём закодированных сообщений", "encoded_bytes"),
+    ("encode_seconds_total", "Время кодирования сообщений", "encode_time")
+)
+
+
+def solver_snapshot() -> dict:
+    """
+    Показатели процесса, которому принадлежит склад: решатель, пулы соединений с БД, журнал остатков
+    и кэш предвычисленных данных. В режиме отдельного процесса решателя вызывается в нём
+    и передаётся в основной процесс вместе с ответом на пинг.
+    """
+    warehouse = manager.warehouse
+    return {
+        "solver": warehouse.solver.metrics(),
+        "db": db.pool_stats(),
+        "journal": warehouse.state.journal_stats(),
+        "precompute": warehouse.precomputed.stats()
+    }
+
+
+class Exposition:
+    """
+    Построитель текста в формате Prometheus: HELP и TYPE выводятся один раз перед первым значением метрики.
+    """
+
+    def __init__(self, prefix: str = "warehouse_"):
+        self.prefix = prefix
+        self.lines: list[str] = list()
+        self._declared: set[str] = set()
+
+    def _declare(self, name: str, kind: str, description: str) -> None:
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {description}")
+            self.lines.append(f"# TYPE {name} {kind}")
+
+    @staticmethod
+    def _labels(labels: Optional[dict]) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for key, value in labels.items()
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def add(self, name: str, kind: str, description: str, value: Union[int, float, bool, None],
+            labels: Optional[dict] = None) -> None:
+        if value is None:
+            return
+        name = self.prefix + name
+        self._declare(name, kind, description)
+        self.lines.append(f"{name}{self._labels(labels)} {float(value)!r}")
+
+    def histogram(self, name: str, description: str, data: dict, labels: Optional[dict] = None) -> None:
+        """
+        :param data: Гистограмма в виде Histogram.as_dict (накопленные значения корзин).
+        """
+        name = self.prefix + name
+        self._declare(name, "histogram", description)
+        labels = labels or dict()
+        for bound, count in data["buckets"].items():
+            self.lines.append(f"{name}_bucket{self._labels({**labels, 'le': repr(float(bound))})} {count}")
+        self.lines.append(f"{name}_bucket{self._labels({**labels, 'le': '+Inf'})} {data['count']}")
+        self.lines.append(f"{name}_sum{self._labels(labels)} {float(data['sum'])!r}")
+        self.lines.append(f"{name}_count{self._labels(labels)} {data['count']}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def local_snapshot() -> Optional[dict]:
+    """
+    Показатели решателя: из процесса решателя (последний ответ на пинг) или из текущего процесса.
+    """
+    if manager.remote is not None:
+        return manager.remote.snapshot or None
+    if not manager.loaded:
+        return None
+    return solver_snapshot()
+
+
+def render_metrics() -> str:
+    out = Exposition()
+    out.add("connections", "gauge", "Активные подключения websocket", len(connected_clients))
+
+    broadcast = hub.stats()
+    out.add("send_queue_depth", "gauge", "Сообщения в очередях отправки клиентам", broadcast["queued"])
+    out.add("broadcast_published_total", "counter", "Опубликованные события рассылки", broadcast["published"])
+    out.add("send_dropped_total", "counter", "Выброшенные из очередей отправки сообщения", broadcast["dropped"])
+    out.add("send_coalesced_total", "counter", "Схлопнутые в очередях отправки сообщения", broadcast["coalesced"])
+    out.add("slow_clients_disconnected_total", "counter", "Отключённые медленные клиенты", broadcast["disconnected"])
+    for topic, subscribers in broadcast["topics"].items():
+        out.add("topic_subscribers", "gauge", "Подписчики темы рассылки", subscribers, {"topic": topic})
+
+    limits = limit_stats.as_dict()
+    out.add("commands_allowed_total", "counter", "Принятые команды", limits["allowed"])
+    for command, count in limits["throttled"].items():
+        out.add("commands_throttled_total", "counter", "Отклонённые по частоте команды", count, {"command": command})
+
+    codecs = codec_stats()
+    for name, description, key in CODEC_METRICS:
+        for codec, data in codecs.items():
+            out.add(name, "counter", description, data[key], {"codec": codec})
+
+    for stage, seconds in profile.as_dict().items():
+        out.add("startup_seconds", "gauge", "Длительность этапов запуска", seconds, {"stage": stage})
+
+    if manager.remote is not None:
+        remote = manager.remote.stats()
+        out.add("solver_process_up", "gauge", "Процесс решателя работает", remote["alive"] and not remote["failed"])
+        out.add("solver_process_restarts_total", "counter", "Перезапуски процесса решателя", remote["restarts"])
+        out.add("solver_process_ping_seconds", "gauge", "Задержка ответа процесса решателя на пинг", remote["latency"])
+
+    snapshot = local_snapshot()
+    if snapshot is not None:
+        solver = snapshot["solver"]
+        out.add("requests_queued", "gauge", "Запросы в очереди решателя (requests_queue)", solver["queued_requests"])
+        out.add("products_waiting", "gauge", "Товары, ожидающие отбора (requests_in_wait)", solver["waiting_products"])
+        out.add("positions_waiting", "gauge", "Позиции, ожидающие отбора", solver["waiting_positions"])
+        out.add("products_processing", "gauge", "Товары в обработке (requests_in_process)",
+                solver["processing_products"])
+        out.add("positions_processing", "gauge", "Позиции в обработке", solver["processing_positions"])
+        out.add("routes_in_flight", "gauge", "Маршруты, которые сейчас строятся", solver["in_flight"])
+        out.add("routes_reserved", "gauge", "Выданные маршруты с резервом товара", solver["reserved_routes"])
+
+        executor = solver["executor"]
+        out.add("executor_workers", "gauge", "Размер пула потоков решателя", executor["max_workers"])
+        out.add("executor_active", "gauge", "Выполняющиеся задачи пула потоков", executor["active"])
+        out.add("executor_queued", "gauge", "Задачи пула потоков в очереди", executor["queued"])
+        out.add("executor_utilisation", "gauge", "Доля занятых потоков пула", executor["utilisation"])
+        out.add("executor_completed_total", "counter", "Выполненные задачи пула потоков", executor["completed"])
+        out.add("executor_busy_seconds_total", "counter", "Суммарное время работы задач пула", executor["busy_time"])
+
+        out.histogram("solve_latency_seconds", "Время от постановки запроса до первого маршрута",
+                      solver["solve_latency"])
+        out.histogram("route_build_seconds", "Полное время построения маршрута, включая улучшения",
+                      solver["route_latency"])
+
+        locks = solver["locks"]
+        out.add("state_lock_acquisitions_total", "counter", "Захваты блокировок состояния товаров",
+                locks.get("acquisitions"))
+        out.add("state_lock_contended_total", "counter", "Захваты блокировок с ожиданием", locks.get("contended"))
+
+        for name, kind, description, key in POOL_METRICS:
+            for pool, data in snapshot["db"].items():
+                out.add(name, kind, description, data.get(key), {"pool": pool})
+
+        journal = snapshot["journal"]
+        out.add("journal_pending", "gauge", "Несброшенные изменения остатков", journal["pending"])
+        out.add("journal_flushes_total", "counter", "Сбросы журнала остатков в БД", journal["flushes"])
+
+        precompute = snapshot["precompute"]
+        out.add("precompute_hits_total", "counter", "Попадания в кэш предвычисленных данных", precompute["hits"])
+        out.add("precompute_misses_total", "counter", "Промахи кэша предвычисленных данных", precompute["misses"])
+
+    return out.render()
+
+
+def health() -> tuple[bool, dict]:
+    """
+    Проверка готовности: склад загружен и подключение к БД создано,
+    а в режиме отдельного процесса решателя - процесс жив и отвечает.
+    """
+    if manager.remote is not None:
+        remote = manager.remote.stats()
+        checks = {"solver_process": remote["alive"] and not remote["failed"]}
+    else:
+        checks = {"database": db.initialised, "warehouse": manager.loaded}
+    return all(checks.values()), checks
+
+
+def process_request(connection, request):
+    """
+    Обработчик HTTP-запроса до рукопожатия websocket (параметр process_request у websockets.serve).
+
+    :return: HTTP-ответ для /healthz и /metrics или None, чтобы продолжить рукопожатие.
+    """
+    if request.headers.get("Upgrade", "").lower() == "websocket":
+        return None
+
+    path = request.path.split('?', 1)[0]
+    try:
+        if path == "/healthz":
+            healthy, checks = health()
+            status = HTTPStatus.OK if healthy else HTTPStatus.SERVICE_UNAVAILABLE
+            response = connection.respond(status, json.dumps({"status": "ok" if healthy else "fail", "checks": checks}))
+            content_type = "application/json"
+        elif path == "/metrics":
+            response = connection.respond(HTTPStatus.OK, render_metrics())
+            content_type = PROMETHEUS_CONTENT_TYPE
+        else:
+            return connection.respond(HTTPStatus.NOT_FOUND, "Not found\n")
+    except Exception as e:
+        logging.error(f"Ошибка при формировании ответа {path}: {e}")
+        return connection.respond(HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error\n")
+
+    del response.headers["Content-Type"]
+    response.headers["Content-Type"] = content_type
+    return response
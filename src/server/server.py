@@ -2,64 +2,97 @@ import asyncio
 import logging
 
 import websockets
-import json
 import random
 from websockets.asyncio.server import ServerConnection
 from websockets.exceptions import ConnectionClosed
 
+from src.algorithm.outbox import RouteUpdate
 from src.parsers.json_parser import manager
 from src.exceptions.parser_exceptions import ExecutionError
+from src.logging.logger import sampled
 from src.parsers.config_parser import config
+from src.server.broadcast import TopicHub, hub
+from src.server.codec import Route, decode, negotiated
+from src.server.limits import RateLimiter
 
+# Записи на каждое сообщение ограничиваются по частоте
+messages_log = sampled(__name__)
 # Хранение подключённых клиентов
 connected_clients = set()
+# Получатель маршрутов ленты в outbox
+ROUTE_FEED = "route_feed"
+# Тема, на которую клиент подписывается при подключении (прежнее поведение сервера)
+DEFAULT_TOPIC = "routes"
+# Пауза между запросами тестовой ленты
+FEED_INTERVAL = 1
+# Как часто сверяется состояние решателя для темы solver (событие отправляется только при изменении)
+STATUS_INTERVAL = 0.5
 
 
 async def server_handler(websocket: ServerConnection) -> None:
     """
     Обрабатывает подключение WebSocket-клиента.
+    Все сообщения клиенту идут через его ограниченную очередь в рассылке, входящие команды
+    ограничиваются по частоте отдельно для каждого типа команды.
 
     :param websocket: Объект подключения клиента.
     """
     connected_clients.add(websocket)  # Добавляем клиента в список подключённых
-    logging.info(f"Клиент {websocket.id} подключился")
-    # Запуск фоновой задачи для отправки статуса сервера клиенту
-    asyncio.create_task(send_request(websocket))
+    # Формат сообщений согласован при подключении (подпротокол websocket), по умолчанию - JSON
+    codec = negotiated(websocket)
+    logging.info(f"Клиент {websocket.id} подключился (формат сообщений: {codec.name})")
+    limiter = RateLimiter(set(manager.namespace))
+    # Подписка клиента на общую ленту маршрутов, остальные темы - командой subscribe
+    hub.connect(websocket)
+    hub.subscribe(websocket, DEFAULT_TOPIC)
 
     try:
         # Чтение сообщений от клиента
         async for message in websocket:
-            # Парсинг JSON-сообщения
-            data = json.loads(message)
-            logging.info(f"Сервер принял сообщение")
+            # Разбор сообщения: текстовые кадры - JSON, бинарные - согласованный формат
+            data = decode(codec, message)
+            messages_log.info("Сервер принял сообщение")
 
-            if 'auth' not in data or data['auth'] != config.wsauth.get_secret_value():
-                await websocket.send(json.dumps(
-                    {
-                        "type": "response",
-                        "code": 401,
-                        "status": "error",
-                        "message": "Не авторизован"
+            command = data.get('type')
+            retry_after = limiter.check(command)
+            if retry_after:
+                # Повторные отказы по одной команде схлопываются в очереди клиента в один ответ
+                hub.send(websocket, {
+                    "type": "response",
+                    "code": 429,
+                    "status": "error",
+                    "message": "Слишком много запросов",
+                    "data": {
+                        "command": command,
+                        "retry_after": round(retry_after, 3)
                     }
-                ))
+                }, key=("throttled", command))
+                continue
+
+            if 'auth' not in data or data['auth'] != config.wsauth.get_secret_value():
+                hub.send(websocket, {
+                    "type": "response",
+                    "code": 401,
+                    "status": "error",
+                    "message": "Не авторизован"
+                })
                 continue
 
             try:
                 if 'type' not in data:
-                    await websocket.send(json.dumps(
-                        {
-                            "type": "response",
-                            "code": 100,
-                            "status": "ok"
-                        }
-                    ))
+                    hub.send(websocket, {
+                        "type": "response",
+                        "code": 100,
+                        "status": "ok"
+                    })
                     continue
 
                 data['websocket'] = websocket
                 response = await manager.execute(data)
                 if response is not None:
-                    await websocket.send(json.dumps(response))
-                    logging.debug("Сервер ответил")
+                    if not hub.send(websocket, response):
+                        break
+                    messages_log.debug("Сервер ответил")
             except Exception as e:
                 logging.error(f"Ошибка обработки на стороне сервера {e}")
                 response = {
@@ -68,7 +101,7 @@ async def server_handler(websocket: ServerConnection) -> None:
                     "code": 500,
                     "message": "Фатальная ошибка на стороне сервера"
                 }
-                await websocket.send(json.dumps(response))
+                hub.send(websocket, response)
 
     except ConnectionClosed:
         # Обработка ситуации, когда клиент разорвал соединение
@@ -78,46 +111,151 @@ async def server_handler(websocket: ServerConnection) -> None:
     finally:
         # Удаляем клиента из списка подключённых
         logging.info(f"Клиент {websocket.id} отключился")
+        hub.disconnect(websocket)
         connected_clients.remove(websocket)
 
 
-async def send_request(websocket: ServerConnection) -> None:
+async def submit_requests(worker_id) -> None:
     """
-    Периодически отправляет клиенту обновлённое состояние сервера.
+    Ставит запросы от имени получателя: следующий запрос ставится не раньше чем через FEED_INTERVAL секунд
+    после того, как для предыдущего построен маршрут.
 
-    :param websocket: Объект подключения клиента.
+    :param worker_id: Идентификатор получателя маршрутов в outbox.
     """
     while True:
         try:
-            # Выполнение запроса для получения данных сервера
-            data = await manager.execute({"type": "run"})
+            await manager.execute({"type": "run", "worker_id": worker_id})
+        except Exception as e:
+            logging.error(f"Ошибка при постановке запроса: {e}")
+        await asyncio.sleep(FEED_INTERVAL)
 
-            if data is None or not data:
-                await asyncio.sleep(1)
-                continue
 
-            # Формирование и отправка сообщения клиенту
-            products = list()
-            for _ in range(len(list(filter(lambda x: 'product' == x[2], data)))):
-                products.append((random.choice(manager.warehouse.get_all_products()), random.randint(1, 20)))
-
-            message = {
-                "type": "request",
-                "message": "Неофициальный результат тестирования",
-                "data": {
-                    "worker_id": "Вадим Зачесов",
-                    "moving_cells": [data],
-                    "selected_products": {product.name: count for product, count in products}
-                }
+def route_message(update: RouteUpdate) -> dict:
+    """
+    Формирует сообщение клиенту с версией маршрута.
+    """
+    data = update.route
+    catalogue = manager.warehouse.catalogue.products()
+
+    products = list()
+    for _ in range(len(list(filter(lambda x: 'product' == x[2], data)))):
+        products.append((random.choice(catalogue), random.randint(1, 20)))
+
+    return {
+        "type": "request",
+        "message": "Неофициальный результат тестирования",
+        "data": {
+            "worker_id": "Вадим Зачесов",
+            "route_id": update.route_id,
+            "version": update.version,
+            "moving_cells": [Route(data)],
+            "selected_products": {product.name: count for product, count in products}
+        }
+    }
+
+
+async def produce_routes(feed: TopicHub, topic: str) -> None:
+    """
+    Источник тем маршрутов. Для темы `routes` сам ставит запросы и публикует каждую построенную версию
+    маршрута один раз для всех подписчиков; для темы `routes.<worker_id>` пересылает маршруты,
+    построенные по запросам этого работника.
+    В anytime-режиме для одного маршрута приходит несколько версий: каждая следующая короче предыдущей.
+
+    :param feed: Рассылка, в которую публикуются маршруты.
+    :param topic: Тема маршрутов.
+    """
+    worker_id = topic.split('.', 1)[1] if '.' in topic else ROUTE_FEED
+    outbox = manager.warehouse.solver.outbox
+    updates = outbox.channel(worker_id)
+    submitter = None
+    if worker_id == ROUTE_FEED:
+        # Маршруты ленты никто не подтверждает, поэтому резерв под них снимается по короткому таймауту
+        manager.warehouse.solver.unconfirmed_workers.add(ROUTE_FEED)
+        submitter = asyncio.create_task(submit_requests(ROUTE_FEED))
+
+    try:
+        while True:
+            try:
+                # Ожидание очередной версии маршрута
+                update = await updates.get()
+                receivers = feed.publish(topic, route_message(update))
+                messages_log.debug(f"Версия {update.version} маршрута {update.route_id} отправлена {receivers} клиентам")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка при формировании сообщения: {e}")
+    finally:
+        if submitter is not None:
+            submitter.cancel()
+            manager.warehouse.solver.unconfirmed_workers.discard(ROUTE_FEED)
+        outbox.close_channel(worker_id)
+
+
+async def produce_inventory(feed: TopicHub, topic: str) -> None:
+    """
+    Источник темы inventory: изменения остатков в ячейках.
+    Изменения приходят из любых потоков и объединяются до ближайшей итерации event loop,
+    так что серия списаний по одному маршруту уходит одним событием.
+    """
+    loop = asyncio.get_running_loop()
+    state = manager.warehouse.state
+    pending = dict()
+
+    def flush() -> None:
+        changes = dict(pending)
+        pending.clear()
+        feed.publish(topic, {
+            "type": "event",
+            "data": {
+                "cells": [
+                    {"cell_id": cell_id, "count": count, "product_sku": sku}
+                    for cell_id, (count, sku) in changes.items()
+                ]
             }
-            await websocket.send(json.dumps(message))
-            logging.debug(f"Сервер отправил сообщение клиенту {websocket.id}")
+        })
 
-        except ConnectionClosed:
-            logging.info(f"Клиент {websocket.id} отключился")
-            break
-        except Exception as e:
-            # Логирование ошибок при отправке сообщения
-            logging.error(f"Ошибка при отправке сообщения: {e}")
-        finally:
-            await asyncio.sleep(1)
+    def collect(changes: dict) -> None:
+        scheduled = bool(pending)
+        pending.update(changes)
+        if not scheduled:
+            loop.call_soon(flush)
+
+    def observer(changes: dict) -> None:
+        loop.call_soon_threadsafe(collect, changes)
+
+    state.observe(observer)
+    try:
+        await asyncio.Future()
+    finally:
+        state.unobserve(observer)
+
+
+async def produce_status(feed: TopicHub, topic: str) -> None:
+    """
+    Источник темы solver: состояние решателя. Публикуется только при изменении.
+    """
+    solver = manager.warehouse.solver
+    last = None
+    while True:
+        status = solver.status()
+        if status != last:
+            feed.publish(topic, {"type": "event", "data": status})
+            last = status
+        await asyncio.sleep(STATUS_INTERVAL)
+
+
+# Допустимые параметры тем: routes.<worker_id>; у inventory и solver параметров нет
+TOPIC_PARAMETERS = {
+    "routes": r"[\w-]{1,64}"
+}
+
+# Источники тем рассылки. В режиме отдельного процесса решателя они запускаются в нём (см. src.server.solver_process)
+PRODUCERS = {
+    "routes": produce_routes,
+    "inventory": produce_inventory,
+    "solver": produce_status
+}
+
+for prefix, producer in PRODUCERS.items():
+    # Для состояния решателя клиенту важно только последнее значение
+    hub.source(prefix, producer, coalesce=prefix == "solver", parameter=TOPIC_PARAMETERS.get(prefix))
@@ -0,0 +1,439 @@
+"""
+Режим отдельного процесса решателя.
+
+Сервер websocket, разбор сообщений и рассылка остаются в основном процессе (front end), а склад,
+обращения к БД и генетический алгоритм работают в дочернем процессе, который владеет состоянием Algorithm.
+Тяжёлый расчёт маршрута больше не делит GIL с циклом событий сервера и не задерживает ответы клиентам.
+
+Процессы обмениваются кортежами через multiprocessing.Pipe:
+
+    front -> решатель: ("call", call_id, команда, подпротокол), ("subscribe", тема), ("unsubscribe", тема),
+                       ("ping", номер, время), ("stop",)
+    решатель -> front: ("ready", pid), ("result", call_id, ответ, будут ли ещё сообщения), ("error", call_id, текст),
+                       ("send", call_id, сообщение клиенту, ключ схлопывания), ("release", call_id),
+                       ("publish", тема, событие), ("pong", номер, время пинга, показатели решателя)
+
+Сообщения клиенту могут идти и после ответа на команду (маршруты по заказам submit_orders): тогда в ответе
+это отмечено, и основной процесс помнит клиента команды до сообщения ("release", call_id).
+
+Основной процесс проверяет решатель пингом раз в `interval` секунд и перезапускает его, если процесс
+завершился или не отвечает дольше `timeout`. Перезапуски идут с нарастающей задержкой; если за `window`
+секунд их набралось больше `max_restarts`, попытки прекращаются и команды решателю получают ответ 503.
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from collections.abc import Hashable
+from multiprocessing.connection import Connection
+from typing import Optional, Union
+
+from src.server.broadcast import hub
+
+# Команды, которые выполняются в основном процессе: они работают с подключением клиента и рассылкой
+LOCAL_COMMANDS = {"subscribe", "unsubscribe", "server_status"}
+# Максимальная задержка перед перезапуском процесса решателя (секунды)
+MAX_BACKOFF = 30.0
+
+
+def unavailable(message: str) -> dict:
+    return {
+        "type": "response",
+        "code": 503,
+        "status": "error",
+        "message": message
+    }
+
+
+class SolverProcess:
+    """
+    Дочерний процесс решателя со стороны основного процесса: запуск, вызов команд, пересылка тем рассылки,
+    проверка живости и политика перезапуска.
+    """
+
+    def __init__(self, interval: float = 5, timeout: float = 30, max_restarts: int = 5, window: float = 5 * 60):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self.window = window
+
+        self.process: Optional[multiprocessing.Process] = None
+        self.failed = False
+        self.restarts = 0
+        # Показатели процесса решателя из последнего ответа на пинг (см. src.server.metrics.solver_snapshot)
+        self.snapshot: dict = dict()
+        self.latency: Optional[float] = None
+
+        self._context = multiprocessing.get_context('spawn')
+        self._conn: Optional[Connection] = None
+        self._send_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._calls: dict[int, tuple[asyncio.Future, object]] = dict()
+        # Клиент каждой команды: сообщения ему могут приходить и после ответа (например, маршруты по заказам)
+        self._clients: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._call_ids = itertools.count(1)
+        self._pings = itertools.count(1)
+        self._last_pong = 0.0
+        self._restart_times: deque[float] = deque()
+        # Темы, источники которых сейчас работают в процессе решателя, и рассылка, куда идут их события
+        self._topics: dict[str, object] = dict()
+        self._monitor: Optional[asyncio.Task] = None
+        self._restarting = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    async def start(self) -> None:
+        """
+        Запускает процесс решателя и ждёт, пока он загрузит склад и выполнит кластеризацию.
+        """
+        self._loop = asyncio.get_running_loop()
+        await self._spawn()
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+        if self.alive:
+            try:
+                await self._send(("stop",))
+            except (OSError, EOFError):
+                pass
+            await self._loop.run_in_executor(None, self.process.join, 10)
+        if self.alive:
+            self.process.terminate()
+        self._close()
+
+    async def _spawn(self) -> None:
+        parent, child = self._context.Pipe()
+        self._conn = parent
+        self._ready = asyncio.Event()
+        self.process = self._context.Process(target=serve, args=(child,), name="solver", daemon=True)
+        self.process.start()
+        child.close()
+        threading.Thread(target=self._read, args=(parent, self.process), daemon=True).start()
+        logging.info(f"Запущен процесс решателя (pid {self.process.pid})")
+
+        # Загрузка склада в дочернем процессе может занимать заметное время, поэтому ждём без таймаута,
+        # но прекращаем ожидание, если процесс завершился раньше
+        while not self._ready.is_set():
+            if not self.alive:
+                raise RuntimeError(f"Процесс решателя завершился при запуске (код {self.process.exitcode})")
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self._last_pong = time.monotonic()
+
+        for topic in self._topics:
+            await self._send(("subscribe", topic))
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _send(self, message: tuple) -> None:
+        conn = self._conn
+        if conn is None:
+            raise OSError("Нет соединения с процессом решателя")
+
+        def send() -> None:
+            with self._send_lock:
+                conn.send(message)
+
+        # Команды (например, карта склада) бывают большими: запись в канал не должна блокировать цикл событий
+        await self._loop.run_in_executor(None, send)
+
+    def _read(self, conn: Connection, process: multiprocessing.Process) -> None:
+        # Поток чтения ответов решателя: сообщения передаются в цикл событий основного процесса
+        try:
+            while True:
+                message = conn.recv()
+                self._loop.call_soon_threadsafe(self._dispatch, message)
+        except (EOFError, OSError):
+            logging.debug(f"Канал процесса решателя (pid {process.pid}) закрыт")
+
+    def _dispatch(self, message: tuple) -> None:
+        kind = message[0]
+        if kind == "ready":
+            self._ready.set()
+        elif kind == "result" or kind == "error":
+            call = self._calls.pop(message[1], None)
+            if kind == "error" or not message[3]:
+                self._clients.pop(message[1], None)
+            if call is None or call[0].done():
+                return
+            if kind == "result":
+                call[0].set_result(message[2])
+            else:
+                call[0].set_exception(RuntimeError(message[2]))
+        elif kind == "send":
+            websocket = self._clients.get(message[1])
+            if websocket is not None:
+                hub.send(websocket, message[2], message[3])
+        elif kind == "release":
+            self._clients.pop(message[1], None)
+        elif kind == "publish":
+            feed = self._topics.get(message[1])
+            if feed is not None:
+                feed.publish(message[1], message[2])
+        elif kind == "pong":
+            self._last_pong = time.monotonic()
+            self.latency = self._last_pong - message[2]
+            self.snapshot = message[3]
+
+    async def execute(self, data: dict) -> Union[dict, list, None]:
+        """
+        Выполняет команду в процессе решателя и возвращает ответ для клиента.
+        Сообщения о ходе операции пересылаются клиенту напрямую.
+        """
+        if self.failed:
+            return unavailable("Процесс решателя остановлен после многократных сбоев")
+        if self._restarting or not self.alive:
+            return unavailable("Процесс решателя перезапускается, повторите запрос позже")
+
+        websocket = data.pop('websocket', None)
+        data.pop('warehouse', None)
+        call_id = next(self._call_ids)
+        future = self._loop.create_future()
+        self._calls[call_id] = (future, websocket)
+        if websocket is not None:
+            self._clients[call_id] = websocket
+        try:
+            await self._send(("call", call_id, data, getattr(websocket, 'subprotocol', None)))
+            return await future
+        except (OSError, EOFError):
+            self._clients.pop(call_id, None)
+            return unavailable("Нет соединения с процессом решателя")
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def producer(self, feed, topic: str) -> None:
+        """
+        Источник тем рассылки основного процесса: сам источник работает в процессе решателя,
+        а его события публикуются здесь. Подходит для TopicHub.source.
+        """
+        self._topics[topic] = feed
+        try:
+            if self.alive and not self._restarting:
+                await self._send(("subscribe", topic))
+            await asyncio.Future()
+        finally:
+            self._topics.pop(topic, None)
+            if self.alive and not self._restarting:
+                try:
+                    await self._send(("unsubscribe", topic))
+                except (OSError, EOFError):
+                    pass
+
+    async def _watch(self) -> None:
+        while not self.failed:
+            await asyncio.sleep(self.interval)
+            if not self.alive:
+                await self._restart(f"процесс завершился (код {self.process.exitcode})")
+            elif time.monotonic() - self._last_pong > self.timeout:
+                await self._restart(f"нет ответа дольше {self.timeout} с")
+            else:
+                try:
+                    await self._send(("ping", next(self._pings), time.monotonic()))
+                except (OSError, EOFError):
+                    await self._restart("канал связи закрыт")
+
+    async def _restart(self, reason: str) -> None:
+        logging.error(f"Процесс решателя (pid {self.process.pid}) будет перезапущен: {reason}")
+        self._restarting = True
+        try:
+            if self.alive:
+                self.process.kill()
+                await self._loop.run_in_executor(None, self.process.join, 5)
+            self._close()
+            for future, _ in self._calls.values():
+                if not future.done():
+                    future.set_result(unavailable("Процесс решателя перезапущен, запрос не выполнен"))
+            self._calls.clear()
+            # Фоновая отправка сообщений клиентам погибла вместе с процессом
+            self._clients.clear()
+
+            now = time.monotonic()
+            self._restart_times.append(now)
+            while self._restart_times and now - self._restart_times[0] > self.window:
+                self._restart_times.popleft()
+            if len(self._restart_times) > self.max_restarts:
+                self.failed = True
+                logging.critical(f"Процесс решателя перезапускался {len(self._restart_times)} раз за "
+                                 f"{self.window} с, перезапуски прекращены")
+                return
+
+            await asyncio.sleep(min(MAX_BACKOFF, 2 ** (len(self._restart_times) - 1)))
+            self.restarts += 1
+            try:
+                await self._spawn()
+            except RuntimeError as e:
+                logging.error(str(e))
+        finally:
+            self._restarting = False
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "latency": self.latency,
+            "pending_calls": len(self._calls),
+            "topics": sorted(self._topics),
+            "solver": self.snapshot.get("solver")
+        }
+
+
+class ClientProxy:
+    """
+    Подключение клиента со стороны процесса решателя: сообщения, которые обработчик команды отправляет
+    клиенту (например, прогресс построения склада), пересылаются в очередь клиента в основном процессе.
+    """
+
+    def __init__(self, service: 'SolverService', call_id: int, subprotocol: Optional[str]):
+        self.service = service
+        self.id = call_id
+        self.subprotocol = subprotocol
+        self.finished = False
+        self._streams = 0
+
+    def relay(self, message: dict, key: Optional[Hashable] = None) -> None:
+        self.service.send(("send", self.id, message, key))
+
+    def keep(self, task: asyncio.Task) -> None:
+        """
+        Отмечает задачу, которая будет отправлять клиенту сообщения и после ответа на команду.
+        Когда завершится последняя такая задача, основной процесс забудет клиента команды.
+        """
+        self._streams += 1
+        task.add_done_callback(self._stream_done)
+
+    @property
+    def streaming(self) -> bool:
+        return self._streams > 0
+
+    def _stream_done(self, _: asyncio.Task) -> None:
+        self._streams -= 1
+        if self.finished and not self._streams:
+            self.service.send(("release", self.id))
+
+
+class RemoteFeed:
+    """
+    Рассылка со стороны процесса решателя: источники тем публикуют события в основной процесс.
+    """
+
+    def __init__(self, service: 'SolverService'):
+        self.service = service
+
+    def publish(self, topic: str, message: dict) -> int:
+        self.service.send(("publish", topic, message))
+        return 1
+
+
+class SolverService:
+    """
+    Процесс решателя: выполняет команды через ParserManager и запускает источники тем по запросу основного процесса.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._tasks: dict[str, asyncio.Task] = dict()
+        self._stopped: Optional[asyncio.Future] = None
+
+    def send(self, message: tuple) -> None:
+        with self._lock:
+            self.conn.send(message)
+
+    async def run(self) -> None:
+        from src.parsers.db_parser import db
+        from src.parsers.json_parser import manager
+
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+
+        db.get()
+        await manager.warehouse.solver.start()
+        self.send(("ready", os.getpid()))
+        logging.info(f"Процесс решателя готов (pid {os.getpid()})")
+
+        threading.Thread(target=self._read, args=(loop,), daemon=True).start()
+        try:
+            await self._stopped
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            manager.warehouse.state.stop()
+            await db.dispose()
+
+    def _read(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            while True:
+                message = self.conn.recv()
+                loop.call_soon_threadsafe(self._dispatch, message)
+        except (EOFError, OSError):
+            logging.warning("Основной процесс закрыл канал, процесс решателя завершается")
+        loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self) -> None:
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def _dispatch(self, message: tuple) -> None:
+        from src.server.metrics import solver_snapshot
+        from src.server.server import PRODUCERS
+
+        kind = message[0]
+        if kind == "call":
+            asyncio.create_task(self._call(*message[1:]))
+        elif kind == "subscribe":
+            topic = message[1]
+            producer = PRODUCERS.get(topic.split('.', 1)[0])
+            if producer is not None and (topic not in self._tasks or self._tasks[topic].done()):
+                self._tasks[topic] = asyncio.create_task(producer(RemoteFeed(self), topic))
+        elif kind == "unsubscribe":
+            task = self._tasks.pop(message[1], None)
+            if task is not None:
+                task.cancel()
+        elif kind == "ping":
+            self.send(("pong", message[1], message[2], solver_snapshot()))
+        elif kind == "stop":
+            self._stop()
+
+    async def _call(self, call_id: int, data: dict, subprotocol: Optional[str]) -> None:
+        from src.parsers.json_parser import manager
+
+        client = data['websocket'] = ClientProxy(self, call_id, subprotocol)
+        try:
+            response = await manager.execute(data)
+        except Exception as e:
+            logging.error(f"Ошибка выполнения команды в процессе решателя: {e}")
+            self.send(("error", call_id, str(e)))
+            return
+        finally:
+            client.finished = True
+        try:
+            self.send(("result", call_id, response, client.streaming))
+        except Exception as e:
+            # Например, ответ не сериализуется: основной процесс не должен ждать его вечно
+            self.send(("error", call_id, str(e)))
+
+
+def serve(conn: Connection) -> None:
+    """
+    Точка входа процесса решателя.
+    """
+    import src.logging.logger
+
+    asyncio.run(SolverService(conn).run())
@@ -0,0 +1,59 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Момент начала запуска процесса: модуль импортируется первым в main.py
+STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    """
+    Разбивка времени запуска сервера по этапам: импорт модулей, подключение к БД и проверка схемы,
+    загрузка склада, кластеризация. Итог пишется в лог одной строкой после старта сервера.
+    """
+
+    def __init__(self, started: float = STARTED):
+        self.started = started
+        self.stages: dict[str, float] = dict()
+        self._last = started
+        # Полное время запуска, фиксируется один раз в report()
+        self.finished: Optional[float] = None
+
+    def mark(self, stage: str) -> float:
+        """
+        Засчитывает этапу время, прошедшее с предыдущей отметки.
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+        self._last = now
+        return elapsed
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        self._last = time.perf_counter()
+        try:
+            yield
+        finally:
+            logging.debug(f"Этап запуска '{stage}' занял {self.mark(stage):.3f} с")
+
+    def total(self) -> float:
+        """
+        Время запуска: зафиксированное в report() или, пока запуск не завершён, прошедшее с его начала.
+        """
+        if self.finished is not None:
+            return self.finished
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict[str, float]:
+        return {**self.stages, "total": self.total()}
+
+    def report(self) -> None:
+        if self.finished is None:
+            self.finished = time.perf_counter() - self.started
+        parts = ", ".join(f"{stage} {elapsed:.3f} с" for stage, elapsed in self.stages.items())
+        logging.info(f"Запуск занял {self.finished:.3f} с: {parts}")
+
+
+profile = StartupProfile()